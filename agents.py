@@ -0,0 +1,290 @@
+import collections
+import concurrent.futures
+import math
+import random
+import time
+from typing import Any, Callable, Iterable
+import engine
+
+
+class RandomDecisionProvider(engine.DecisionProvider):
+    """
+    Picks uniformly among the offered options.
+    """
+    def __init__(self, seed = None):
+        self.random = random.Random(seed)
+
+    def choose(self, kind: str, options: list, game: engine.Game) -> Any:
+        return self.random.choice(options)
+
+
+class ScriptedDecisionProvider(engine.DecisionProvider):
+    """
+    Answers with a fixed sequence of selections, e.g. to reproduce a game.
+    Once the script is exhausted, the fallback provider takes over, if one is given.
+    """
+    def __init__(self, script: Iterable[Any], fallback: engine.DecisionProvider = None):
+        self.script = iter(script)
+        self.fallback = fallback
+
+    def choose(self, kind: str, options: list, game: engine.Game) -> Any:
+        try:
+            return next(self.script)
+        except StopIteration:
+            if self.fallback is None:
+                raise RuntimeError(f'Script exhausted while waiting for a {kind} selection')
+            return self.fallback.choose(kind, options, game)
+
+
+class StopSimulation(Exception):
+    """
+    Ends a simulated game early, once the rollout has reached its depth.
+    """
+
+
+class MCTSNode:
+    """
+    A decision point in the search tree. Statistics are kept per option, from the view of the deciding player.
+    """
+    __slots__ = ('player', 'visits', 'stats', 'next')
+
+    def __init__(self, player: int):
+        self.player = player
+        self.visits = 0
+        self.stats = {} # option key -> [visits, total value]
+        self.next = {} # option key -> node of the following decision within the same activation
+
+
+def option_key(option) -> Any:
+    """
+    Returns a picklable key of an option, which stays the same across restores and processes.
+    """
+    if isinstance(option, engine.Piece):
+        return ('piece', option.roster_index)
+    if isinstance(option, list):
+        return tuple(option)
+    return option
+
+
+def mcts_search(game: engine.Game, searcher: 'MCTSDecisionProvider', iterations: int = None, time_budget: float = None) -> MCTSNode:
+    """
+    Runs simulations from the current state of the game, which must be at the start of an activation.
+    Returns the root node of the search.
+    """
+    snapshot = game.snapshot()
+    simulation_state = game.snapshot(include_random=False)
+    real_api = game.api
+    # The simulation API takes over the double pointers of the game and the rules until the search ends
+    engine.HeadlessAPI(game, game.rules, searcher.simulation)
+    root = searcher.node_for_state(game, game.board.hash)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    try:
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time.perf_counter() < deadline):
+            game.restore(simulation_state)
+            searcher.simulation.start()
+            try:
+                game.run_headless()
+            except StopSimulation:
+                pass
+            searcher.backpropagate(searcher.evaluate(game))
+            done += 1
+        searcher.simulations += done
+    finally:
+        game.restore(snapshot)
+        game.api = real_api
+        game.rules.set_api(real_api)
+    return root
+
+
+def mcts_search_worker(game_factory: Callable[[], engine.Game], snapshot: engine.GameSnapshot, settings: dict,
+                       seed: int, iterations: int, time_budget: float) -> MCTSNode:
+    """
+    Root parallel search in a worker process: rebuilds the game, restores the state and searches independently.
+    """
+    game = game_factory()
+    game.restore(snapshot)
+    searcher = MCTSDecisionProvider(seed=seed, **settings)
+    return mcts_search(game, searcher, iterations, time_budget)
+
+
+class MCTSDecisionProvider(engine.DecisionProvider):
+    """
+    Monte Carlo tree search over the decisions of the game, played through the real rules.
+
+    At the start of an activation, the provider restores the game to the current state many times and plays
+    it on through a simulation API: inside the tree, options are picked by UCT, beyond it at random.
+    Rollouts stop after rollout_activations activations and are scored by the share of surviving units.
+    The decisions within the activation follow the most visited options of the search.
+
+    Decision points at the start of activations are shared through a transposition table keyed
+    by the Zobrist hash of the board, so different orders of play reaching the same position pool their statistics.
+
+    iterations, time_budget: Budget of each search, in simulations or seconds. The first one reached ends it
+    workers: Number of processes for root parallel search. Requires a game_factory, which sets up 
+             an identical game in the worker, e.g. functools.partial(selfplay.setup_game, seed)
+    """
+    def __init__(self, seed = None, iterations: int = None, time_budget: float = 0.1, exploration: float = 1.4,
+                 rollout_activations: int = 8, max_table_size: int = 100000, workers: int = 1,
+                 game_factory: Callable[[], engine.Game] = None):
+        assert iterations is not None or time_budget is not None, 'The search needs an iteration or time budget'
+        assert workers == 1 or game_factory is not None, 'Root parallel search needs a game factory'
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.exploration = exploration
+        self.rollout_activations = rollout_activations
+        self.max_table_size = max_table_size
+        self.workers = workers
+        self.game_factory = game_factory
+        self.pool = None
+
+        self.table = collections.OrderedDict() # board hash -> MCTSNode at the start of an activation, in LRU order
+        self.simulation = MCTSSimulationProvider(self)
+        self.plan = None # Node of the next decision within the current activation
+        self.simulations = 0
+
+    def settings(self) -> dict:
+        return {'exploration': self.exploration, 'rollout_activations': self.rollout_activations,
+                'max_table_size': self.max_table_size, 'iterations': self.iterations, 'time_budget': self.time_budget}
+
+    def node_for_state(self, game: engine.Game, key: int) -> MCTSNode:
+        """
+        Looks up the node of a position. A full table evicts its least recently used entry.
+        """
+        node = self.table.get(key)
+        if node is None:
+            if len(self.table) >= self.max_table_size:
+                self.table.popitem(last=False)
+            node = self.table[key] = MCTSNode(game.active_player)
+        else:
+            self.table.move_to_end(key)
+        return node
+
+    @staticmethod
+    def is_activation_start(kind: str, options: list, game: engine.Game) -> bool:
+        return kind == 'unit' and all(getattr(option, 'player', None) == game.active_player 
+                                      and not getattr(option, 'activated', True) for option in options)
+
+    def choose(self, kind: str, options: list, game: engine.Game) -> Any:
+        # Once the game is decided, the rest of the turn is played out without searching
+        if self.is_activation_start(kind, options, game) and not game.rules.check_game_over():
+            roots = self.search(game)
+            visits = {}
+            for root in roots:
+                for key, stats in root.stats.items():
+                    visits[key] = visits.get(key, 0) + stats[0]
+            choice = max(options, key=lambda option: (visits.get(option_key(option), 0), self.random.random()))
+            # The rest of the activation follows the tree of the search that explored the choice most
+            key = option_key(choice)
+            best = max(roots, key=lambda root: root.stats.get(key, (0,))[0])
+            self.plan = best.next.get(key)
+            return choice
+
+        # Within an activation, follow the most visited options of the search
+        node, self.plan = self.plan, None
+        if node is not None:
+            visited = [option for option in options if node.stats.get(option_key(option), (0,))[0] > 0]
+            if visited:
+                choice = max(visited, key=lambda option: node.stats[option_key(option)][0])
+                self.plan = node.next.get(option_key(choice))
+                return choice
+        return self.random.choice(options)
+
+    def search(self, game: engine.Game) -> list[MCTSNode]:
+        """
+        Returns the root nodes of the searches, one per worker.
+        """
+        if self.workers == 1:
+            return [mcts_search(game, self, self.iterations, self.time_budget)]
+
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        snapshot = game.snapshot(include_random=False)
+        settings = self.settings()
+        iterations, time_budget = settings.pop('iterations'), settings.pop('time_budget')
+        futures = [self.pool.submit(mcts_search_worker, self.game_factory, snapshot, settings,
+                                    self.random.randrange(2**31), iterations, time_budget)
+                   for _ in range(self.workers)]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def evaluate(self, game: engine.Game) -> dict[int, float]:
+        """
+        Returns the value of the simulated game for every player: 1 for a win, 0.5 for a draw and 0 for a loss.
+        Unfinished games are scored by the share of the surviving units of each player.
+        """
+        rules = game.rules
+        if rules.check_game_over():
+            winner = rules.determine_winner()
+            return {player: 0.5 if winner is None else float(player == winner) for player in game.players}
+        remaining = {player: len(rules.units(player)) for player in game.players}
+        total = sum(remaining.values()) or 1
+        return {player: count / total for player, count in remaining.items()}
+
+    def backpropagate(self, values: dict[int, float]):
+        for node, key in self.simulation.path:
+            node.visits += 1
+            stats = node.stats.setdefault(key, [0, 0.0])
+            stats[0] += 1
+            stats[1] += values[node.player]
+
+
+class MCTSSimulationProvider(engine.DecisionProvider):
+    """
+    Answers the decisions of both players in the simulations of an MCTSDecisionProvider.
+    """
+    def __init__(self, searcher: MCTSDecisionProvider):
+        self.searcher = searcher
+        self.path = []
+        self.in_tree = True
+        self.next_node = None
+        self.start_activations = 0
+
+    def start(self):
+        self.path = []
+        self.in_tree = True
+        self.next_node = None
+        self.start_activations = None
+
+    def choose(self, kind: str, options: list, game: engine.Game) -> Any:
+        searcher = self.searcher
+        activation_start = searcher.is_activation_start(kind, options, game)
+        if activation_start:
+            activations = game.rules.activations
+            if self.start_activations is None:
+                self.start_activations = activations
+            elif activations - self.start_activations >= searcher.rollout_activations:
+                raise StopSimulation()
+
+        if not self.in_tree:
+            return searcher.random.choice(options)
+
+        if activation_start:
+            node = searcher.node_for_state(game, game.board.hash)
+        else:
+            node = self.next_node
+            if node is None:
+                parent, parent_key = self.path[-1]
+                node = parent.next[parent_key] = MCTSNode(game.active_player)
+
+        # Options without statistics are tried first, in random order, and end the descent in the tree
+        untried = [option for option in options if option_key(option) not in node.stats]
+        if untried:
+            choice = searcher.random.choice(untried)
+            self.in_tree = False
+        else:
+            log_visits = math.log(max(node.visits, 1))
+            def uct(option):
+                visits, value = node.stats[option_key(option)]
+                return value / visits + searcher.exploration * math.sqrt(log_visits / visits)
+            choice = max(options, key=uct)
+        key = option_key(choice)
+        self.path.append((node, key))
+        self.next_node = node.next.get(key)
+        return choice
@@ -0,0 +1,263 @@
+"""
+Importer of OnePageRules army lists, as exported by Army Forge, e.g. army_lists/OPR_export/Saurian_testlist.json.
+
+The units of a list refer to their army book by armyId and version, to the unit entry by selectionId
+and to upgrades by (upgradeId, optionId), i.e. the section and option of an upgrade package.
+Army books are read from a local data directory, as {armyId}_{version}.json or {armyId}.json,
+in the Army Forge book format. army_lists/army_books holds a small fixture instead of the online data.
+
+Parsed books are compiled into unit templates and stored in a binary cache keyed by (armyId, version),
+which is validated against the modification time of the book. Lists resolve to unit profiles in the format of
+selfplay.ARMIES, so setting up the same armies many times builds the units from the profiles without any parsing.
+"""
+import json
+import logging
+import os
+import pickle
+
+import engine
+import onepagerules as opr
+
+
+ARMY_BOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'army_lists', 'army_books')
+CACHE_FORMAT_VERSION = 1
+
+# Movement of OPR units, and the changes by special rules
+DEFAULT_MOVEMENT = 6
+MOVEMENT_RULES = {'Fast': 2, 'Slow': -2}
+
+logger = logging.getLogger('army book logger')
+
+
+def rule_rating(rules: list[dict], name: str, default: int = None) -> int:
+    for rule in rules:
+        if rule['name'] == name:
+            return int(rule.get('rating', default if default is not None else 0))
+    return default
+
+
+def rule_label(rule: dict) -> str:
+    return f"{rule['name']}({rule['rating']})" if rule.get('rating') not in (None, '') else rule['name']
+
+
+def compile_weapon(equipment: dict) -> tuple:
+    """
+    Returns the (name, range, attacks, damage) of an OPRWeapon. Melee weapons have range 0 in army books,
+    but range 1 in the engine. Deadly(X) multiplies the damage of every unblocked hit.
+    """
+    rules = equipment.get('specialRules', [])
+    attacks = int(equipment['attacks']) * int(equipment.get('count', 1))
+    return equipment['name'], max(int(equipment.get('range', 0)), 1), attacks, rule_rating(rules, 'Deadly', 1)
+
+
+def compile_book(data: dict) -> dict:
+    """
+    Compiles an army book into unit templates and upgrade options, with everything resolved
+    that does not depend on the list.
+    """
+    units = {}
+    for unit in data['units']:
+        units[unit['id']] = {
+            'name': unit['name'],
+            'size': int(unit.get('size', 1)),
+            'quality': int(unit['quality']),
+            'defense': int(unit['defense']),
+            'rules': [{'name': rule['name'], 'rating': rule.get('rating')} for rule in unit.get('rules', [])],
+            'weapons': [compile_weapon(equipment) for equipment in unit.get('equipment', [])],
+        }
+    upgrades = {}
+    for package in data.get('upgradePackages', []):
+        for section in package['sections']:
+            for option in section['options']:
+                gains = option.get('gains', [])
+                upgrades[(section['uid'], option['uid'])] = {
+                    'replace': list(section.get('replaceWhat', [])),
+                    'weapons': [compile_weapon(gain) for gain in gains if gain.get('type') == 'ArmyBookWeapon'],
+                    'rules': [{'name': gain['name'], 'rating': gain.get('rating')} for gain in gains
+                              if gain.get('type') == 'ArmyBookRule'],
+                }
+    return {'army_id': data['uid'], 'name': data['name'], 'version': data.get('versionString'),
+            'units': units, 'upgrades': upgrades}
+
+
+class ArmyBookCache:
+    """
+    Binary cache of compiled army books, with an index keyed by (armyId, version).
+    An entry is used while the modification time of its book is unchanged, otherwise the book is parsed again.
+    Books are also kept in memory, so each process parses and unpickles every book at most once.
+
+    data_dir: Directory of the army book JSON files
+    cache_dir: Directory of the cache. Defaults to .cache in the data directory
+    """
+    def __init__(self, data_dir: str = ARMY_BOOK_DIR, cache_dir: str = None):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir or os.path.join(data_dir, '.cache')
+        self.index_path = os.path.join(self.cache_dir, 'index.pickle')
+        self.index = None # (armyId, version) -> (cache file, book file, modification time of the book)
+        self.books = {} # (armyId, version) -> (modification time of the book, compiled book)
+        self.parsed = 0
+        self.loaded = 0
+
+    def book_path(self, army_id: str, version: str = None) -> str:
+        if version is not None:
+            path = os.path.join(self.data_dir, f'{army_id}_{version}.json')
+            if os.path.exists(path):
+                return path
+        path = os.path.join(self.data_dir, f'{army_id}.json')
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No army book for army {army_id} in {self.data_dir}')
+        return path
+
+    def read_index(self) -> dict:
+        if self.index is None:
+            self.index = {}
+            try:
+                with open(self.index_path, 'rb') as file:
+                    stored = pickle.load(file)
+                if stored.get('version') == CACHE_FORMAT_VERSION:
+                    self.index = stored['entries']
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+        return self.index
+
+    def write_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.write_atomic(self.index_path, {'version': CACHE_FORMAT_VERSION, 'entries': self.index})
+
+    @staticmethod
+    def write_atomic(path: str, value):
+        """
+        Pickles the value into a temporary file that replaces the path, so that concurrent 
+        self-play workers never read a partially written file.
+        """
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+    def get(self, army_id: str, version: str = None) -> dict:
+        """
+        Returns the compiled army book.
+        """
+        key = (army_id, version)
+        path = self.book_path(army_id, version)
+        mtime = os.stat(path).st_mtime_ns
+
+        cached = self.books.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        book = None
+        entry = self.read_index().get(key)
+        if entry is not None and entry[1:] == (path, mtime):
+            try:
+                with open(os.path.join(self.cache_dir, entry[0]), 'rb') as file:
+                    book = pickle.load(file)
+                self.loaded += 1
+            except (OSError, pickle.UnpicklingError, EOFError):
+                book = None
+
+        if book is None:
+            with open(path) as file:
+                book = compile_book(json.load(file))
+            self.parsed += 1
+            if version is not None and book['version'] != version:
+                logger.warning(f'The list asks for version {version} of {book["name"]}, but the army book has version {book["version"]}')
+            filename = f'{army_id}_{version}.pickle'
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.write_atomic(os.path.join(self.cache_dir, filename), book)
+            self.read_index()[key] = (filename, path, mtime)
+            self.write_index()
+
+        self.books[key] = (mtime, book)
+        return book
+
+
+def unit_profiles(book: dict, list_unit: dict) -> list[dict]:
+    """
+    Returns the profiles of the models of a list unit, with its upgrades applied.
+    Models act on their own in Firefight, so a unit of size N becomes N profiles.
+    """
+    template = book['units'].get(list_unit['selectionId'])
+    if template is None:
+        raise KeyError(f'Unit {list_unit["selectionId"]} is not in {book["name"]} {book["version"]}')
+    weapons = list(template['weapons'])
+    rules = list(template['rules'])
+    for selected in list_unit.get('selectedUpgrades', []):
+        upgrade = book['upgrades'].get((selected['upgradeId'], selected['optionId']))
+        if upgrade is None:
+            raise KeyError(f'Upgrade {selected["upgradeId"]}/{selected["optionId"]} is not in {book["name"]} {book["version"]}')
+        for replaced in upgrade['replace']:
+            names = [weapon[0] for weapon in weapons]
+            if replaced in names:
+                weapons.pop(names.index(replaced))
+        weapons += upgrade['weapons']
+        rules += upgrade['rules']
+
+    movement = DEFAULT_MOVEMENT + sum(MOVEMENT_RULES.get(rule['name'], 0) for rule in rules)
+    profile = {
+        'name': template['name'],
+        'quality': template['quality'],
+        'defense': template['defense'],
+        'movement': movement,
+        'wounds': rule_rating(rules, 'Tough', 1),
+        'weapons': weapons,
+        'special_rules': [rule_label(rule) for rule in rules],
+    }
+    return [profile] * template['size']
+
+
+def army_versions(army_list: dict) -> dict[str, str]:
+    return {entry['armyId']: entry['version'] for entry in army_list.get('armyVersions', [])}
+
+
+def import_army_list(army_list: dict, cache: ArmyBookCache = None) -> list[dict]:
+    """
+    Resolves an exported army list into unit profiles, in the format of selfplay.ARMIES.
+    """
+    cache = cache or default_cache()
+    versions = army_versions(army_list)
+    profiles = []
+    for list_unit in army_list['list']['units']:
+        army_id = list_unit.get('armyId', army_list['armyId'])
+        profiles += unit_profiles(cache.get(army_id, versions.get(army_id)), list_unit)
+    return profiles
+
+
+_default_cache = None
+_army_lists = {} # (path, modification time) -> profiles
+
+
+def default_cache() -> ArmyBookCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ArmyBookCache()
+    return _default_cache
+
+
+def load_army_list(path: str, cache: ArmyBookCache = None) -> list[dict]:
+    """
+    Returns the unit profiles of an exported army list file. The profiles are kept per process
+    and must not be modified, so repeated setups of the same army do not parse anything.
+    """
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    profiles = _army_lists.get(key)
+    if profiles is None:
+        with open(path) as file:
+            profiles = _army_lists[key] = import_army_list(json.load(file), cache)
+    return profiles
+
+
+def build_unit(game: engine.Game, profile: dict, player: int, position=None) -> opr.OPRUnit:
+    """
+    Creates an OPRUnit from a profile.
+    """
+    unit = opr.OPRUnit(game, profile['name'], player=player, position=position)
+    unit.quality = profile['quality']
+    unit.defense = profile['defense']
+    unit.set_movement(profile['movement'])
+    unit.wounds = profile.get('wounds', 1)
+    unit.special_rules = list(profile.get('special_rules', []))
+    for weapon in profile['weapons']:
+        unit.add_weapon(opr.OPRWeapon(*weapon))
+    return unit
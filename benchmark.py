@@ -0,0 +1,352 @@
+"""
+Reproducible benchmarks of the board operations, headless games, environments and UI frames.
+
+Every benchmark is timed in repeated samples. A sample runs the operation as often as needed to take at least
+min_time, and yields the time per operation. Results are stored as JSON baselines, and a comparison with a
+baseline flags a benchmark as a regression if it is slower by more than the threshold, and the
+one-sided Mann-Whitney U test of the samples is significant at alpha.
+
+Usage:
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --filter board.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+import combat
+import engine
+import environment
+import onepagerules as opr
+import selfplay
+import vector_environment
+
+
+BOARD_SIZES = (8, 64, 256, 1000)
+UNIT_COUNTS = (4, 64, 512)
+QUICK_BOARD_SIZES = (8, 64)
+QUICK_UNIT_COUNTS = (4, 16)
+
+
+class Benchmark:
+    """
+    setup: Prepares the benchmark and returns the operation and the number of operations per call of it,
+    and optionally a function that releases what was set up, called after the measurement
+    """
+    def __init__(self, name: str, setup: Callable[[], tuple[Callable[[], None], int]]):
+        self.name = name
+        self.setup = setup
+
+
+def board_with_units(size: int, n_units: int, seed: int = 0) -> tuple[engine.Game, list[opr.OPRUnit]]:
+    """
+    Creates a board with units of two players on random squares.
+    """
+    game = engine.Game(seed=seed)
+    engine.Board([size, size], game)
+    opr.OPR_Firefight(game)
+    squares = random.Random(seed).sample(range(size * size), n_units)
+    units = [opr.OPRUnit(game, f'Unit {i}', player=i % 2 + 1, position=divmod(square, size))
+             for i, square in enumerate(squares)]
+    return game, units
+
+
+def board_benchmarks(size: int, n_units: int) -> list[Benchmark]:
+    label = f'[{size}x{size},{n_units} units]'
+
+    def in_range():
+        game, _ = board_with_units(size, n_units)
+        rng = random.Random(1)
+        origins = [(rng.randrange(size), rng.randrange(size)) for _ in range(64)]
+        board = game.board
+        def operation():
+            for origin in origins:
+                board.in_range(origin, 12, 'Unit', players=[2])
+        return operation, len(origins)
+
+    def is_occupied():
+        game, _ = board_with_units(size, n_units)
+        rng = random.Random(2)
+        positions = [(rng.randrange(size), rng.randrange(size)) for _ in range(256)]
+        board = game.board
+        def operation():
+            for position in positions:
+                board.is_occupied(position)
+        return operation, len(positions)
+
+    def place():
+        game, units = board_with_units(size, n_units)
+        # Every unit moves to a free square of its own and back
+        occupied = {tuple(unit.position) for unit in units}
+        rng = random.Random(3)
+        moves = []
+        for unit in units[:64]:
+            target = (rng.randrange(size), rng.randrange(size))
+            while target in occupied:
+                target = (rng.randrange(size), rng.randrange(size))
+            occupied.add(target)
+            moves.append((unit, target, tuple(unit.position)))
+        def operation():
+            for unit, target, home in moves:
+                unit.place(target)
+                unit.place(home)
+        return operation, 2 * len(moves)
+
+    return [Benchmark(f'board.in_range{label}', in_range),
+            Benchmark(f'board.is_occupied{label}', is_occupied),
+            Benchmark(f'piece.place{label}', place)]
+
+
+def game_benchmark(n_games: int) -> Benchmark:
+    def setup():
+        def operation():
+            for seed in range(n_games):
+                selfplay.setup_game(seed).run_headless()
+        return operation, n_games
+    return Benchmark('game.headless[random,12x12]', setup)
+
+
+def dice_benchmark(trials: int) -> Benchmark:
+    def setup():
+        rng = np.random.default_rng(0)
+        def operation():
+            combat.simulate_wounds(rng, attacks=[10, 10], damage=[1, 2], quality=4, defense=4, trials=trials)
+        # A hit and a block roll per attack
+        return operation, 2 * 20 * trials
+    return Benchmark('combat.dice[simulate_wounds,20 attacks]', setup)
+
+
+def environment_benchmarks(n_games: int, n_envs: int) -> list[Benchmark]:
+    """
+    Random play in FirefightEnv and in VectorFirefightEnv with K boards, timed per activation of a unit,
+    as a step of FirefightEnv is a single decision, while a step of VectorFirefightEnv is an activation on every board.
+    """
+    def scalar():
+        env = environment.FirefightEnv()
+        def operation():
+            rng = np.random.default_rng(0)
+            activations = 0
+            for seed in range(n_games):
+                _, info = env.reset(seed=seed)
+                done = False
+                while not done:
+                    _, _, done, _, info = env.step(rng.choice(np.flatnonzero(info['action_mask'])))
+                activations += env.game.rules.activations
+            return activations
+        # The games are seeded, so every call plays the same activations
+        return operation, operation()
+
+    def vector():
+        env = vector_environment.VectorFirefightEnv(n_envs, seed=0)
+        rng = np.random.default_rng(0)
+        def operation():
+            env.step(env.sample_actions(rng))
+        return operation, n_envs
+
+    return [Benchmark('env.scalar_activation[random,12x12]', scalar),
+            Benchmark(f'env.vector_activation[random,12x12,K={n_envs}]', vector)]
+
+
+def ui_benchmarks(size: int) -> list[Benchmark]:
+    label = f'[{size}x{size}]'
+
+    def ui_setup():
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import gameUI
+        game, units = board_with_units(size, min(16, size * size // 4))
+        api = engine.API(game, game.rules)
+        ui = gameUI.UI(game.board, api)
+        ui.render_frame()
+        return ui, units
+
+    def idle_frame():
+        ui, _ = ui_setup()
+        return ui.render_frame, 1, ui.close
+
+    def moving_frame():
+        ui, units = ui_setup()
+        unit = units[0]
+        home = tuple(unit.position)
+        occupied = {tuple(other.position) for other in units}
+        target = next((x, y) for x in range(size) for y in range(size) if (x, y) not in occupied)
+        def operation():
+            unit.place(target)
+            ui.render_frame()
+            unit.place(home)
+            ui.render_frame()
+        return operation, 2, ui.close
+
+    return [Benchmark(f'ui.frame_idle{label}', idle_frame), Benchmark(f'ui.frame_move{label}', moving_frame)]
+
+
+def all_benchmarks(quick: bool = False) -> list[Benchmark]:
+    sizes, counts = (QUICK_BOARD_SIZES, QUICK_UNIT_COUNTS) if quick else (BOARD_SIZES, UNIT_COUNTS)
+    benchmarks = []
+    for size in sizes:
+        for n_units in counts:
+            # Units take at most a quarter of the board
+            if n_units <= size * size // 4:
+                benchmarks += board_benchmarks(size, n_units)
+    benchmarks.append(dice_benchmark(1000 if quick else 50000))
+    benchmarks.append(game_benchmark(2 if quick else 10))
+    benchmarks += environment_benchmarks(1, 64) if quick else environment_benchmarks(10, 1024)
+    for size in ((8,) if quick else (8, 256)):
+        benchmarks += ui_benchmarks(size)
+    return benchmarks
+
+
+def measure(operation: Callable[[], None], ops: int, repeats: int, min_time: float) -> list[float]:
+    """
+    Returns the time per operation of each sample. The garbage collector is paused while timing, as in timeit.
+    """
+    def timed(number: int) -> float:
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                operation()
+            return time.perf_counter() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    # Calibrate the calls per sample, which also warms up the caches
+    number = 1
+    while True:
+        elapsed = timed(number)
+        if elapsed >= min_time:
+            break
+        number = max(number + 1, min(number * 10, int(number * min_time * 1.2 / max(elapsed, 1e-9))))
+    return [timed(number) / (number * ops) for _ in range(repeats)]
+
+
+def run_benchmarks(benchmarks: list[Benchmark], repeats: int = 10, min_time: float = 0.05, log=None) -> dict:
+    """
+    Runs the benchmarks and returns the results in the baseline format.
+    """
+    results = {}
+    for benchmark in benchmarks:
+        operation, ops, *release = benchmark.setup()
+        samples = measure(operation, ops, repeats, min_time)
+        for function in release:
+            function()
+        results[benchmark.name] = {'unit': 'seconds per operation', 'samples': samples,
+                                   'median': statistics.median(samples), 'mean': statistics.fmean(samples),
+                                   'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+                                   'per_second': 1 / statistics.median(samples)}
+        if log:
+            result = results[benchmark.name]
+            print(f'{benchmark.name}: {format_time(result["median"])} ({result["per_second"]:.4g}/s)', file=log)
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                     'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'repeats': repeats, 'min_time': min_time},
+            'benchmarks': results}
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3g} {unit}'
+    return f'{seconds / 1e-9:.3g} ns'
+
+
+def mann_whitney_greater(current: list[float], baseline: list[float]) -> float:
+    """
+    One-sided p-value of the Mann-Whitney U test that the current samples are larger than the baseline,
+    in the normal approximation with a continuity correction.
+    """
+    n1, n2 = len(current), len(baseline)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    values = sorted([(value, 0) for value in current] + [(value, 1) for value in baseline])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    sd = math.sqrt(n1 * n2 * (n1 + n2 + 1) / 12)
+    if sd == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sd
+    return 1 - statistics.NormalDist().cdf(z)
+
+
+def compare(baseline: dict, current: dict, alpha: float = 0.01, threshold: float = 0.05) -> list[dict]:
+    """
+    Compares the benchmarks of two result sets. The status of a benchmark is 'regression' or 'improvement'
+    if its median changed by more than the threshold and the change is significant, 'unchanged' otherwise,
+    or 'new' and 'missing' if it is only in one of them.
+    """
+    rows = []
+    base, cur = baseline['benchmarks'], current['benchmarks']
+    for name in list(base) + [name for name in cur if name not in base]:
+        if name not in cur or name not in base:
+            rows.append({'name': name, 'status': 'missing' if name not in cur else 'new'})
+            continue
+        ratio = cur[name]['median'] / base[name]['median']
+        slower = mann_whitney_greater(cur[name]['samples'], base[name]['samples'])
+        faster = mann_whitney_greater(base[name]['samples'], cur[name]['samples'])
+        if ratio > 1 + threshold and slower < alpha:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold) and faster < alpha:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        rows.append({'name': name, 'status': status, 'ratio': ratio, 'p_slower': slower,
+                     'baseline': base[name]['median'], 'current': cur[name]['median']})
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark board operations, headless games, environments and UI frames.')
+    parser.add_argument('--filter', type=str, default=None, help='Only run benchmarks whose name contains this text')
+    parser.add_argument('--quick', action='store_true', help='Small boards and few games, e.g. for a smoke test')
+    parser.add_argument('--repeats', type=int, default=10, help='Samples per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.05, help='Minimum duration of a sample in seconds')
+    parser.add_argument('--save', type=str, default=None, help='Store the results as a baseline in this JSON file')
+    parser.add_argument('--compare', type=str, default=None, help='Compare the results with this baseline')
+    parser.add_argument('--alpha', type=float, default=0.01, help='Significance level of regressions')
+    parser.add_argument('--threshold', type=float, default=0.05, help='Relative slowdown below which changes are ignored')
+    args = parser.parse_args(argv)
+
+    benchmarks = [benchmark for benchmark in all_benchmarks(args.quick) if not args.filter or args.filter in benchmark.name]
+    results = run_benchmarks(benchmarks, args.repeats, args.min_time, log=sys.stderr)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=1)
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as file:
+        baseline = json.load(file)
+    rows = compare(baseline, results, args.alpha, args.threshold)
+    for row in rows:
+        if 'ratio' in row:
+            print(f"{row['status']:<12} {row['name']}: {format_time(row['baseline'])} -> {format_time(row['current'])} "
+                  f"({row['ratio']:.2f}x, p={row['p_slower']:.3g})")
+        else:
+            print(f"{row['status']:<12} {row['name']}")
+    regressions = [row for row in rows if row['status'] == 'regression']
+    print(f'{len(regressions)} regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
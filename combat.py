@@ -0,0 +1,185 @@
+"""
+Vectorized dice mechanics for OnePageRules combat.
+
+All attacks of an activation are rolled in one batch of NumPy draws:
+an attack hits on a roll of at least the quality of the attacker, and a hit is blocked
+on a roll of at least the defense of the target. Every unblocked hit deals the damage of its weapon.
+An unmodified 6 always succeeds and an unmodified 1 always fails, for hits and blocks alike.
+"""
+import pickle
+from collections import OrderedDict
+import numpy as np
+
+
+def roll_succeeds(rolls: np.ndarray, target) -> np.ndarray:
+    """
+    Returns True where a d6 roll meets the target number, with natural 6s and 1s overriding it.
+    """
+    return ((rolls >= target) | (rolls == 6)) & (rolls != 1)
+
+
+def roll_attacks(rng: np.random.Generator, attacks, damage, quality, defense) -> np.ndarray:
+    """
+    Resolves groups of attacks, e.g. one group per weapon and target, with a single draw of dice.
+
+    rng: The random number generator of the game
+    attacks: Number of attacks of each group
+    damage: Wounds dealt by every unblocked hit of each group
+    quality: Quality of the attacker of each group, or one value for all
+    defense: Defense of the target of each group, or one value for all
+
+    Returns the number of wounds dealt by each group.
+    """
+    attacks = np.asarray(attacks, dtype=np.int64).reshape(-1)
+    groups = len(attacks)
+    quality = np.broadcast_to(np.asarray(quality), (groups,))
+    defense = np.broadcast_to(np.asarray(defense), (groups,))
+
+    group_of_attack = np.repeat(np.arange(groups), attacks)
+    to_hit, to_block = rng.integers(1, 7, size=(2, len(group_of_attack)), dtype=np.int8)
+    unblocked = roll_succeeds(to_hit, quality[group_of_attack]) & ~roll_succeeds(to_block, defense[group_of_attack])
+
+    unblocked_hits = np.bincount(group_of_attack, weights=unblocked, minlength=groups)
+    return unblocked_hits.astype(np.int64) * np.asarray(damage, dtype=np.int64)
+
+
+def simulate_wounds(rng: np.random.Generator, attacks, damage, quality: int, defense: int, trials: int) -> np.ndarray:
+    """
+    Monte Carlo simulation of an engagement, i.e. the same attacks rolled many times.
+
+    attacks, damage: Attacks and damage of every weapon of the attacker
+    quality, defense: Quality of the attacker and defense of the target
+
+    Returns the total wounds dealt in each of the trials.
+    """
+    attacks = np.asarray(attacks, dtype=np.int64).reshape(-1)
+    damage_of_attack = np.repeat(np.asarray(damage, dtype=np.int64).reshape(-1), attacks)
+    to_hit, to_block = rng.integers(1, 7, size=(2, trials, len(damage_of_attack)), dtype=np.int8)
+    unblocked = roll_succeeds(to_hit, quality) & ~roll_succeeds(to_block, defense)
+    return unblocked @ damage_of_attack
+
+
+def success_probability(target: int) -> float:
+    """
+    Probability that a d6 roll meets the target number, with natural 6s and 1s overriding it.
+    """
+    return min(max((7 - target) / 6, 1 / 6), 5 / 6)
+
+
+def unblocked_probability(quality: int, defense: int) -> float:
+    """
+    Probability that a single attack hits and is not blocked.
+    """
+    return success_probability(quality) * (1 - success_probability(defense))
+
+
+def binomial_pmf(n: int, p: float) -> np.ndarray:
+    """
+    Returns the probabilities of 0 to n successes in n trials with success probability p.
+    """
+    k = np.arange(n + 1)
+    log_binomial = np.cumsum(np.log(np.maximum(n - k + 1, 1))) - np.cumsum(np.log(np.maximum(k, 1)))
+    with np.errstate(divide='ignore'):
+        log_pmf = log_binomial + k * np.log(p) + (n - k) * np.log1p(-p)
+    pmf = np.exp(log_pmf)
+    return pmf / pmf.sum()
+
+
+class OutcomeTable:
+    """
+    Exact distributions of the wounds dealt by a set of weapons against a target.
+    The wounds of a weapon are its damage times a binomial number of unblocked hits,
+    and the distributions of several weapons are convolved.
+
+    Distributions are memoized by profile, i.e. the (attacks, damage) of the weapons, the quality 
+    of the attacker and the defense of the target. The least recently used profiles are evicted 
+    once max_entries are stored. After warm-up, queries are a lookup.
+    """
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # profile -> (pmf, tail, mean), tail[k] = P(wounds >= k)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def profile(weapons, quality: int, defense: int) -> tuple:
+        """
+        Returns the key of a matchup. Weapons can be OPRWeapons or (attacks, damage) tuples.
+        The order of the weapons does not matter.
+        """
+        attacks_damage = sorted((weapon.attacks, weapon.damage) if hasattr(weapon, 'attacks') else tuple(weapon)
+                                for weapon in weapons)
+        return tuple(attacks_damage), quality, defense
+
+    @staticmethod
+    def compute(profile: tuple) -> np.ndarray:
+        """
+        Returns the probabilities of dealing 0, 1, 2, ... wounds for a profile.
+        """
+        attacks_damage, quality, defense = profile
+        p = unblocked_probability(quality, defense)
+        pmf = np.ones(1)
+        for attacks, damage in attacks_damage:
+            hits = binomial_pmf(attacks, p)
+            weapon_pmf = np.zeros(attacks * damage + 1)
+            weapon_pmf[::max(damage, 1)] = hits if damage > 0 else hits.sum()
+            pmf = np.convolve(pmf, weapon_pmf)
+        return pmf
+
+    def entry(self, weapons, quality: int, defense: int) -> tuple:
+        key = self.profile(weapons, quality, defense)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        entry = self.store(key, self.compute(key))
+        return entry
+
+    def store(self, key: tuple, pmf: np.ndarray) -> tuple:
+        tail = np.append(pmf[::-1].cumsum()[::-1], 0.0)
+        entry = (pmf, tail, float(np.arange(len(pmf)) @ pmf))
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def distribution(self, weapons, quality: int, defense: int) -> np.ndarray:
+        """
+        Returns the probabilities of dealing 0, 1, 2, ... wounds. The array must not be modified.
+        """
+        return self.entry(weapons, quality, defense)[0]
+
+    def expected_wounds(self, weapons, quality: int, defense: int) -> float:
+        return self.entry(weapons, quality, defense)[2]
+
+    def kill_probability(self, weapons, quality: int, defense: int, wounds: int) -> float:
+        """
+        Returns the probability to destroy a target with the given number of wounds.
+        """
+        tail = self.entry(weapons, quality, defense)[1]
+        return float(tail[min(max(wounds, 0), len(tail) - 1)])
+
+    def expected_kills(self, weapons, quality: int, defense: int, wounds: int, models: int = 1) -> float:
+        """
+        Returns the expected number of models killed, for targets of several models with the same wounds.
+        For a single model, this is the probability to destroy it.
+        """
+        if models == 1:
+            return self.kill_probability(weapons, quality, defense, wounds)
+        pmf = self.distribution(weapons, quality, defense)
+        kills = np.minimum(np.arange(len(pmf)) // max(wounds, 1), models)
+        return float(kills @ pmf)
+
+    def save(self, filename: str):
+        """
+        Saves the stored distributions, so that a later run can skip the warm-up.
+        """
+        with open(filename, 'wb') as file:
+            pickle.dump({key: pmf for key, (pmf, _, _) in self.entries.items()}, file)
+
+    def load(self, filename: str):
+        with open(filename, 'rb') as file:
+            for key, pmf in pickle.load(file).items():
+                self.store(key, pmf)
@@ -0,0 +1,244 @@
+"""
+Trajectory datasets of (observation, action mask, action, outcome) records, for training agents.
+
+Records have a fixed NumPy dtype and are appended to raw binary shards, which are memory-mapped for reading,
+so sampling a minibatch only reads the pages of the sampled records. A directory holds the shards and index.json:
+
+    {"version": 1, "fields": [{"name": "action", "type": "<i4", "shape": []}, ...],
+     "shards": [{"file": "shard_00000.bin", "records": 1234}, ...], "episodes": 100}
+
+Shards are rotated once they reach max_shard_bytes. The index lists completed shards only and is replaced
+atomically, so readers never see a partially written shard.
+
+Usage:
+    python dataset.py --games 1000 --output trajectories --seed 0
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import environment
+
+
+INDEX_FILE = 'index.json'
+FORMAT_VERSION = 1
+
+
+def record_dtype(observation_shape: tuple, n_actions: int) -> np.dtype:
+    """
+    The outcome is the final reward of the episode from the view of the acting player, known once the episode ends.
+    """
+    return np.dtype([('observation', np.float32, tuple(observation_shape)),
+                     ('action_mask', np.bool_, (n_actions,)),
+                     ('action', np.int32),
+                     ('outcome', np.float32),
+                     ('episode', np.int64),
+                     ('step', np.int32)])
+
+
+class ShardWriter:
+    """
+    Streams records into the shards of a directory. Steps are collected per episode with add(),
+    and written with their outcome by end_episode().
+
+    directory: Output directory. Shards of an existing dataset with the same dtype are continued
+    max_shard_bytes: Size at which a shard is completed and the next one started
+    """
+    def __init__(self, directory: str, dtype: np.dtype, max_shard_bytes: int = 256 * 2**20):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.max_shard_records = max(1, max_shard_bytes // self.dtype.itemsize)
+        os.makedirs(directory, exist_ok=True)
+
+        self.shards = []
+        self.episodes = 0
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as file:
+                index = json.load(file)
+            if fields_to_dtype(index['fields']) != self.dtype:
+                raise ValueError(f'The dataset in {directory} has a different record dtype')
+            self.shards = index['shards']
+            self.episodes = index.get('episodes', 0)
+
+        self.file = None
+        self.shard_records = 0
+        self.episode = [] # (observation, action mask, action) of the steps of the current episode
+
+    @property
+    def records(self) -> int:
+        return sum(shard['records'] for shard in self.shards) + self.shard_records
+
+    def add(self, observation: np.ndarray, action_mask: np.ndarray, action: int):
+        """
+        Adds a step to the current episode. The arrays are copied, since environments update them in place.
+        """
+        self.episode.append((observation.copy(), action_mask.copy(), action))
+
+    def end_episode(self, outcome: float):
+        """
+        Writes the steps of the current episode with the outcome.
+        """
+        steps = len(self.episode)
+        if steps:
+            records = np.empty(steps, dtype=self.dtype)
+            records['observation'] = np.stack([step[0] for step in self.episode])
+            records['action_mask'] = np.stack([step[1] for step in self.episode])
+            records['action'] = [step[2] for step in self.episode]
+            records['outcome'] = outcome
+            records['episode'] = self.episodes
+            records['step'] = np.arange(steps)
+            self.write(records)
+        self.episode = []
+        self.episodes += 1
+
+    def write(self, records: np.ndarray):
+        """
+        Appends records of the dtype, rotating shards as they fill up.
+        """
+        while len(records):
+            if self.file is None:
+                self.open_shard()
+            count = min(len(records), self.max_shard_records - self.shard_records)
+            self.file.write(records[:count].tobytes())
+            self.shard_records += count
+            records = records[count:]
+            if self.shard_records >= self.max_shard_records:
+                self.close_shard()
+
+    def open_shard(self):
+        self.shard_name = f'shard_{len(self.shards):05d}.bin'
+        self.file = open(os.path.join(self.directory, self.shard_name), 'wb')
+        self.shard_records = 0
+
+    def close_shard(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if self.shard_records:
+            self.shards.append({'file': self.shard_name, 'records': self.shard_records})
+        else:
+            os.remove(os.path.join(self.directory, self.shard_name))
+        self.shard_records = 0
+        self.write_index()
+
+    def write_index(self):
+        index = {'version': FORMAT_VERSION, 'fields': dtype_to_fields(self.dtype),
+                 'shards': self.shards, 'episodes': self.episodes}
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(index, file)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        """
+        Completes the current shard. Steps of an unfinished episode are discarded.
+        """
+        self.episode = []
+        self.close_shard()
+        self.write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def dtype_to_fields(dtype: np.dtype) -> list[dict]:
+    """
+    Describes a record dtype in JSON: one name, base type and shape per field.
+    """
+    return [{'name': name, 'type': dtype[name].base.str, 'shape': list(dtype[name].shape)} for name in dtype.names]
+
+
+def fields_to_dtype(fields: list[dict]) -> np.dtype:
+    return np.dtype([(field['name'], field['type'], tuple(field['shape'])) for field in fields])
+
+
+class ShardReader:
+    """
+    Random access to the records of a dataset directory, through memory maps of the shards.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            index = json.load(file)
+        if index['version'] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported dataset version {index["version"]}')
+        self.dtype = fields_to_dtype(index['fields'])
+        self.shards = [np.memmap(os.path.join(directory, shard['file']), dtype=self.dtype, mode='r',
+                                 shape=(shard['records'],)) for shard in index['shards'] if shard['records']]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, indices) -> np.ndarray:
+        """
+        Returns the records at global indices, an integer or an array of them, as an in-memory array.
+        """
+        scalar = np.isscalar(indices)
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError('Record index out of range')
+        shard_of = np.searchsorted(self.offsets, indices, side='right') - 1
+        batch = np.empty(len(indices), dtype=self.dtype)
+        for shard in np.unique(shard_of):
+            selected = shard_of == shard
+            batch[selected] = self.shards[shard][indices[selected] - self.offsets[shard]]
+        return batch[0] if scalar else batch
+
+    def sample(self, batch_size: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Returns a minibatch of records drawn uniformly with replacement. Only the sampled records are read.
+        Sorting the indices keeps the reads of each shard in file order.
+        """
+        return self[np.sort(rng.integers(0, len(self), size=batch_size))]
+
+
+def collect(env: environment.FirefightEnv, writer: ShardWriter, n_games: int, rng: np.random.Generator,
+            policy=None) -> int:
+    """
+    Plays n_games in the environment and writes every decision of the agent.
+    The policy maps (observation, action mask) to an action and defaults to uniform random legal actions.
+    Returns the number of records written.
+    """
+    written = 0
+    for _ in range(n_games):
+        observation, info = env.reset()
+        done = env.done
+        reward = 0.0
+        while not done:
+            mask = info['action_mask']
+            action = int(rng.choice(np.flatnonzero(mask))) if policy is None else policy(observation, mask)
+            writer.add(observation, mask, action)
+            observation, reward, done, _, info = env.step(action)
+        written += len(writer.episode)
+        writer.end_episode(reward)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write trajectories of headless OPR_Firefight games to memory-mapped shards.')
+    parser.add_argument('--games', type=int, default=100, help='Number of games to play')
+    parser.add_argument('--output', type=str, required=True, help='Dataset directory')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game')
+    parser.add_argument('--board', nargs=2, type=int, default=[12, 12], help='Board size')
+    parser.add_argument('--shard-mb', type=float, default=256, help='Size at which shards are rotated, in MiB')
+    args = parser.parse_args(argv)
+
+    env = environment.FirefightEnv(board_size=args.board, seed=args.seed)
+    dtype = record_dtype(env.observation.shape, env.n_actions)
+    start = time.perf_counter()
+    with ShardWriter(args.output, dtype, int(args.shard_mb * 2**20)) as writer:
+        written = collect(env, writer, args.games, np.random.default_rng(args.seed))
+    print(f'Wrote {written} records of {args.games} games in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,12 @@ import numpy as np
 from typing import TypedDict, List, Tuple, Dict, Generator, Any
 from abc import ABC, abstractmethod
 import asyncio
+import types
 from transitions import Machine
 import copy
+import random
+from functools import lru_cache
+import zlib
 DEBUG = True
 import logging, logging.config
 logging.config.dictConfig({
@@ -13,17 +17,36 @@ logging.config.dictConfig({
 
 class Game:
 
-    def __init__(self, players = [1,2]):
+    def __init__(self, players = [1,2], seed = None):
+        """
+        players: The players taking part in the game
+        seed: Seed for the random number generator of the game. Seeded games are reproducible.
+        """
+        self.seed = seed
+        self.random = random.Random(seed) # For choices made by the rules, e.g. initiative
+        self.rng = np.random.default_rng(seed) # For dice rolls
         self.board = None
         self.unplaced_pieces = {}
         self.dead_units = {}
+        self.roster = [] # All pieces of the game in order of creation, wherever they are
         self.api = None
         self.rules = None
         self.game_sequence = None
         self.players = players
-        self.active_player = None
+        self._active_player = None
         self.logger = logging.getLogger('game logger')
 
+    @property
+    def active_player(self):
+        return self._active_player
+
+    @active_player.setter
+    def active_player(self, player):
+        if self.board is not None:
+            self.board.hash ^= zobrist_key(ZOBRIST_ACTIVE_PLAYER, self._active_player or 0) \
+                ^ zobrist_key(ZOBRIST_ACTIVE_PLAYER, player or 0)
+        self._active_player = player
+
 
     def add_piece(self, piece, position = None):
         """
@@ -41,10 +64,174 @@ class Game:
         self.rules = rules
 
     async def start_game(self):
-        print('Game Started')
+        self.logger.info('Game Started')
         assert self.rules is not None, 'No rules set for the game.'
         await self.rules.game_sequence()
 
+    def run_headless(self):
+        """
+        Runs the game sequence to the end synchronously, without an event loop.
+        Requires an API that answers every request for input immediately, such as the HeadlessAPI.
+        """
+        assert self.rules is not None, 'No rules set for the game.'
+        sequence = self.rules.game_sequence()
+        try:
+            sequence.send(None)
+        except StopIteration:
+            return
+        sequence.close()
+        raise RuntimeError('The game sequence suspended while waiting for input, which a headless game cannot provide.')
+
+    def snapshot(self, include_random: bool = True) -> 'GameSnapshot':
+        """
+        Returns a compact copy of the game state: where every piece is, its state fields,
+        the active player and the state of the rules. Restoring it costs O(pieces), 
+        unlike a deepcopy, which would copy the whole world including the API.
+
+        include_random: Also store the state of the random number generators, 
+                        so that the game continues with the same dice after restoring
+        """
+        n = len(self.roster)
+        positions = np.full((n, 2), -1, dtype=np.int32)
+        locations = np.zeros(n, dtype=np.int8)
+        fields = []
+        for i, piece in enumerate(self.roster):
+            if piece.id in self.board.pieces:
+                positions[i] = piece.position
+                locations[i] = GameSnapshot.ON_BOARD
+            elif piece.id in self.dead_units:
+                locations[i] = GameSnapshot.DEAD
+            elif piece.id in self.unplaced_pieces:
+                locations[i] = GameSnapshot.UNPLACED
+            else:
+                locations[i] = GameSnapshot.REMOVED
+            fields.append(tuple(getattr(piece, name) for name in piece.state_fields))
+        random_state = (self.random.getstate(), self.rng.bit_generator.state) if include_random else None
+        return GameSnapshot(positions, locations, tuple(fields), self.active_player, 
+                            self.rules.get_state() if self.rules is not None else None, random_state)
+
+    def restore(self, snapshot: 'GameSnapshot'):
+        """
+        Puts the game back into the state of the snapshot. The pieces are the same objects as before,
+        so references to them stay valid.
+        """
+        assert len(snapshot.locations) == len(self.roster), 'The snapshot was taken from a different game'
+        board = self.board
+        moved = []
+        for piece, location, position in zip(self.roster, snapshot.locations.tolist(), snapshot.positions.tolist()):
+            on_board = piece.slot is not None
+            if on_board and (location != GameSnapshot.ON_BOARD or list(piece.position) != position):
+                board.vacate(piece)
+            if location == GameSnapshot.ON_BOARD and (piece.slot is None):
+                moved.append((piece, tuple(position)))
+            elif location != GameSnapshot.ON_BOARD:
+                piece.position = None
+            self.unplaced_pieces.pop(piece.id, None)
+            self.dead_units.pop(piece.id, None)
+            if location == GameSnapshot.UNPLACED:
+                self.unplaced_pieces[piece.id] = piece
+            elif location == GameSnapshot.DEAD:
+                self.dead_units[piece.id] = piece
+        # Pieces are placed after all others have left, so that swapped squares do not collide
+        for piece, position in moved:
+            piece.position = position
+            board.occupy(piece, position)
+        # Pieces are kept in the order of the roster, so that the game continues deterministically
+        board.pieces.clear()
+        for piece, location in zip(self.roster, snapshot.locations.tolist()):
+            if location == GameSnapshot.ON_BOARD:
+                board.pieces[piece.id] = piece
+
+        for piece, values in zip(self.roster, snapshot.fields):
+            for name, value in zip(piece.state_fields, values):
+                setattr(piece, name, value)
+        self.active_player = snapshot.active_player
+        if self.rules is not None:
+            self.rules.set_state(snapshot.rules_state)
+        if snapshot.random_state is not None:
+            self.random.setstate(snapshot.random_state[0])
+            self.rng.bit_generator.state = snapshot.random_state[1]
+
+
+class GameSnapshot:
+    """
+    Compact state of a game, see Game.snapshot. Pieces are referred to by their index in the roster
+    of the game, so a snapshot can be restored into any game set up the same way, e.g. in another process.
+    """
+    UNPLACED, ON_BOARD, DEAD, REMOVED = 0, 1, 2, 3
+    __slots__ = ('positions', 'locations', 'fields', 'active_player', 'rules_state', 'random_state')
+
+    def __init__(self, positions: np.ndarray, locations: np.ndarray, fields: tuple, active_player: int,
+                 rules_state: tuple, random_state: tuple = None):
+        self.positions = positions
+        self.locations = locations
+        self.fields = fields
+        self.active_player = active_player
+        self.rules_state = rules_state
+        self.random_state = random_state
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def key(self) -> tuple:
+        """
+        Returns a hashable identity of the game position, without the random state.
+        """
+        return (self.positions.tobytes(), self.locations.tobytes(), self.fields, self.active_player, self.rules_state)
+
+
+ZOBRIST_MASK = (1 << 64) - 1
+# Kinds of hashed features, the first part of every Zobrist key
+ZOBRIST_PIECE, ZOBRIST_FIELD, ZOBRIST_ACTIVE_PLAYER, ZOBRIST_GAME_TURN = 1, 2, 3, 4
+
+def splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & ZOBRIST_MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & ZOBRIST_MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & ZOBRIST_MASK
+    return x ^ (x >> 31)
+
+@lru_cache(maxsize=65536)
+def zobrist_key(*parts: int) -> int:
+    """
+    Returns the 64-bit random key of a feature of the game state, e.g. (ZOBRIST_PIECE, roster index, x, y).
+    Keys are derived from the parts alone, so they are the same in every process and every run.
+    """
+    key = 0
+    for part in parts:
+        key = splitmix64(key ^ (int(part) & ZOBRIST_MASK))
+    return key
+
+
+class HashedField:
+    """
+    A piece attribute that is part of the Zobrist hash of the board. Every assignment updates the hash in O(1).
+    Values must be integers or booleans, and the attribute should be listed in the state_fields of the piece.
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.attribute = '_' + name
+        self.field_id = zlib.crc32(name.encode())
+
+    def __get__(self, piece, owner=None):
+        if piece is None:
+            return self
+        return getattr(piece, self.attribute)
+
+    def __set__(self, piece, value):
+        board = piece.game.board
+        # Without a board there is no hash yet. The board computes it from scratch when it is created
+        if board is not None:
+            old = getattr(piece, self.attribute, None)
+            if old is not None:
+                board.hash ^= zobrist_key(ZOBRIST_FIELD, piece.roster_index, self.field_id, old)
+            board.hash ^= zobrist_key(ZOBRIST_FIELD, piece.roster_index, self.field_id, value)
+        setattr(piece, self.attribute, value)
+
+
 def make_id():
     i = 0
     while True:
@@ -54,6 +241,8 @@ id_generator = make_id()
 
 
 class Piece:
+    # Attributes, besides the position, that make up the state of the piece in a game snapshot
+    state_fields = ()
 
     def __init__(self, game, name, position = None, height = 0, extent=[0,0]):
         """
@@ -71,6 +260,9 @@ class Piece:
         self.board = self.game.board
         self.clickable = False
         self.rect = None
+        self.slot = None # Index of the piece in the piece table of the board, while it is placed
+        self.roster_index = len(game.roster)
+        game.roster.append(self)
 
         self.interaction_range = 0 # The range of the highlight around the piece when selected
 
@@ -83,17 +275,23 @@ class Piece:
     
 
     def place(self, new_position: list[int]):
-        assert not self.board.is_occupied(new_position, self.extent),\
-        f'Coordinates {new_position} already occupied with {self.board.map[*new_position]}'
+        # Moving a piece first frees its old squares, so that it cannot collide with itself
+        old_position = self.position if self.slot is not None else None
+        if old_position is not None:
+            self.board.vacate(self)
+        if self.board.is_occupied(new_position, self.extent):
+            if old_position is not None:
+                self.board.occupy(self, old_position)
+            raise AssertionError(f'Coordinates {new_position} already occupied with {self.board.piece_at(new_position)}')
         self.position = new_position
-        self.board.map[*new_position] = self
+        self.board.occupy(self, new_position)
         self.board.pieces[self.id] = self
         self.game.unplaced_pieces.pop(self.id, None)
 
         self.interaction_range = 0 # After setting to a new position, I do not expect a new interaction
 
     def remove(self, kill=True):
-        self.board.map[*self.position] = None
+        self.board.vacate(self)
         self.board.pieces.pop(self.id)
         self.position = None
         if kill:
@@ -105,6 +303,8 @@ class Piece:
 class Unit(Piece,ABC):
     
     def __init__(self, game: Game, name: str, player:int, position = None,  img = None):
+        # The player must be known before the unit is placed on the board
+        self.player = player
         super().__init__(game, name=name,position=position)
 
         self.health = None
@@ -113,11 +313,29 @@ class Unit(Piece,ABC):
         self.abilities = []
         self.movement = 0
         self.clickable = True
-        self.player = player
 
         
 
 
+@lru_cache(maxsize=256)
+def disk_stencil(range: float, gridsize: float = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the offsets (dx, dy) of all squares within range of a square, excluding the square itself.
+    The distance between squares is measured in game units, i.e. squares times gridsize.
+    The offsets are ordered by dx first, then dy. The arrays are cached and must not be modified.
+    """
+    reach = int(np.floor(range / gridsize))
+    offsets = np.arange(-reach, reach + 1)
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    dx, dy = dx.ravel(), dy.ravel()
+    within = (dx**2 + dy**2) * gridsize**2 <= range**2
+    within &= (dx != 0) | (dy != 0)
+    dx, dy = dx[within], dy[within]
+    dx.flags.writeable = False
+    dy.flags.writeable = False
+    return dx, dy
+
+
 class Board:
 
     def __init__(self, size: list[str], game, gridsize = 1):
@@ -140,61 +358,571 @@ class Board:
         self.x = np.arange(0, self.size[0], 1)
         self.y = np.arange(0, self.size[1], 1)
 
-    def is_occupied(self, position: list[int], extent: list[int]):
+        # Compact occupancy layer next to the map: every square holds the slot of the piece
+        # covering it in the dense piece table, or -1 if it is empty
+        self.occupancy = np.full(self.size, -1, dtype=np.int32)
+        self.piece_table = []
+        self.free_slots = []
+        # Per-slot attributes of the piece table, so that type filters can be applied to whole arrays
+        self.slot_is_unit = np.zeros(16, dtype=bool)
+        self.slot_player = np.zeros(16, dtype=np.int32)
+        self.slot_height = np.zeros(16, dtype=np.float64)
+
+        # Height of the terrain on every square. Terrain blocks line of sight, or grants cover behind it.
+        # Terrain of height 1 or more is impassable, lower terrain is difficult to move through
+        self.terrain = np.zeros(self.size, dtype=np.float64)
+
+        # Incremented whenever pieces or terrain change, to invalidate derived data
+        self.version = 0
+        self.movement_cache = {} # (piece id, distance) -> movement costs, valid for movement_cache_version
+        self.movement_cache_version = 0
+
+        # Zobrist hash of the game position: pieces on their squares, hashed piece fields, 
+        # the active player and the game turn. Kept up to date incrementally, see rehash
+        self.hash = 0
+        self.hash = self.rehash()
+
+        # Objects notified whenever a piece occupies or vacates squares. 
+        # They implement on_occupy(piece, squares) and on_vacate(piece, squares), with squares given as slices
+        self.listeners = []
+        self.visibility = VisibilityCache(self)
+        self.unit_index = SpatialIndex(self)
+
+    @staticmethod
+    def footprint(extent: list[int]) -> tuple[int, int]:
+        """
+        Returns the number of squares covered by a piece of the given extent in each dimension.
+        An extent of [0,0] and [1,1] both describe a single square.
+        """
+        return max(extent[0], 1), max(extent[1], 1)
+
+    def footprint_slices(self, position: list[int], extent: list[int]):
+        """
+        Returns the slices of the squares covered by a piece at position, 
+        or None if the piece would not fit on the board.
+        """
+        width, height = self.footprint(extent)
+        x, y = position
+        if x < 0 or y < 0 or x + width > self.size[0] or y + height > self.size[1]:
+            return None
+        return slice(x, x + width), slice(y, y + height)
+
+    def occupy(self, piece: Piece, position: list[int]):
+        """
+        Writes the piece into the map and the occupancy grid. 
+        The caller is responsible for checking that the squares are free.
+        """
+        if piece.slot is None:
+            if self.free_slots:
+                piece.slot = self.free_slots.pop()
+                self.piece_table[piece.slot] = piece
+            else:
+                piece.slot = len(self.piece_table)
+                self.piece_table.append(piece)
+                if piece.slot >= len(self.slot_is_unit):
+                    self.slot_is_unit = np.resize(self.slot_is_unit, 2 * len(self.slot_is_unit))
+                    self.slot_player = np.resize(self.slot_player, 2 * len(self.slot_player))
+                    self.slot_height = np.resize(self.slot_height, 2 * len(self.slot_height))
+            self.slot_is_unit[piece.slot] = isinstance(piece, Unit)
+            self.slot_player[piece.slot] = getattr(piece, 'player', 0) or 0
+            self.slot_height[piece.slot] = piece.height
+        squares = self.footprint_slices(position, piece.extent)
+        self.occupancy[squares] = piece.slot
+        self.map[squares] = piece
+        self.version += 1
+        self.hash ^= zobrist_key(ZOBRIST_PIECE, piece.roster_index, position[0], position[1])
+        for listener in self.listeners:
+            listener.on_occupy(piece, squares)
+
+    def vacate(self, piece: Piece):
+        """
+        Clears the squares covered by the piece and releases its slot in the piece table.
+        """
+        if piece.slot is None:
+            return
+        squares = self.footprint_slices(piece.position, piece.extent)
+        self.occupancy[squares] = -1
+        self.map[squares] = None
+        self.version += 1
+        self.hash ^= zobrist_key(ZOBRIST_PIECE, piece.roster_index, piece.position[0], piece.position[1])
+        for listener in self.listeners:
+            listener.on_vacate(piece, squares)
+        self.piece_table[piece.slot] = None
+        self.free_slots.append(piece.slot)
+        piece.slot = None
+
+    def rehash(self) -> int:
+        """
+        Computes the Zobrist hash of the position from scratch. The incremental hash always equals it.
+        """
+        game = self.game
+        value = zobrist_key(ZOBRIST_ACTIVE_PLAYER, game.active_player or 0)
+        value ^= zobrist_key(ZOBRIST_GAME_TURN, game.rules.game_turn if game.rules is not None else 0)
+        for piece in game.roster:
+            if piece.slot is not None:
+                value ^= zobrist_key(ZOBRIST_PIECE, piece.roster_index, piece.position[0], piece.position[1])
+            for name in piece.state_fields:
+                field = getattr(type(piece), name, None)
+                if isinstance(field, HashedField) and hasattr(piece, field.attribute):
+                    value ^= zobrist_key(ZOBRIST_FIELD, piece.roster_index, field.field_id, getattr(piece, name))
+        return value
+
+    def set_terrain(self, squares, height: float):
+        """
+        Sets the terrain height of the squares, given as an index into the board, e.g. slices.
+        Listeners with an on_terrain(squares) method are notified.
+        """
+        self.terrain[squares] = height
+        self.version += 1
+        for listener in self.listeners:
+            if hasattr(listener, 'on_terrain'):
+                listener.on_terrain(squares)
+
+    def piece_at(self, position: list[int]):
+        """
+        Returns the piece covering the square at position, or None.
+        """
+        slot = self.occupancy[position[0], position[1]]
+        return None if slot < 0 else self.piece_table[slot]
+
+    def is_occupied(self, position: list[int], extent: list[int] = [0,0]):
         """
         position: The position to check
         extent: The extent of the piece, given a list of coordinates relative to the position
         
-        Returns True if the position is occupied, False otherwise
+        Returns True if the position is occupied or the piece would not fit on the board, False otherwise
         """
+        squares = self.footprint_slices(position, extent)
+        if squares is None:
+            return True
+        return bool((self.occupancy[squares] >= 0).any())
 
-        if extent == [0,0]:
-            return self.map[*position] is not None
-        else:
-            for i in range(extent[0]):
-                for j in range(extent[1]):
-                    if self.map[position[0]+i, position[1]+j] is not None:
-                        return True
-            return False
+    def legal_placements(self, extent: list[int] = [0,0], ignore: Piece = None) -> np.ndarray:
+        """
+        Returns a boolean array of the board size, which is True for every position 
+        a piece of the given extent can be placed at.
+
+        extent: The extent of the piece
+        ignore: A piece whose own squares are treated as free, e.g. the piece that is about to move
+        """
+        blocked = self.occupancy >= 0
+        if ignore is not None and ignore.slot is not None:
+            blocked &= self.occupancy != ignore.slot
+        return self.free_footprints(blocked, extent)
+
+    def free_footprints(self, blocked: np.ndarray, extent: list[int] = [0,0]) -> np.ndarray:
+        """
+        Returns a boolean array of the board size, which is True for every position at which 
+        a piece of the given extent covers none of the blocked squares.
+        """
+        width, height = self.footprint(extent)
+        # Summed-area table of the blocked squares, so every footprint is tested with four lookups
+        table = np.zeros((self.size[0] + 1, self.size[1] + 1), dtype=np.int32)
+        table[1:, 1:] = blocked.cumsum(axis=0, dtype=np.int32).cumsum(axis=1, dtype=np.int32)
+        counts = table[width:, height:] - table[:-width, height:] - table[width:, :-height] + table[:-width, :-height]
 
+        legal = np.zeros(self.size, dtype=bool)
+        legal[:counts.shape[0], :counts.shape[1]] = counts == 0
+        return legal
 
-    def in_range(self, origin, range, type_of_interest = 'Any'):
+    def legal_positions(self, extent: list[int] = [0,0], ignore: Piece = None) -> list[tuple[int, int]]:
+        """
+        Returns a list of all positions a piece of the given extent can be placed at.
+        """
+        xs, ys = np.nonzero(self.legal_placements(extent, ignore))
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def movement_costs(self, piece: Piece, distance: float) -> np.ndarray:
+        """
+        Returns the cost of the shortest move of the piece to every position, in game units,
+        or inf where the position cannot be reached within distance.
+
+        Moves go square by square, orthogonally for gridsize and diagonally for sqrt(2) gridsize,
+        without cutting the corners of blocked squares. Every square of the footprint must stay clear
+        of other pieces and impassable terrain, and entering difficult terrain costs twice as much.
+        The result is cached until the board changes and must not be modified.
+        """
+        if self.movement_cache_version != self.version:
+            self.movement_cache.clear()
+            self.movement_cache_version = self.version
+        key = (piece.id, distance)
+        costs = self.movement_cache.get(key)
+        if costs is not None:
+            return costs
+
+        blocked = (self.terrain >= 1) | (self.occupancy >= 0)
+        if piece.slot is not None:
+            blocked &= self.occupancy != piece.slot
+        passable = self.free_footprints(blocked, piece.extent)
+        easy_going = self.free_footprints((self.terrain > 0) & (self.terrain < 1), piece.extent)
+        step_factor = np.where(easy_going, 1.0, 2.0) * self.gridsize
+
+        # Only the window the piece can possibly reach is relaxed
+        reach = int(np.floor(distance / self.gridsize))
+        x, y = piece.position
+        x0, x1 = max(x - reach, 0), min(x + reach + 1, self.size[0])
+        y0, y1 = max(y - reach, 0), min(y + reach + 1, self.size[1])
+        window_passable = passable[x0:x1, y0:y1]
+        window_factor = step_factor[x0:x1, y0:y1]
+        costs = np.full(window_passable.shape, np.inf)
+        costs[x - x0, y - y0] = 0
+
+        # Cost of the step from every neighbour onto every square, inf where the step is not allowed
+        open_padded = np.zeros((costs.shape[0] + 2, costs.shape[1] + 2), dtype=bool)
+        open_padded[1:-1, 1:-1] = window_passable
+        rows, columns = costs.shape
+        neighbours = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if dx == 0 and dy == 0:
+                    continue
+                allowed = window_passable
+                if dx and dy:
+                    allowed = allowed & open_padded[1 - dx:1 - dx + rows, 1:1 + columns] \
+                        & open_padded[1:1 + rows, 1 - dy:1 - dy + columns]
+                step = np.where(allowed, window_factor * (np.sqrt(2) if dx and dy else 1), np.inf)
+                neighbours.append((1 - dx, 1 - dy, step))
+
+        # Vectorized Bellman-Ford relaxation over the eight neighbours. Every step costs at least gridsize,
+        # so no shortest path within distance has more than reach steps
+        padded = np.full(open_padded.shape, np.inf)
+        candidate = np.empty_like(costs)
+        for _ in range(reach):
+            padded[1:-1, 1:-1] = costs
+            best = costs.copy()
+            for x_offset, y_offset, step in neighbours:
+                np.add(padded[x_offset:x_offset + rows, y_offset:y_offset + columns], step, out=candidate)
+                np.minimum(best, candidate, out=best)
+            if np.array_equal(best, costs):
+                break
+            costs = best
+
+        result = np.full(self.size, np.inf)
+        result[x0:x1, y0:y1] = np.where(costs <= distance + 1e-9, costs, np.inf)
+        result.flags.writeable = False
+        self.movement_cache[key] = result
+        return result
+
+    def reachable_positions(self, piece: Piece, distance: float) -> list[tuple[int, int]]:
+        """
+        Returns the positions the piece can move to within distance, excluding its current position.
+        """
+        reachable = np.isfinite(self.movement_costs(piece, distance))
+        reachable[piece.position[0], piece.position[1]] = False
+        xs, ys = np.nonzero(reachable)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def of_type(self, slots: np.ndarray, type_of_interest: str = 'Any', players: list[int] = None) -> np.ndarray:
+        """
+        Returns a boolean array, which is True where the piece table slots hold a piece of interest.
+
+        slots: Values taken from the occupancy grid, -1 for empty squares
+        type_of_interest: The type of pieces to consider. Can be 'Any', 'Unit', 'Piece'
+        players: If given, only units of these players are of interest
+        """
+        occupied = slots >= 0
+        lookup = np.where(occupied, slots, 0)
+        match type_of_interest:
+            case 'Any':
+                mask = np.ones(slots.shape, dtype=bool)
+            case 'Unit':
+                mask = occupied & self.slot_is_unit[lookup]
+            case 'Piece':
+                mask = occupied
+            case _:
+                raise ValueError(f'Unknown type of interest: {type_of_interest}')
+        if players is not None:
+            # Decide per slot first, the piece table is much smaller than the squares
+            slot_of_player = np.zeros(len(self.slot_player), dtype=bool)
+            for player in players:
+                slot_of_player |= self.slot_player == player
+            mask &= occupied & slot_of_player[lookup]
+        return mask
+
+    def in_range_batch(self, origins, range, type_of_interest = 'Any', players: list[int] = None):
+        """
+        Applies the range stencil to many origins at once.
+
+        Returns the arrays xs, ys and hits of shape (number of origins, stencil size).
+        hits is True where the square (xs, ys) is on the board, within range of the 
+        respective origin and holds something of interest.
+        """
+        dx, dy = disk_stencil(range, self.gridsize)
+        origins = np.asarray(origins, dtype=np.int64).reshape(-1, 2)
+        xs = origins[:, 0:1] + dx
+        ys = origins[:, 1:2] + dy
+        hits = (xs >= 0) & (xs < self.size[0]) & (ys >= 0) & (ys < self.size[1])
+        slots = np.full(xs.shape, -1, dtype=np.int32)
+        slots[hits] = self.occupancy[xs[hits], ys[hits]]
+        hits &= self.of_type(slots, type_of_interest, players)
+        return xs, ys, hits
+
+    def in_range(self, origin, range, type_of_interest = 'Any', players: list[int] = None):
         """
         Returns a list of coordinates of pieces within range of the origin
 
         origin: The origin of the range
         range: The range of the origin
         type_of_interest: The type of pieces to consider. Can be 'Any', 'Unit', 'Piece'
+        players: If given, only squares of units of these players are returned
         """
-        def is_type_of_interest(piece):
-            match type_of_interest:
-                case 'Any':
-                    return True
-                case 'Unit':
-                    return isinstance(piece, Unit)
-                case 'Piece':
-                    return isinstance(piece, Piece)
-
-        # First, get the rectangular box around the origin
-        x_range = self.x[(self.x >= origin[0] - range)&
-                         (self.x<=origin[0] + range)]
-        y_range = self.y[(self.y >= origin[1] - range)&
-                            (self.y<=origin[1] + range)]
-        
-        # Then, check if the pieces in the box are within range
-        in_range = []
-        for x in x_range:
-            for y in y_range:
-                if is_type_of_interest(self.map[x,y]):
-                    # omit self
-                    if x == origin[0] and y == origin[1]:
+        xs, ys, hits = self.in_range_batch([origin], range, type_of_interest, players)
+        return list(zip(xs[hits].tolist(), ys[hits].tolist()))
+
+    def count_in_range(self, origins, range, type_of_interest = 'Any', players: list[int] = None) -> np.ndarray:
+        """
+        Returns the number of squares of interest within range, for each of the origins.
+        """
+        if len(origins) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.in_range_batch(origins, range, type_of_interest, players)[2].sum(axis=1)
+
+
+class SpatialIndex:
+    """
+    Uniform buckets of the units on a board, for proximity queries whose cost grows with the number 
+    of units nearby instead of the number of squares in range. 
+    The board notifies the index whenever a unit occupies or vacates squares.
+
+    Distances are measured from the origin square to the nearest square covered by a unit, in game units.
+    Results are ordered by the roster index of the units, so that they do not depend on the history of the board.
+    """
+    def __init__(self, board: 'Board', bucket_size: int = 8):
+        self.board = board
+        self.bucket_size = bucket_size
+        self.buckets = {} # (bucket x, bucket y) -> {unit: None}
+        self.bucket_of = {} # unit -> bucket
+        self.max_footprint = 1 # Largest footprint of an indexed unit, in squares
+        board.listeners.append(self)
+
+    # Board listener
+    def on_occupy(self, piece: Piece, squares):
+        if not isinstance(piece, Unit):
+            return
+        bucket = (squares[0].start // self.bucket_size, squares[1].start // self.bucket_size)
+        self.buckets.setdefault(bucket, {})[piece] = None
+        self.bucket_of[piece] = bucket
+        self.max_footprint = max(self.max_footprint, *self.board.footprint(piece.extent))
+
+    def on_vacate(self, piece: Piece, squares):
+        bucket = self.bucket_of.pop(piece, None)
+        if bucket is not None:
+            units = self.buckets[bucket]
+            del units[piece]
+            if not units:
+                del self.buckets[bucket]
+
+    def distance(self, origin, unit: Unit) -> float:
+        return self.gap((origin[0], origin[0], origin[1], origin[1]), unit)
+
+    def bounds(self, unit: Unit) -> tuple[int, int, int, int]:
+        """
+        Returns the first and last square covered by the unit in each dimension, as (x0, x1, y0, y1).
+        """
+        width, height = self.board.footprint(unit.extent)
+        x, y = unit.position
+        return x, x + width - 1, y, y + height - 1
+
+    def gap(self, bounds: tuple[int, int, int, int], unit: Unit) -> float:
+        """
+        Returns the distance between the nearest squares of an area, given by its bounds, and a unit.
+        """
+        x0, x1, y0, y1 = bounds
+        ux0, ux1, uy0, uy1 = self.bounds(unit)
+        dx = max(ux0 - x1, 0, x0 - ux1)
+        dy = max(uy0 - y1, 0, y0 - uy1)
+        return (dx * dx + dy * dy) ** 0.5 * self.board.gridsize
+
+    def units_in_buckets(self, x0: int, x1: int, y0: int, y1: int, players: list[int] = None) -> list[Unit]:
+        """
+        Returns the units of the given players anchored in the buckets covering the squares x0..x1, y0..y1.
+        """
+        size = self.bucket_size
+        units = []
+        for bx in range(x0 // size, x1 // size + 1):
+            for by in range(y0 // size, y1 // size + 1):
+                bucket = self.buckets.get((bx, by))
+                if bucket is not None:
+                    units.extend(unit for unit in bucket if players is None or unit.player in players)
+        return units
+
+    def units_within(self, origin, range: float, players: list[int] = None, bounds: tuple = None) -> list[Unit]:
+        """
+        Returns the units of the given players, or of all players, within range of the origin.
+
+        bounds: Measure the range from an area (x0, x1, y0, y1) instead of the origin square
+        """
+        x0, x1, y0, y1 = bounds if bounds is not None else (origin[0], origin[0], origin[1], origin[1])
+        reach = int(np.floor(range / self.board.gridsize))
+        # Units anchored up to a footprint before the area can still reach into it
+        margin = reach + self.max_footprint - 1
+        candidates = self.units_in_buckets(x0 - margin, x1 + reach, y0 - margin, y1 + reach, players)
+        units = [unit for unit in candidates if self.gap((x0, x1, y0, y1), unit) <= range]
+        units.sort(key=lambda unit: unit.roster_index)
+        return units
+
+    def nearest(self, origin, players: list[int] = None) -> tuple[Unit, float] | None:
+        """
+        Returns the nearest unit of the given players and its distance, or None if there is none.
+        Rings of buckets are searched outwards until no closer unit can exist. Ties go to the lower roster index.
+        """
+        if not self.buckets:
+            return None
+        size = self.bucket_size
+        bx, by = origin[0] // size, origin[1] // size
+        max_ring = max(self.board.size) // size + 1
+        best, best_key = None, None
+        for ring in range(max_ring + 1):
+            # Any unit outside of the rings searched so far is at least this far away
+            if best is not None and (ring - 1) * size - self.max_footprint + 1 > best_key[0] / self.board.gridsize:
+                break
+            for x in range(bx - ring, bx + ring + 1):
+                for y in range(by - ring, by + ring + 1):
+                    if max(abs(x - bx), abs(y - by)) != ring:
                         continue
-                    #calculate actual distance
-                    distance = np.sqrt((x-origin[0])**2 + (y-origin[1])**2)
-                    if distance <= range:
-                        in_range.append((x,y))
-        return in_range
-        
+                    for unit in self.buckets.get((x, y), ()):
+                        if players is not None and unit.player not in players:
+                            continue
+                        key = (self.distance(origin, unit), unit.roster_index)
+                        if best_key is None or key < best_key:
+                            best, best_key = unit, key
+        return None if best is None else (best, best_key[0])
+
+    def nearest_enemy(self, unit: Unit) -> tuple[Unit, float] | None:
+        """
+        Returns the nearest unit of another player and its distance, or None if there is none.
+        """
+        enemies = [player for player in self.board.game.players if player != unit.player]
+        return self.nearest(unit.position, enemies)
+
+    def enemy_pairs_within(self, range: float) -> list[tuple[Unit, Unit]]:
+        """
+        Returns all pairs of units of different players within range of each other.
+        Every pair is returned once, ordered by roster index.
+        """
+        pairs = []
+        for unit in sorted(self.bucket_of, key=lambda unit: unit.roster_index):
+            for other in self.units_within(None, range, bounds=self.bounds(unit)):
+                if other.roster_index > unit.roster_index and other.player != unit.player:
+                    pairs.append((unit, other))
+        return pairs
+
+
+class VisibilityCache:
+    """
+    Line of sight between squares of a board, with a cache of the results.
+
+    A ray runs from the center of one square to the center of another and is rasterized at
+    half-square steps. It is blocked by any square in between whose terrain, plus the height of the
+    piece on it, reaches the height of the ray. The ray starts and ends at eye height, i.e. the
+    terrain under the observer plus its height, but at least 1 above the terrain.
+    Pieces of height 0 thus never block, and neither do the pieces at both ends of the ray.
+    Terrain that is crossed next to the target without blocking grants cover.
+
+    Results are cached per pair of squares. The board notifies the cache whenever squares are 
+    occupied or vacated, and only the rays crossing these squares are invalidated.
+    Changing the height of a piece without moving it is not tracked, call clear() afterwards.
+    """
+    def __init__(self, board: 'Board', max_entries: int = 200000):
+        self.board = board
+        self.max_entries = max_entries
+        self.entries = {} # (x0, y0, x1, y1) -> (visible, cover)
+        self.rays_through = {} # square index -> keys of the cached rays crossing it
+        self.square_index = np.arange(board.size[0] * board.size[1]).reshape(board.size)
+        board.listeners.append(self)
+
+    def clear(self):
+        self.entries.clear()
+        self.rays_through.clear()
+
+    # Board listener
+    def invalidate(self, squares):
+        for index in np.ravel(self.square_index[squares]).tolist():
+            for key in self.rays_through.pop(index, ()):
+                self.entries.pop(key, None)
+
+    def on_occupy(self, piece: Piece, squares):
+        self.invalidate(squares)
+
+    def on_vacate(self, piece: Piece, squares):
+        self.invalidate(squares)
+
+    def on_terrain(self, squares):
+        self.invalidate(squares)
+
+    def trace(self, origins: np.ndarray, targets: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Traces many rays at once, without the cache.
+
+        Returns the arrays visible and cover of shape (number of rays,), 
+        and the square indices crossed by every ray, shape (number of rays, samples), padded with -1.
+        """
+        board = self.board
+        origins = np.asarray(origins, dtype=np.int64).reshape(-1, 2)
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1, 2)
+        delta = targets - origins
+        steps = np.maximum(2 * np.abs(delta).max(axis=1), 1)
+        t = np.arange(steps.max() + 1) / steps[:, None]
+        on_ray = t <= 1
+        t = np.minimum(t, 1)
+        xs = np.floor(origins[:, 0:1] + t * delta[:, 0:1] + 0.5).astype(np.int64)
+        ys = np.floor(origins[:, 1:2] + t * delta[:, 1:2] + 0.5).astype(np.int64)
+
+        # Pieces at both ends do not block the ray
+        origin_slots = board.occupancy[origins[:, 0], origins[:, 1]]
+        target_slots = board.occupancy[targets[:, 0], targets[:, 1]]
+        slots = board.occupancy[xs, ys]
+        own = (slots == origin_slots[:, None]) | (slots == target_slots[:, None])
+        piece_height = np.where((slots >= 0) & ~own, board.slot_height[np.maximum(slots, 0)], 0)
+        terrain = board.terrain[xs, ys]
+
+        def eye_height(points, point_slots):
+            height = np.where(point_slots >= 0, board.slot_height[np.maximum(point_slots, 0)], 0)
+            return board.terrain[points[:, 0], points[:, 1]] + np.maximum(height, 1)
+        origin_eye, target_eye = eye_height(origins, origin_slots), eye_height(targets, target_slots)
+        ray_height = origin_eye[:, None] + t * (target_eye - origin_eye)[:, None]
+
+        between = on_ray & ~((xs == origins[:, 0:1]) & (ys == origins[:, 1:2])) \
+            & ~((xs == targets[:, 0:1]) & (ys == targets[:, 1:2]))
+        blocking = between & (terrain + piece_height >= ray_height)
+        near_target = np.maximum(np.abs(xs - targets[:, 0:1]), np.abs(ys - targets[:, 1:2])) <= 1
+        visible = ~blocking.any(axis=1)
+        cover = visible & (between & near_target & (terrain > 0)).any(axis=1)
+        crossed = np.where(on_ray, xs * board.size[1] + ys, -1)
+        return visible, cover, crossed
+
+    def check(self, origin, targets) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the arrays visible and cover for the rays from the origin to each of the targets.
+        Only the rays missing in the cache are traced, all in one batch.
+        """
+        x0, y0 = int(origin[0]), int(origin[1])
+        keys = [(x0, y0, int(x), int(y)) for x, y in targets]
+        visible = np.zeros(len(keys), dtype=bool)
+        cover = np.zeros(len(keys), dtype=bool)
+        missing = []
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is None:
+                missing.append(i)
+            else:
+                visible[i], cover[i] = entry
+        if missing:
+            if len(self.entries) + len(missing) > self.max_entries:
+                self.clear()
+            traced_visible, traced_cover, crossed = self.trace([origin] * len(missing), [keys[i][2:] for i in missing])
+            visible[missing], cover[missing] = traced_visible, traced_cover
+            for i, entry, squares in zip(missing, zip(traced_visible.tolist(), traced_cover.tolist()), crossed.tolist()):
+                key = keys[i]
+                self.entries[key] = entry
+                for index in set(squares):
+                    if index >= 0:
+                        self.rays_through.setdefault(index, set()).add(key)
+        return visible, cover
+
+    def line_of_sight(self, origin, target) -> bool:
+        return bool(self.check(origin, [target])[0][0])
+
 
 class RuleSystem(ABC):
     game: Game
@@ -202,8 +930,19 @@ class RuleSystem(ABC):
     def __init__(self, game: 'Game'):
         game.set_rules(self)
         self.game = game
-        self.game_turn = 0
+        self._game_turn = 0
         self.controlled_unit = None
+        self.input_timeout = None # Seconds to wait for a selection, None waits forever
+
+    @property
+    def game_turn(self) -> int:
+        return self._game_turn
+
+    @game_turn.setter
+    def game_turn(self, turn: int):
+        if self.game.board is not None:
+            self.game.board.hash ^= zobrist_key(ZOBRIST_GAME_TURN, self._game_turn) ^ zobrist_key(ZOBRIST_GAME_TURN, turn)
+        self._game_turn = turn
 
     @abstractmethod
     async def game_sequence(self) -> Generator[Any, None, None]:
@@ -224,38 +963,59 @@ class RuleSystem(ABC):
     def set_api(self, api: 'API'):
         self.api = api
 
+    def get_state(self) -> tuple:
+        """
+        Returns the state of the rules for a game snapshot. Rule systems with more state extend this.
+        """
+        controlled = None if self.controlled_unit is None else self.controlled_unit.roster_index
+        return (self.game_turn, controlled)
+
+    def set_state(self, state: tuple):
+        self.game_turn, controlled = state[:2]
+        self.controlled_unit = None if controlled is None else self.game.roster[controlled]
+
     async def get_unit_selection(self, selectable_units: list[Unit]):
-        self.api.select_unit(selectable_units)
-        await self.wait_for_input(selectable_units)
+        await self.wait_for_input(selectable_units, 'unit')
 
     async def get_option_selection(self, options: list[str]):
-        self.api.select_option(options)
-        await self.wait_for_input(options)
+        await self.wait_for_input(options, 'option')
 
     async def get_tile_selection(self, tile_options: list[tuple[int, int]]):
-        self.api.select_tile(tile_options)
-        await self.wait_for_input(tile_options)
+        await self.wait_for_input(tile_options, 'tile')
 
-    async def wait_for_input(self, options):
+    def request_input(self, options, kind: str):
+        """
+        Asks the API for a selection of the given kind, which can be 'unit', 'option' or 'tile'.
         """
-        Waits for input from the user.
+        match kind:
+            case 'unit':
+                self.api.select_unit(options)
+            case 'option':
+                self.api.select_option(options)
+            case 'tile':
+                self.api.select_tile(options)
+            case _:
+                raise ValueError(f'Unknown kind of input: {kind}')
+
+    async def wait_for_input(self, options, kind: str, timeout: float = None):
         """
-        print('Waiting for input')
+        Requests input from the user and waits until a valid selection is made.
+        The rules are woken up by the API as soon as the selection is done, without polling.
 
-        # If the game is not running, wait for the game to resume
-        while not self.api.state == "game_running":
-            await asyncio.sleep(0.1)
+        timeout: Seconds to wait for each selection. Defaults to the input_timeout of the rules.
+        Raises asyncio.TimeoutError if no selection is made in time, 
+        and asyncio.CancelledError if the request is cancelled through the API.
+        """
+        timeout = self.input_timeout if timeout is None else timeout
+        self.request_input(options, kind)
+        self.game.logger.debug('Waiting for input')
+        await self.api.wait_for_selection(timeout)
 
         # If the selection is not in the options, request a new selection
-        if self.api.selection not in options:
-            print(f'Invalid selection: {self.api.selection}. We shall try this again!')
-            match type(options[0]):
-                case str():
-                    self.api.select_option(options)
-                case tuple():
-                    self.api.select_tile(options)
-                case Unit():
-                    self.api.select_unit(options)            
+        while self.api.selection not in options:
+            self.game.logger.info(f'Invalid selection: {self.api.selection}. We shall try this again!')
+            self.request_input(options, kind)
+            await self.api.wait_for_selection(timeout)
 
         return True
 
@@ -271,6 +1031,10 @@ class API():
         self.board = game.board
         self.current_options = []
         self.selection = None
+        # Future awaited by the rules while a selection is pending, resolved by selection_done
+        self.pending = None
+        # Receives every selection, e.g. a replay.ReplayWriter
+        self.recorder = None
 
         # Some double pointers
         self.game.api = self
@@ -289,6 +1053,9 @@ class API():
         # The UI has provided the requested input and the game continures
         self.machine.add_transition(trigger='selection_done', source=['wait_for_option_sel','wait_for_unit_sel','wait_for_tile_sel'],
                                      dest='game_running', before='set_selection')
+        # The request is withdrawn without a selection, e.g. on a timeout
+        self.machine.add_transition(trigger='cancel_selection', source=['wait_for_option_sel','wait_for_unit_sel','wait_for_tile_sel'],
+                                     dest='game_running', before='cancel_pending')
 
 
     def set_options(self, options):
@@ -299,11 +1066,129 @@ class API():
         self.current_options = options
     
     def set_selection(self, selection):
-        print(f'Selection made: {selection} of type {type(selection)}')
+        self.game.logger.debug(f'Selection made: {selection} of type {type(selection)}')
         self.selection = selection
+        if self.recorder is not None:
+            self.recorder.record(selection)
+        if self.pending is not None and not self.pending.done():
+            self.pending.set_result(selection)
+
+    def cancel_pending(self):
+        if self.pending is not None and not self.pending.done():
+            self.pending.cancel()
+
+    async def wait_for_selection(self, timeout: float = None):
+        """
+        Waits until the requested selection is done and returns it.
+        Returns immediately if no selection is pending.
+
+        timeout: Seconds to wait, None waits forever
+        """
+        if self.state == 'game_running':
+            return self.selection
+        self.pending = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(self.pending, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Withdraw the request, so that the UI stops offering it
+            if self.state != 'game_running':
+                self.cancel_selection()
+            raise
+        finally:
+            self.pending = None
 
     def set_active_player(self, player):
         self.game.active_player = player
 
     def get_active_player(self):
-        return self.game.active_player
\ No newline at end of file
+        return self.game.active_player
+
+
+class DecisionProvider(ABC):
+    """
+    Answers requests for input directly, instead of a user clicking in the UI.
+    Implementations can be random, scripted or an AI.
+    """
+
+    @abstractmethod
+    def choose(self, kind: str, options: list, game: Game) -> Any:
+        """
+        Returns one of the options.
+
+        kind: The kind of selection requested. Can be 'unit', 'option' or 'tile'
+        options: The selectable units, option strings or tiles
+        game: The game the selection is made in, with the active player set
+        """
+        pass
+
+
+@types.coroutine
+def suspend_for_selection(request: tuple[str, list]):
+    """
+    Suspends the game sequence and hands the request for input to whoever drives the coroutine.
+    The driver resumes the sequence by sending the selection.
+    """
+    selection = yield request
+    return selection
+
+
+class HeadlessAPI(API):
+    """
+    An API without UI and state machine, for games that run at full speed.
+    Every request for input is answered immediately by the decision provider of the active player,
+    so the game sequence never has to wait.
+
+    Players without a decision provider are controlled externally: the game sequence then suspends with 
+    a (kind, options) request and is resumed by sending it the selection, e.g. by an environment for training.
+    """
+    state = 'game_running'
+
+    def __init__(self, game: 'Game', rules: RuleSystem, providers: DecisionProvider | dict[int, DecisionProvider]):
+        """
+        providers: A decision provider used for all players, or a dict of decision providers by player
+        """
+        self.game = game
+        self.rules = rules
+        self.board = game.board
+        self.current_options = []
+        self.selection = None
+        self.pending = None
+        self.recorder = None
+        self.request_kind = None
+        self.decisions = 0
+        if isinstance(providers, DecisionProvider):
+            providers = {player: providers for player in game.players}
+        self.providers = providers
+
+        # Some double pointers
+        self.game.api = self
+        self.rules.set_api(self)
+
+    def request_selection(self, kind: str, options: list):
+        self.set_options(options)
+        self.request_kind = kind
+        self.decisions += 1
+        provider = self.providers.get(self.game.active_player)
+        if provider is None:
+            self.state = f'wait_for_{kind}_sel'
+            return
+        self.set_selection(provider.choose(kind, options, self.game))
+
+    def select_option(self, options):
+        self.request_selection('option', options)
+
+    def select_unit(self, options):
+        self.request_selection('unit', options)
+
+    def select_tile(self, options):
+        self.request_selection('tile', options)
+
+    def selection_done(self, selection):
+        self.set_selection(selection)
+        self.state = 'game_running'
+
+    async def wait_for_selection(self, timeout: float = None):
+        if self.state == 'game_running':
+            return self.selection
+        self.selection_done(await suspend_for_selection((self.request_kind, self.current_options)))
+        return self.selection
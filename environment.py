@@ -0,0 +1,151 @@
+"""
+Gym-style environment around a headless OPR_Firefight game, for training agents.
+
+One player is controlled through step(action), the other players by decision providers.
+Every request for input of the controlled player is one step. Actions are integers:
+the first len(OPTIONS) actions select an option button, the others select the board square
+with index row * columns + column, i.e. a tile or the unit on it.
+"""
+import numpy as np
+
+import engine
+import selfplay
+import onepagerules as opr
+
+
+# Option buttons offered by OPR_Firefight, in action order
+OPTIONS = ('Hold', 'Advance', 'Rush', 'Charge', 'Confirm charge', 'Back')
+
+# Feature planes of the observation
+PLANES = ('occupied', 'own_unit', 'enemy_unit', 'activated', 'shaken', 'wounds', 'movement', 'selectable')
+
+
+class FirefightEnv:
+    """
+    Observations are float32 feature planes of shape (len(PLANES), rows, columns). The array is
+    allocated once and updated in place: geometry through the board listener, whenever a piece
+    occupies or vacates squares, and unit stats only on the squares of the units.
+    Consumers that keep observations across steps must copy them.
+    """
+    def __init__(self, armies=('skirmish', 'skirmish'), board_size=(12, 12), agent_player: int = 1,
+                 opponent: str = 'random', seed: int = None):
+        self.armies = armies
+        self.board_size = tuple(board_size)
+        self.agent_player = agent_player
+        self.opponent = opponent
+        self.seed = seed
+        self.episodes = 0
+
+        self.n_actions = len(OPTIONS) + self.board_size[0] * self.board_size[1]
+        self.observation = np.zeros((len(PLANES),) + self.board_size, dtype=np.float32)
+        self.action_mask = np.zeros(self.n_actions, dtype=bool)
+        self.planes = {name: self.observation[i] for i, name in enumerate(PLANES)}
+        self.squares_of_mask = self.action_mask[len(OPTIONS):].reshape(self.board_size)
+
+        self.game = None
+        self.sequence = None
+        self.request = None
+        self.done = True
+
+    def reset(self, seed: int = None):
+        """
+        Starts a new game and runs it up to the first decision of the agent.
+        Returns the observation and an info dict with the action mask.
+        """
+        if seed is None:
+            seed = None if self.seed is None else self.seed + self.episodes
+        self.episodes += 1
+        game_seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2**31)
+
+        providers = {player: None if player == self.agent_player else selfplay.AGENTS[self.opponent](game_seed * 2 + player)
+                     for player in (1, 2)}
+        self.game = selfplay.setup_game(game_seed, self.armies, providers, self.board_size)
+        self.game.board.listeners.append(self)
+
+        # Fill the planes once, afterwards they are only updated
+        self.observation[:] = 0
+        for piece in self.game.board.pieces.values():
+            self.on_occupy(piece, self.game.board.footprint_slices(piece.position, piece.extent))
+
+        self.sequence = self.game.rules.game_sequence()
+        self.done = False
+        self.advance(None)
+        return self.observation, self.info()
+
+    def step(self, action: int):
+        """
+        Answers the pending request with the action and runs the game up to the next decision of the agent.
+        Returns observation, reward, terminated, truncated and info.
+        The reward is 1 for a win of the agent, -1 for a loss and 0 otherwise.
+        """
+        assert not self.done, 'The game is over, call reset() first'
+        self.advance(self.decode(action))
+        reward = 0.0
+        if self.done:
+            winner = self.game.rules.determine_winner()
+            reward = 0.0 if winner is None else (1.0 if winner == self.agent_player else -1.0)
+        return self.observation, reward, self.done, False, self.info()
+
+    def advance(self, selection):
+        try:
+            self.request = self.sequence.send(selection)
+        except StopIteration:
+            self.request = None
+            self.done = True
+        self.update_unit_planes()
+        self.update_action_mask()
+
+    def decode(self, action: int):
+        """
+        Translates an action index into the selection for the pending request.
+        """
+        if action < len(OPTIONS):
+            return OPTIONS[action]
+        row, column = divmod(action - len(OPTIONS), self.board_size[1])
+        if self.request[0] == 'unit':
+            return self.game.board.piece_at((row, column))
+        return (row, column)
+
+    def info(self) -> dict:
+        return {'action_mask': self.action_mask,
+                'request': None if self.request is None else self.request[0],
+                'game_turn': self.game.rules.game_turn}
+
+    # Board listener
+    def on_occupy(self, piece: engine.Piece, squares):
+        self.planes['occupied'][squares] = 1
+        if isinstance(piece, engine.Unit):
+            self.planes['own_unit' if piece.player == self.agent_player else 'enemy_unit'][squares] = 1
+
+    def on_vacate(self, piece: engine.Piece, squares):
+        for name in ('occupied', 'own_unit', 'enemy_unit', 'activated', 'shaken', 'wounds', 'movement'):
+            self.planes[name][squares] = 0
+
+    def update_unit_planes(self):
+        """
+        Writes the stats of every unit onto its squares. Costs O(units), no planes are rebuilt.
+        """
+        board = self.game.board
+        for unit in board.pieces.values():
+            if isinstance(unit, opr.OPRUnit):
+                squares = board.footprint_slices(unit.position, unit.extent)
+                self.planes['activated'][squares] = unit.activated
+                self.planes['shaken'][squares] = unit.shaken
+                self.planes['wounds'][squares] = unit.wounds
+                self.planes['movement'][squares] = unit.movement
+
+    def update_action_mask(self):
+        self.action_mask[:] = False
+        if self.request is None:
+            self.planes['selectable'][:] = 0
+            return
+        kind, options = self.request
+        for option in options:
+            match kind:
+                case 'option':
+                    self.action_mask[OPTIONS.index(option)] = True
+                case 'tile':
+                    self.squares_of_mask[option[0], option[1]] = True
+                case 'unit':
+                    self.squares_of_mask[option.position[0], option.position[1]] = True
+        self.planes['selectable'][:] = self.squares_of_mask
@@ -2,6 +2,10 @@ import pygame
 import engine
 import asyncio
 import logging
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
 
 DEBUG = True
 
@@ -17,30 +21,148 @@ DARKGRAY = (169, 169, 169)
 DARKRED = (139, 0, 0)
 
 
+# Colors of the board image
+THEMES = {
+    'default': {'board': (128, 128, 0), 'grid': WHITE, 'terrain': (110, 90, 50), 'impassable': (70, 55, 35)},
+}
+
 # Set up fonts
 font_size = 40
 
 pygame.init()
 
+
+class BoardSurfaceCache:
+    """
+    Pre-rendered board images, kept in memory with least recently used eviction.
+
+    A board image is composed of two layers, which are cached separately: the terrain layer, 
+    keyed by the terrain heights, the square size and the theme, and the grid layer, keyed by the 
+    board size, the square size and the theme. Changing the terrain re-renders only the terrain,
+    and resizing back to a recent size re-renders nothing.
+    """
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key: tuple, render) -> pygame.Surface:
+        """
+        Returns the surface cached under key, rendering it with render() if it is missing.
+        """
+        surface = self.entries.get(key)
+        if surface is None:
+            surface = self.entries[key] = render()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return surface
+
+    def grid_layer(self, board_size: tuple, square_size: tuple, theme: str) -> pygame.Surface:
+        def render():
+            rows, columns = board_size
+            width, height = square_size
+            layer = pygame.Surface((columns * width, rows * height), pygame.SRCALPHA)
+            for i in range(rows):
+                for j in range(columns):
+                    pygame.draw.rect(layer, THEMES[theme]['grid'], (j * width, i * height, width, height), 1)
+            return layer
+        return self.get(('grid', tuple(board_size), tuple(square_size), theme), render)
+
+    def terrain_layer(self, terrain: np.ndarray, square_size: tuple, theme: str, digest: tuple = None) -> pygame.Surface:
+        def render():
+            colors = THEMES[theme]
+            width, height = square_size
+            layer = pygame.Surface((terrain.shape[1] * width, terrain.shape[0] * height))
+            layer.fill(colors['board'])
+            for row, col in zip(*np.nonzero(terrain > 0)):
+                color = colors['impassable'] if terrain[row, col] >= 1 else colors['terrain']
+                layer.fill(color, (col * width, row * height, width, height))
+            return layer
+        digest = digest or self.digest(terrain)
+        return self.get(('terrain', digest, tuple(square_size), theme), render)
+
+    @staticmethod
+    def digest(terrain: np.ndarray) -> tuple:
+        return terrain.shape, zlib.crc32(np.ascontiguousarray(terrain).tobytes())
+
+    def board_image(self, board: engine.Board, square_size: tuple, theme: str = 'default', window: tuple = None) -> pygame.Surface:
+        """
+        Returns the image of the board with its terrain and grid. The surface is shared and must not be modified.
+
+        window: Only render the squares rows[r0:r1], columns[c0:c1], given as (r0, r1, c0, c1)
+        """
+        r0, r1, c0, c1 = window if window is not None else (0, board.size[0], 0, board.size[1])
+        terrain = board.terrain[r0:r1, c0:c1]
+        digest = self.digest(terrain)
+        def render():
+            image = self.terrain_layer(terrain, square_size, theme, digest).copy()
+            image.blit(self.grid_layer(terrain.shape, square_size, theme), (0, 0))
+            return image
+        return self.get(('board', digest, terrain.shape, tuple(square_size), theme), render)
+
+# Shared by all UIs of the process
+board_surfaces = BoardSurfaceCache()
+
+
+class FrameScheduler:
+    """
+    Paces the frames of the UI loop without blocking the event loop, so that the rules coroutine 
+    keeps running between frames. If a frame is late, e.g. because the game task was busy,
+    the missed frames are dropped instead of being caught up.
+    """
+    def __init__(self, fps: float = 30, clock=time.perf_counter, sleep=asyncio.sleep):
+        """
+        clock: Returns the time in seconds
+        sleep: Coroutine function that waits for a number of seconds. Tests pass a fake clock and sleep
+        """
+        self.frame_time = 1 / fps
+        self.clock = clock
+        self.sleep = sleep
+        self.next_frame = None
+        self.frames = 0
+        self.dropped = 0 # Frames missed because the loop was busy
+        self.idle = 0 # Frames in which nothing changed, so nothing was rendered
+
+    async def wait_for_next_frame(self):
+        now = self.clock()
+        if self.next_frame is None:
+            self.next_frame = now
+        elif now - self.next_frame > self.frame_time:
+            self.dropped += int((now - self.next_frame) // self.frame_time)
+            self.next_frame = now
+        self.next_frame += self.frame_time
+        self.frames += 1
+        await self.sleep(max(self.next_frame - self.clock(), 0))
+
 class UI:                                                                                                    
-    def __init__(self, board: engine.Board, api: engine.API):
+    def __init__(self, board: engine.Board, api: engine.API, theme: str = 'default', fps: float = 30):
             """
-            Initializes the game UI and generates Rect objects for each grid coordinate.
+            Initializes the game UI.
             Args:
                 board (engine.Board): The game board object containing the size of the board.
+                theme (str): The colors of the board image, a key of THEMES.
+                fps (float): The targeted frame rate. Frames are only rendered when something changed.
             Attributes:
                 SCREEN_WIDTH (int): The width of the game screen.
                 SCREEN_HEIGHT (int): The height of the game screen.
                 BOARD_WIDTH (int): The width of the game board on the screen.
                 BOARD_HEIGHT (int): The height of the game board on the screen.
                 screen (pygame.Surface): The Pygame surface representing the game screen.
-                grid_rects (list of list of pygame.Rect): A 2D list storing Rect objects for each grid cell.
             """
             self.board = board
             self.running = False            
             self.unit_clicked = None
             self.api = api
+            self.theme = theme
             self.logger = logging.getLogger('ui logger')
+            # The board image is rendered again when the terrain changes
+            self.board.listeners.append(self)
+            # Resizes are applied once the window size has been stable for resize_delay seconds
+            self.pending_resize = None
+            self.resize_delay = 0.15
+            self.scheduler = FrameScheduler(fps)
+            self.last_signature = None
 
             pygame.display.set_caption("Table Wars")
 
@@ -55,18 +177,31 @@ class UI:
             self.board_height = self.screen_height
             # Define the number of squares in the grid
             self.rows, self.columns = self.board.size
-            # Define the size of each square
-            self.square_width = self.board_width // self.columns
-            self.square_height = self.board_height // self.rows
 
-            # Load the pre-saved board image
-            board_image_filename = self.save_board_image()
-            self.board_image = pygame.image.load(board_image_filename)
+            # Camera: the squares are shown at a zoom factor relative to the size that fits the whole board
+            # into the board area, and the view is panned by view_offset, the board pixel at the top left of the area.
+            # Squares never get smaller than min_square_size, larger boards are panned instead
+            self.zoom = 1.0
+            self.min_square_size = 8
+            self.max_square_size = 200
+            self.view_offset = [0, 0]
+            self.dragging = False
+            self.update_square_size()
+
+            # Retained-mode rendering: every frame is described as a scene of (surface, rect) items, 
+            # and only the regions whose items changed since the last frame are redrawn
+            self.scene = [] # Items of the frame being built, in drawing order
+            self.shown = [] # Items currently on the screen
+            self.full_redraw = True
+            self.sprite_cache = {} # (letter, color, textcolor, square size) -> unit token
+            self.text_cache = OrderedDict() # (text, color) -> rendered text, least recently used first
+            self.max_cached_texts = 256
+            self.highlight_cache = {} # (color, pixel_inwards, square size) -> outline
+            self.overlay_cache = {} # (options, color, square size) -> (overlay of the options, offset)
+
+            self.board_image = self.render_board_image()
             self.reset_screen()
 
-            self.create_grid_rects()
-            self.update_unit_rects()
-
             # Set up font for displaying text
             self.font = pygame.font.SysFont(None, 30)
 
@@ -78,34 +213,100 @@ class UI:
 
             self.logger.debug('UI initialized')
 
-    def create_grid_rects(self):
-        #self.logger.debug('Creating grid rects')
-        # Initialize grid_rects to store the Rect objects for each grid cell
-        self.grid_rects = [[None for _ in range(self.columns)] for _ in range(self.rows)]
-        # Generate Rect objects for each grid cell
-        for row in range(self.rows):
-            for col in range(self.columns):
-                # Calculate the top-left corner of each grid square
-                top_left_x = col * self.square_width
-                top_left_y = row * self.square_height
-                # Create the Rect object
-                self.grid_rects[row][col] = pygame.Rect(top_left_x, top_left_y, self.square_width, self.square_height)
-
-    def update_unit_rects(self):
-        """
-        Generates Rect objects for each unit on the board.
-        """
-        #self.logger.debug('Updating unit rects')
-        # Generate Rect objects for each unit
-        for unit in self.board.pieces.values():
-            unit.rect = None
-            if unit.clickable:
-                row, col = unit.position
-                # Calculate the top-left corner of the grid square
-                top_left_x = col * self.square_width
-                top_left_y = row * self.square_height
-                # Create the Rect object
-                unit.rect = pygame.Rect(top_left_x, top_left_y, self.square_width, self.square_height)
+    def update_square_size(self):
+        """
+        Sets the size of the squares from the zoom and keeps the view on the board.
+        """
+        fit = max(min(self.board_width // self.columns, self.board_height // self.rows), 1)
+        self.zoom = min(max(self.zoom, self.min_square_size / fit), self.max_square_size / fit)
+        self.square_width = self.square_height = int(fit * self.zoom)
+        self.clamp_view()
+
+    @property
+    def viewport(self) -> pygame.Rect:
+        """
+        The area of the screen that shows the board.
+        """
+        return pygame.Rect(0, 0, self.board_width, self.board_height)
+
+    def clamp_view(self):
+        """
+        Keeps the view within the board. Boards smaller than the board area are shown from the top left.
+        """
+        max_x = max(self.columns * self.square_width - self.board_width, 0)
+        max_y = max(self.rows * self.square_height - self.board_height, 0)
+        self.view_offset = [min(max(self.view_offset[0], 0), max_x), min(max(self.view_offset[1], 0), max_y)]
+
+    def cell_at(self, pos) -> tuple[int, int] | None:
+        """
+        Returns the (row, column) of the square under a screen position, or None outside of the board.
+        Computed arithmetically, so the cost does not depend on the size of the board.
+        """
+        x, y = pos
+        if not self.viewport.collidepoint(x, y):
+            return None
+        col = (x + self.view_offset[0]) // self.square_width
+        row = (y + self.view_offset[1]) // self.square_height
+        if 0 <= row < self.rows and 0 <= col < self.columns:
+            return row, col
+        return None
+
+    def cell_rect(self, row: int, col: int) -> pygame.Rect:
+        """
+        Returns the rect of a square on the screen. It may lie outside of the board area.
+        """
+        return pygame.Rect(col * self.square_width - self.view_offset[0], row * self.square_height - self.view_offset[1],
+                           self.square_width, self.square_height)
+
+    def visible_window(self) -> tuple[int, int, int, int]:
+        """
+        Returns the squares in view as (first row, end row, first column, end column).
+        """
+        r0 = self.view_offset[1] // self.square_height
+        c0 = self.view_offset[0] // self.square_width
+        r1 = min(-(-(self.view_offset[1] + self.board_height) // self.square_height), self.rows)
+        c1 = min(-(-(self.view_offset[0] + self.board_width) // self.square_width), self.columns)
+        return r0, r1, c0, c1
+
+    def is_visible(self, grid_position) -> bool:
+        r0, r1, c0, c1 = self.visible_window()
+        return r0 <= grid_position[0] < r1 and c0 <= grid_position[1] < c1
+
+    def pan(self, dx: int, dy: int):
+        """
+        Moves the view by a number of pixels.
+        """
+        old = list(self.view_offset)
+        self.view_offset = [self.view_offset[0] + dx, self.view_offset[1] + dy]
+        self.clamp_view()
+        if self.view_offset != old:
+            self.camera_changed()
+
+    def zoom_at(self, pos, factor: float):
+        """
+        Zooms by a factor, keeping the board point under the screen position in place.
+        """
+        old_size = self.square_width
+        anchor_x = (pos[0] + self.view_offset[0]) / old_size
+        anchor_y = (pos[1] + self.view_offset[1]) / old_size
+        self.zoom *= factor
+        self.update_square_size()
+        if self.square_width == old_size:
+            return
+        self.view_offset = [int(anchor_x * self.square_width - pos[0]), int(anchor_y * self.square_height - pos[1])]
+        self.clamp_view()
+        self.clear_size_caches()
+        self.camera_changed()
+
+    def camera_changed(self):
+        self.board_image = self.render_board_image()
+        self.update_background()
+
+    def clear_size_caches(self):
+        # Cached surfaces of the old square size are not needed anymore
+        self.sprite_cache.clear()
+        self.highlight_cache.clear()
+        self.overlay_cache.clear()
 
     def relpos_to_pix(self, x_ratio, y_ratio):
         """
@@ -114,51 +315,119 @@ class UI:
         """
         return (int(self.screen_width * x_ratio), int(self.screen_height * y_ratio))
 
-    def save_board_image(self, filename="temp/board_grid.png"):
-        self.logger.debug('Saving board image')
-        # Create a temporary surface to draw the board and grid
-        board_surface = pygame.Surface((self.board_width, self.board_height))
+    def render_board_image(self) -> pygame.Surface:
+        """
+        Returns the image of the board at the current square size, from the shared in-memory cache.
+        """
+        return board_surfaces.board_image(self.board, (self.square_width, self.square_height), self.theme,
+                                          window=self.visible_window())
 
-        # Set the background color (olive green for the board)
-        board_surface.fill((128, 128, 0))
+    # Board listener
+    def on_occupy(self, piece, squares):
+        pass
 
-        # Draw the grid on the board surface
-        for i in range(self.rows):
-            for j in range(self.columns):
-                pygame.draw.rect(board_surface, (255, 255, 255), 
-                                (j * self.square_width, i * self.square_height, self.square_width, self.square_height), 1)
+    def on_vacate(self, piece, squares):
+        pass
 
-        # Save the board image to a file (PNG format)
-        pygame.image.save(board_surface, filename)
-        return filename
+    def on_terrain(self, squares):
+        self.board_image = self.render_board_image()
+        self.reset_screen()
 
     def reset_screen(self):
         """
-        Resets the screen by loading the pre-saved board image.
+        Sets up the screen and the static background, i.e. the board image and the control area.
+        The next frame is drawn completely.
         """
         self.logger.debug('Resetting screen')
         # Create the screen
         self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
+        self.update_background()
 
+    def update_background(self):
+        """
+        Draws the static background: the visible part of the board image and the control area.
+        The next frame is drawn completely.
+        """
+        self.background = pygame.Surface((self.screen_width, self.screen_height))
+        # The control area of the screen is white
+        self.background.fill(WHITE)
+        # Blit (draw) the board image of the visible squares onto the background
+        r0, _, c0, _ = self.visible_window()
+        self.background.set_clip(self.viewport)
+        self.background.blit(self.board_image, self.cell_rect(r0, c0).topleft)
+        self.background.set_clip(None)
         # Draw a line to separate the board from the controls
-        pygame.draw.line(self.screen, (0, 0, 0), (self.board_width, 0), (self.board_width, self.screen_height))
+        pygame.draw.line(self.background, BLACK, (self.board_width, 0), (self.board_width, self.screen_height))
 
-        # Blit (draw) the board image onto the screen
-        self.screen.blit(self.board_image, (0, 0))
+        self.full_redraw = True
+        self.shown = []
 
-        # The control area of the screen is white
-        pygame.draw.rect(self.screen, (255, 255, 255), (self.board_width, 0, self.screen_width - self.board_width, self.screen_height))
+    def add_to_scene(self, surface: pygame.Surface, rect: pygame.Rect, clip: pygame.Rect = None):
+        """
+        Adds a surface to the frame being built. Items are drawn in the order they are added.
 
-        # Update the screen to display the changes
-        pygame.display.flip()
+        clip: Only draw the item within this area, e.g. the board area for items on the board
+        """
+        self.scene.append((surface, pygame.Rect(rect), clip))
+
+    def add_to_board(self, surface: pygame.Surface, rect: pygame.Rect):
+        """
+        Adds an item on the board to the scene, unless it is out of view.
+        """
+        viewport = self.viewport
+        if viewport.colliderect(rect):
+            self.add_to_scene(surface, rect, None if viewport.contains(rect) else viewport)
+
+    def present(self) -> list[pygame.Rect]:
+        """
+        Brings the scene onto the screen and starts a new one.
+        Only the regions covered by items that appeared or disappeared since the last frame are redrawn,
+        by restoring the background there and drawing all items that overlap them.
+        Returns the updated regions.
+        """
+        scene, self.scene = self.scene, []
+        if self.full_redraw:
+            self.screen.blit(self.background, (0, 0))
+            for surface, rect, clip in scene:
+                self.screen.set_clip(clip)
+                self.screen.blit(surface, rect)
+            self.screen.set_clip(None)
+            pygame.display.flip()
+            self.full_redraw = False
+            self.shown = scene
+            return [self.screen.get_rect()]
+
+        def identity(item):
+            return id(item[0]), tuple(item[1])
+        old_items = {identity(item): item for item in self.shown}
+        new_items = {identity(item): item for item in scene}
+        dirty = [rect if clip is None else rect.clip(clip) for key, (_, rect, clip) in old_items.items() if key not in new_items]
+        dirty += [rect if clip is None else rect.clip(clip) for key, (_, rect, clip) in new_items.items() if key not in old_items]
+        self.shown = scene
+        if not dirty:
+            return []
+
+        for region in dirty:
+            self.screen.set_clip(region)
+            self.screen.blit(self.background, region, region)
+            for surface, rect, clip in scene:
+                if rect.colliderect(region):
+                    self.screen.set_clip(region if clip is None else region.clip(clip))
+                    self.screen.blit(surface, rect)
+        self.screen.set_clip(None)
+        pygame.display.update(dirty)
+        return dirty
     
     def show_pieces(self):
         """
         Places the units on the board.
         """
-        # Place the units on the board
+        # Place the units in view on the board
+        r0, r1, c0, c1 = self.visible_window()
         for unit in self.board.pieces.values():
             position = unit.position
+            if not (r0 <= position[0] < r1 and c0 <= position[1] < c1):
+                continue
             letter = unit.name[0].upper()
             match unit.player:
                 case 1:
@@ -170,63 +439,114 @@ class UI:
             
             self.draw_circle_with_letter(position, letter, color=color)
 
-    async def run(self):
-        self.logger.info('Running UI')
-        self.running = True
-        while self.running:
-            # Re-set the board
-            self.reset_screen()
+    def frame_signature(self) -> tuple:
+        """
+        Returns a cheap summary of everything a frame shows. If it did not change and no event arrived,
+        the frame is not rendered at all. The board hash covers the pieces, their markers, the turn and the active player.
+        """
+        options = self.api.current_options
+        return (self.board.hash, self.api.state, id(options), len(options), self.unit_clicked,
+                self.unit_clicked.position if self.unit_clicked else None)
 
-            # Place the units on the board
-            self.show_pieces()
+    def render_frame(self):
+        """
+        Builds the scene of the current state and brings it onto the screen.
+        """
+        # Place the units on the board
+        self.show_pieces()
 
-            # Display game info and action buttons
-            self.draw_game_info()
-            self.draw_option_buttons()
+        # Display game info and action buttons
+        self.draw_game_info()
+        self.draw_option_buttons()
 
-            # Get mouse position
-            mouse_pos = pygame.mouse.get_pos()
+        # Highlight the square under the mouse
+        self.highlight_hovered_square(pygame.mouse.get_pos())
+        
+        # Highlight the selected unit
+        if self.unit_clicked and self.unit_clicked.position is not None:
+            self.highlight_square(self.unit_clicked.position, RED, pixel_inwards=0)
+            #self.highlight_movement(self.unit_clicked)
+            if self.api.state == 'wait_for_tile_sel':
+                self.highlight_options(self.api.current_options, BLUE, pixel_inwards=5)
 
-            self.highlight_hovered_square(mouse_pos)
-            self.update_unit_rects()
-            
-            # Highlight the selected unit
-            if self.unit_clicked:
-                self.highlight_square(self.unit_clicked.position, RED, pixel_inwards=0)
-                #self.highlight_movement(self.unit_clicked)
-                if self.api.state == 'wait_for_tile_sel':
-                    for option in self.api.current_options:
-                        self.highlight_square(option, BLUE, pixel_inwards=5)
-
-            # Check for mouse clicks on buttons
-            for event in pygame.event.get():
-                match event.type:
-                    case pygame.MOUSEBUTTONDOWN:
-                        self.handle_mouse_click(pygame.mouse.get_pos())
-                    case pygame.QUIT:
-                        self.running = False
-                    case pygame.VIDEORESIZE:
-                        self.handle_resize(event)
-            # update the screen
-            pygame.display.flip()
+        # Update the changed regions of the screen
+        self.present()
 
-            #pause for 0.1 seconds
-            pygame.time.delay(100)
-            await asyncio.sleep(0.001)
+    async def run(self):
+        self.logger.info('Running UI')
+        self.running = True
+        while self.running:
+            # Drain all pending events first, so input is handled within one frame
+            events = pygame.event.get()
+            for event in events:
+                self.handle_event(event)
+            self.apply_pending_resize()
+
+            signature = self.frame_signature()
+            if events or self.full_redraw or signature != self.last_signature:
+                self.render_frame()
+                self.last_signature = signature
+            else:
+                self.scheduler.idle += 1
+
+            # Wait without blocking, so the game task runs in the meantime
+            await self.scheduler.wait_for_next_frame()
+        self.close()
         pygame.quit()
 
+    def close(self):
+        """
+        Detaches the UI from the board, which stops notifying it of changes. Called when the UI loop ends.
+        """
+        if self in self.board.listeners:
+            self.board.listeners.remove(self)
+
+    def handle_event(self, event):
+        """
+        Left clicks select, dragging with the right mouse button or the arrow keys pan the board,
+        and the mouse wheel or +/- zoom.
+        """
+        match event.type:
+            case pygame.MOUSEBUTTONDOWN if event.button == 1:
+                self.handle_mouse_click(event.pos)
+            case pygame.MOUSEBUTTONDOWN if event.button == 3:
+                self.dragging = True
+            case pygame.MOUSEBUTTONUP if event.button == 3:
+                self.dragging = False
+            case pygame.MOUSEMOTION if self.dragging:
+                self.pan(-event.rel[0], -event.rel[1])
+            case pygame.MOUSEWHEEL:
+                self.zoom_at(pygame.mouse.get_pos(), 1.25 ** event.y)
+            case pygame.KEYDOWN:
+                step = self.square_width
+                match event.key:
+                    case pygame.K_LEFT:
+                        self.pan(-step, 0)
+                    case pygame.K_RIGHT:
+                        self.pan(step, 0)
+                    case pygame.K_UP:
+                        self.pan(0, -step)
+                    case pygame.K_DOWN:
+                        self.pan(0, step)
+                    case pygame.K_PLUS | pygame.K_EQUALS | pygame.K_KP_PLUS:
+                        self.zoom_at(self.viewport.center, 1.25)
+                    case pygame.K_MINUS | pygame.K_KP_MINUS:
+                        self.zoom_at(self.viewport.center, 1 / 1.25)
+            case pygame.QUIT:
+                self.running = False
+            case pygame.VIDEORESIZE:
+                self.handle_resize(event)
+
     def highlight_hovered_square(self, mouse_pos):
         self.logger.debug('Highlighting hovered square')
-                # Loop over each grid cell and check for collision
-        for row in range(len(self.grid_rects)):
-            for col in range(len(self.grid_rects[row])):
-                if self.grid_rects[row][col].collidepoint(mouse_pos):
-
-                    # Highlight the square
-                    if self.board.map[row, col] is None:
-                        self.highlight_square((row, col), GREEN)
-                    else:
-                        self.highlight_square((row, col), YELLOW, pixel_inwards=3)
+        cell = self.cell_at(mouse_pos)
+        if cell is None:
+            return
+        # Highlight the square
+        if self.board.map[cell] is None:
+            self.highlight_square(cell, GREEN)
+        else:
+            self.highlight_square(cell, YELLOW, pixel_inwards=3)
 
     # Function to draw a circle with a letter in a specific grid square
     def draw_circle_with_letter(self,  grid_position, letter,
@@ -243,26 +563,23 @@ class UI:
             font (pygame.font.Font): The font to use for the letter.
         """
         row, col = grid_position
-        
-        # Calculate the center of the grid square
-        center_x = col * self.square_width + self.square_width // 2
-        center_y = row * self.square_height + self.square_height // 2
-        position = (center_x, center_y)
-        
-        # Calculate the radius of the circle to fit inside the square
-        radius = min(self.square_width, self.square_height) // 2 - 5  # Subtracting 5 for padding
-        
-        # Draw the circle
-        pygame.draw.circle(self.screen, color, position, radius)
-        
-        # Render the text
-        text_surface = font.render(letter, True, textcolor)
-        
-        # Get the rectangle of the text surface
-        text_rect = text_surface.get_rect(center=position)
-        
-        # Blit the text onto the circle
-        self.screen.blit(text_surface, text_rect)
+        size = (self.square_width, self.square_height)
+        key = (letter, color, textcolor, size, id(font))
+        sprite = self.sprite_cache.get(key)
+        if sprite is None:
+            sprite = pygame.Surface(size, pygame.SRCALPHA)
+            position = (self.square_width // 2, self.square_height // 2)
+
+            # Calculate the radius of the circle to fit inside the square
+            radius = min(self.square_width, self.square_height) // 2 - 5  # Subtracting 5 for padding
+
+            # Draw the circle, with the letter centered on it
+            pygame.draw.circle(sprite, color, position, radius)
+            text_surface = font.render(letter, True, textcolor)
+            sprite.blit(text_surface, text_surface.get_rect(center=position))
+            self.sprite_cache[key] = sprite
+
+        self.add_to_board(sprite, self.cell_rect(row, col))
 
     def highlight_square(self, grid_position, color, pixel_inwards=0):
         """
@@ -274,12 +591,46 @@ class UI:
         """
 
         row, col = grid_position
-        
-        # Calculate the top-left corner of the grid square
-        top_left = (col * self.square_width + pixel_inwards, row * self.square_height + pixel_inwards)
-        
-        # Draw a rectangle to highlight the square
-        pygame.draw.rect(self.screen, color, (*top_left, self.square_width-2*pixel_inwards, self.square_height-2*pixel_inwards), 3)
+        self.add_to_board(self.outline(color, pixel_inwards), self.cell_rect(row, col))
+
+    def outline(self, color, pixel_inwards=0) -> pygame.Surface:
+        """
+        Returns the cached highlight of a square, a transparent surface of the size of a square.
+        """
+        key = (color, pixel_inwards, self.square_width, self.square_height)
+        outline = self.highlight_cache.get(key)
+        if outline is None:
+            outline = pygame.Surface((self.square_width, self.square_height), pygame.SRCALPHA)
+            pygame.draw.rect(outline, color, (pixel_inwards, pixel_inwards, self.square_width-2*pixel_inwards, self.square_height-2*pixel_inwards), 3)
+            self.highlight_cache[key] = outline
+        return outline
+
+    def highlight_options(self, grid_positions, color, pixel_inwards=0):
+        """
+        Highlights many grid squares at once, e.g. the movement options of a unit. 
+        The highlights are drawn once into a cached overlay, which is reused as long as the options stay the same.
+        """
+        r0, r1, c0, c1 = self.visible_window()
+        positions = tuple(tuple(position) for position in grid_positions
+                          if r0 <= position[0] < r1 and c0 <= position[1] < c1)
+        if len(positions) == 0:
+            return
+        key = (positions, color, pixel_inwards, self.square_width, self.square_height)
+        cached = self.overlay_cache.get(key)
+        if cached is None:
+            rows = [row for row, _ in positions]
+            cols = [col for _, col in positions]
+            top, left = min(rows), min(cols)
+            overlay = pygame.Surface(((max(cols) - left + 1) * self.square_width, (max(rows) - top + 1) * self.square_height), pygame.SRCALPHA)
+            outline = self.outline(color, pixel_inwards)
+            for row, col in positions:
+                overlay.blit(outline, ((col - left) * self.square_width, (row - top) * self.square_height))
+            # Only the overlays of the current and the previous options are kept
+            if len(self.overlay_cache) > 1:
+                self.overlay_cache.clear()
+            cached = self.overlay_cache[key] = (overlay, top, left)
+        overlay, top, left = cached
+        self.add_to_board(overlay, overlay.get_rect(topleft=self.cell_rect(top, left).topleft))
 
     def highlight_movement(self, unit:engine.Unit, parameter='interaction_range'):
         self.logger.debug('Highlighting movement')
@@ -292,16 +643,36 @@ class UI:
         Draw text on the screen at the specified position.
         """
         display = text if type(text) == str else text.__repr__()
-        text_surface = self.font.render(display, True, color)
-        self.screen.blit(text_surface, pos)
+        text_surface = self.render_text(display, color)
+        self.add_to_scene(text_surface, text_surface.get_rect(topleft=pos))
+
+    def render_text(self, text: str, color=BLACK) -> pygame.Surface:
+        """
+        Returns the rendered text from the text cache, rendering it only the first time.
+        """
+        key = (text, color)
+        text_surface = self.text_cache.get(key)
+        if text_surface is None:
+            text_surface = self.text_cache[key] = self.font.render(text, True, color)
+            if len(self.text_cache) > self.max_cached_texts:
+                self.text_cache.popitem(last=False)
+        else:
+            self.text_cache.move_to_end(key)
+        return text_surface
 
     def create_button(self, text, rect, callback):
         """
         Create a button with a callback when clicked.
         """
         self.logger.debug('Creating button')
-        pygame.draw.rect(self.screen, GREEN, rect)
-        self.draw_text(text, (rect.x + 5, rect.y + 5))
+        key = ('button', text, rect.size)
+        button = self.sprite_cache.get(key)
+        if button is None:
+            button = pygame.Surface(rect.size)
+            button.fill(GREEN)
+            button.blit(self.render_text(text), (5, 5))
+            self.sprite_cache[key] = button
+        self.add_to_scene(button, rect)
         self.buttons.append((rect, callback))
 
     def draw_game_info(self):
@@ -360,28 +731,40 @@ class UI:
 
     def handle_resize(self, event):
         """
-        Handle screen resize events.
+        Handle screen resize events. While the window is being dragged, many events arrive in a row,
+        so the new size is only noted here and applied by apply_pending_resize once it is stable.
+        """
+        self.pending_resize = (tuple(event.size), time.perf_counter())
+
+    def apply_pending_resize(self, force: bool = False) -> bool:
+        """
+        Applies the last noted window size, once no resize event came for resize_delay seconds.
+        Returns True if the size was applied.
         """
+        if self.pending_resize is None:
+            return False
+        size, noted = self.pending_resize
+        if not force and time.perf_counter() - noted < self.resize_delay:
+            return False
+        self.pending_resize = None
+        self.resize(size)
+        return True
+
+    def resize(self, size):
         self.logger.info('Handling screen resize')
-        self.screen_width, self.screen_height = event.size
+        self.screen_width, self.screen_height = size
 
         # Define the size of the board on the screen. The remainder is reserved for controls and uncommitted figures
         self.board_width = self.screen_height
         self.board_height = self.screen_height
         # Define the number of squares in the grid
         self.rows, self.columns = self.board.size
-        # Define the size of each square
-        self.square_width = self.board_width // self.columns
-        self.square_height = self.board_height // self.rows
+        self.update_square_size()
 
-        # Load the pre-saved board image
-        board_image_filename = self.save_board_image()
-        self.board_image = pygame.image.load(board_image_filename)
+        self.board_image = self.render_board_image()
+        self.clear_size_caches()
         self.reset_screen()
 
-        self.create_grid_rects()
-        self.update_unit_rects()
-
     def handle_mouse_click(self, pos):
         """
         Check if any buttons are clicked.
@@ -389,22 +772,22 @@ class UI:
         self.logger.debug('Handling mouse click')
         if self.api.state == 'wait_for_option_sel':
             # Check if a button is clicked
-            for button, callback in self.buttons:
+            for button, callback in list(self.buttons):
                 if button.collidepoint(pos):
                     callback()
         
         if self.api.state == 'wait_for_unit_sel':
             # Check if a unit is clicked
-            for unit in self.board.pieces.values():
-                if unit.clickable and unit.rect.collidepoint(pos):
-                    self.unit_clicked = unit
-                    self.api.selection_done(unit)
-                    print(f'Selected unit: {unit}')
+            cell = self.cell_at(pos)
+            unit = None if cell is None else self.board.piece_at(cell)
+            if unit is not None and unit.clickable:
+                self.unit_clicked = unit
+                self.api.selection_done(unit)
+                self.logger.info(f'Selected unit: {unit}')
         
         if self.api.state == 'wait_for_tile_sel':
             # Check if a grid square is clicked
-            for row in range(len(self.grid_rects)):
-                for col in range(len(self.grid_rects[row])):
-                    if self.grid_rects[row][col].collidepoint(pos):
-                        self.api.selection_done((row, col))
-                        print(f'Selected tile: {row}, {col}')
+            cell = self.cell_at(pos)
+            if cell is not None:
+                self.api.selection_done(cell)
+                self.logger.info(f'Selected tile: {cell[0]}, {cell[1]}')
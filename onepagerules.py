@@ -1,47 +1,76 @@
 
+import numpy as np
 import engine
+import combat
 from typing import Generator, Any
-import random
 DEBUG = True
 
 class OPR_Firefight(engine.RuleSystem):
     ## A turn is done when all units on the board have taken their unit_turn
     ## The player turn and the unit_turn switch when the current unit has taken its turn
+
+    def __init__(self, game: engine.Game, max_turns: int = 4):
+        """
+        max_turns: Number of game turns, after which the game ends
+        """
+        super().__init__(game)
+        self.activations = 0 # Number of unit activations in the game so far
+        self.max_turns = max_turns
     
     async def game_sequence(self):
         """
         Implements the OnePageRules game flow as a generator.
         Yields each step to be processed by the game engine or API.
+        A sequence started on a game in progress resumes with the next activation.
         """
-        print("Game sequence started")
+        self.game.logger.info("Game sequence started")
         # Determine initiative at the start of the game
-        self.determine_initiative()
+        if self.game.active_player is None:
+            self.determine_initiative()
 
         while not self.check_game_over():
-            self.game_turn += 1
-            print(f"Game turn {self.game_turn} begins")
+            if self.game_turn == 0 or self.all_units_activated():
+                self.start_turn()
 
             # Handle unit activations during the game turn
             while not self.all_units_activated():
 
-                yet_to_act_units = [unit for unit in self.game.board.pieces.values() \
-                                    if (unit.player == self.game.active_player) and not unit.activated]
+                yet_to_act_units = [unit for unit in self.units(self.game.active_player) if not unit.activated]
                 
                 if len(yet_to_act_units) > 0:
                     await self.get_unit_selection(yet_to_act_units)
                     while not self.api.selection in yet_to_act_units:
-                        print(f"Selected unit ({self.api.selection}) not in list of available units: {yet_to_act_units}")
+                        self.game.logger.info(f"Selected unit ({self.api.selection}) not in list of available units: {yet_to_act_units}")
                         await self.get_unit_selection(yet_to_act_units)
                     self.controlled_unit = self.api.selection
 
                     await self.unit_turn(self.controlled_unit)
+                    self.controlled_unit.activated = True
+                    self.activations += 1
+                    self.game.logger.info(f"Unit {self.controlled_unit} turn completed")
                 else:
-                    print(f"No units left to activate for player {self.game.active_player}")
-                print(f"Unit {self.controlled_unit} turn completed")
+                    self.game.logger.info(f"No units left to activate for player {self.game.active_player}")
 
                 self.next_player()
 
-        print(f"Game turn {self.game_turn} ends")
+            self.game.logger.info(f"Game turn {self.game_turn} ends")
+
+    def start_turn(self):
+        """
+        Starts a new game turn, in which every unit can be activated again.
+        """
+        self.game_turn += 1
+        for unit in self.units():
+            unit.activated = False
+            unit.fought = False
+        self.game.logger.info(f"Game turn {self.game_turn} begins")
+
+    def units(self, player: int = None) -> list['OPRUnit']:
+        """
+        Returns the units on the board, optionally only those of one player.
+        """
+        return [piece for piece in self.game.board.pieces.values()
+                if isinstance(piece, OPRUnit) and (player is None or piece.player == player)]
 
     async def unit_turn(self, unit: engine.Unit):
         """
@@ -55,19 +84,19 @@ class OPR_Firefight(engine.RuleSystem):
 
         match self.api.selection:
             case "Hold":
-                print(f"{unit} will hold position.")
+                self.game.logger.info(f"{unit} will hold position.")
                 await unit.hold()
 
             case "Advance":
-                print(f"{unit} advances.")
+                self.game.logger.info(f"{unit} advances.")
                 await unit.advance()
 
             case "Rush":
-                print(f"{unit} rushes.")
+                self.game.logger.info(f"{unit} rushes.")
                 await unit.rush()
 
             case "Charge":
-                print(f"{unit} charges.")
+                self.game.logger.info(f"{unit} charges.")
                 await unit.charge()
 
             case _:
@@ -79,9 +108,9 @@ class OPR_Firefight(engine.RuleSystem):
         Determines which player has the initiative.
         For now, we'll just return Player 1 for simplicity.
         """
-        active_player = random.choice(self.game.players)
+        active_player = self.game.random.choice(self.game.players)
         self.game.api.set_active_player(active_player)
-        print(f"Initiative determined: Player {self.game.active_player} goes first")
+        self.game.logger.info(f"Initiative determined: Player {self.game.active_player} goes first")
 
     def next_player(self) -> int:
         """ Sets the next player in the sequence. """
@@ -91,14 +120,32 @@ class OPR_Firefight(engine.RuleSystem):
         """
         Returns True if all units have been activated this turn.
         """
-        return all(unit.activated for unit in self.game.board.pieces.values())
+        return all(unit.activated for unit in self.units())
 
     def check_game_over(self) -> bool:
         """
         Checks if the game is over, based on some condition.
         """
-        # For now, the game is over after 4 turns
-        return self.game_turn > 3
+        # For now, the game is over after max_turns turns, or once a player has no units left
+        if self.game_turn >= self.max_turns:
+            return True
+        return self.game_turn > 0 and any(len(self.units(player)) == 0 for player in self.game.players)
+
+    def get_state(self) -> tuple:
+        return super().get_state() + (self.activations,)
+
+    def set_state(self, state: tuple):
+        super().set_state(state)
+        self.activations = state[2]
+
+    def determine_winner(self) -> int | None:
+        """
+        Returns the player with the most units left on the board, or None for a draw.
+        """
+        remaining = {player: len(self.units(player)) for player in self.game.players}
+        most = max(remaining.values())
+        leaders = [player for player, count in remaining.items() if count == most]
+        return leaders[0] if len(leaders) == 1 else None
 
     def get_available_actions(self, api):
         """
@@ -125,6 +172,13 @@ class OPRWeapon:
         return f"{self.name} (Range: {self.range}, Attacks: {self.attacks}, Damage: {self.damage})"
 
 class OPRUnit(engine.Unit):
+    state_fields = ('activated', 'fought', 'shaken', 'wounds')
+    # The state markers are part of the board hash
+    activated = engine.HashedField()
+    fought = engine.HashedField()
+    shaken = engine.HashedField()
+    wounds = engine.HashedField()
+
     def __init__(self, game: 'engine.Game', name: str, player: int, position: list[int]=None):
         super().__init__(game, name, player, position)
 
@@ -135,7 +189,8 @@ class OPRUnit(engine.Unit):
 
         # Default stats
         self.movement: int = 6  # Standard movement for all units
-        self.movement_rush = self.movement * 2
+        self.rush_multiplier: float = 2  # Rush and charge moves go this many times the movement
+        self.movement_rush = self.movement * self.rush_multiplier
         self.wounds: int = 1
 
         # Unit stats (must be edited)
@@ -147,7 +202,7 @@ class OPRUnit(engine.Unit):
 
     def set_movement(self, movement: int):
         self.movement = movement
-        self.movement_rush = movement * 2
+        self.movement_rush = movement * self.rush_multiplier
         
     def add_weapon(self, weapon: OPRWeapon):
         self.weapons.append(weapon)
@@ -156,29 +211,114 @@ class OPRUnit(engine.Unit):
         weapons_str = ', '.join(str(weapon) for weapon in self.weapons)
         return f"{self.name} at {self.position} with weapons: {weapons_str}"
     
-    async def shoot(self, target = None):
-        all_ranged_weapons = [weapon for weapon in self.weapons if weapon.range > 1]
-        weapon_shot = [False for _ in all_ranged_weapons]
+    def enemy_players(self) -> list[int]:
+        return [player for player in self.game.players if player != self.player]
+
+    def units_in_range(self, origin, range) -> list['OPRUnit']:
+        """
+        Returns the enemy units within range of the origin.
+        """
+        return self.board.unit_index.units_within(origin, range, players=self.enemy_players())
 
-        while not all(weapon_shot):
-            await self.rules.select_option(all_ranged_weapons[~weapon_shot])
-            weapon_choice = self.rules.api.selection
-            assert weapon_choice in all_ranged_weapons
+    def units_in_sight(self, origin, range) -> dict['OPRUnit', bool]:
+        """
+        Returns the enemy units within range of the origin that are in line of sight,
+        each with True if it is in cover. A unit larger than a square is in cover only if all its visible squares are.
+        """
+        index = self.board.unit_index
+        tiles, units = [], []
+        for unit in index.units_within(origin, range, players=self.enemy_players()):
+            x0, x1, y0, y1 = index.bounds(unit)
+            if x0 == x1 and y0 == y1:
+                unit_tiles = [(x0, y0)]
+            else:
+                # Every square of a larger unit that is in range is a candidate for line of sight
+                xs, ys = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1), indexing='ij')
+                within = np.hypot(xs - origin[0], ys - origin[1]) * self.board.gridsize <= range
+                unit_tiles = list(zip(xs[within].tolist(), ys[within].tolist()))
+            tiles += unit_tiles
+            units += [unit] * len(unit_tiles)
+        visible, cover = self.board.visibility.check(origin, tiles)
+        in_sight = {}
+        for unit, tile_visible, tile_cover in zip(units, visible.tolist(), cover.tolist()):
+            if tile_visible:
+                in_sight[unit] = in_sight.get(unit, True) and tile_cover
+        return in_sight
+
+    def attack(self, assignments: list[tuple['OPRWeapon', 'OPRUnit']], in_cover = ()):
+        """
+        Resolves the attacks of weapons at their targets with one batched roll,
+        and applies the wounds to the targets.
 
-            available_targets = self.game.board.in_range(self.position, weapon_choice.range)
-            target = await self.rules.select_unit(available_targets)
+        in_cover: Targets that are in cover, which improves their defense by one
+        """
+        if len(assignments) == 0:
+            return
+        if self.quality is None or any(target.defense is None for _, target in assignments):
+            raise ValueError(f'Quality and defense must be set to resolve attacks of {self}')
+        wounds = combat.roll_attacks(self.game.rng,
+                                     attacks=[weapon.attacks for weapon, _ in assignments],
+                                     damage=[weapon.damage for weapon, _ in assignments],
+                                     quality=self.quality,
+                                     defense=[max(target.defense - 1, 2) if target in in_cover else target.defense
+                                              for _, target in assignments])
+        wounds_by_target = {}
+        for (weapon, target), dealt in zip(assignments, wounds.tolist()):
+            wounds_by_target[target] = wounds_by_target.get(target, 0) + dealt
+        for target, dealt in wounds_by_target.items():
+            target.take_wounds(dealt)
+
+    def take_wounds(self, wounds: int):
+        """
+        Removes wounds from the unit. A unit without wounds left is destroyed.
+        """
+        if wounds <= 0:
+            return
+        self.wounds -= wounds
+        self.game.logger.info(f'{self.name} takes {wounds} wounds, {max(self.wounds, 0)} left.')
+        if self.wounds <= 0 and self.position is not None:
+            self.game.logger.info(f'{self.name} is destroyed.')
+            self.remove(kill=True)
+
+    async def shoot(self, target = None):
+        """
+        Every ranged weapon fires at an enemy unit in its range and line of sight.
+        All shots are resolved together, once every weapon has a target.
+        """
+        assignments = []
+        in_cover = set()
+        for weapon in [weapon for weapon in self.weapons if weapon.range > 1]:
+            in_sight = self.units_in_sight(self.position, weapon.range)
+            available_targets = list(in_sight)
+            if len(available_targets) == 0:
+                continue
+            await self.rules.get_unit_selection(available_targets)
+            target = self.rules.api.selection
             assert target in available_targets
     
-            print(f'{self} shoots at {target}.')
-            #!TODO: Implement applying damage mechanics
+            self.game.logger.info(f'{self} shoots at {target} with {weapon.name}' + (', which is in cover.' if in_sight[target] else '.'))
+            assignments.append((weapon, target))
+            if in_sight[target]:
+                in_cover.add(target)
+        self.attack(assignments, in_cover)
     
     async def melee(self, target = None):
         if target is None:
-            target = await self.game.api.select_unit()
-        print(f'{self} attacks {target} in melee combat.')
+            available_targets = self.units_in_range(self.position, 1.5)
+            if len(available_targets) == 0:
+                return
+            await self.rules.get_unit_selection(available_targets)
+            target = self.rules.api.selection
+        self.fought = True
+        self.game.logger.info(f'{self} attacks {target} in melee combat.')
+        self.attack([(weapon, target) for weapon in self.weapons if weapon.range <= 1])
 
     def get_fields_in_range(self, rangeparam='movement'):
-        return self.game.board.in_range(self.position, self.__getattribute__(rangeparam))
+        """
+        Returns the positions the unit can move to within the distance given by the attribute rangeparam,
+        going around other pieces and impassable terrain.
+        """
+        return self.board.reachable_positions(self, self.__getattribute__(rangeparam))
 
     async def hold(self):
         await self.shoot()
@@ -189,12 +329,14 @@ class OPRUnit(engine.Unit):
 
         # Get movement options
         movement_options = self.get_fields_in_range()
-        move_target = None
-        while (not move_target in movement_options) or (self.board.is_occupied(move_target, self.extent) ):
-            await self.rules.get_tile_selection(tile_options=movement_options)
-            move_target = self.rules.api.selection        
-
-        self.place(move_target)
+        if len(movement_options) == 0:
+            self.game.logger.info(f"{self} has nowhere to move.")
+        else:
+            move_target = None
+            while not move_target in movement_options:
+                await self.rules.get_tile_selection(tile_options=movement_options)
+                move_target = self.rules.api.selection        
+            self.place(move_target)
 
         # Shoot
         await self.shoot()
@@ -203,44 +345,49 @@ class OPRUnit(engine.Unit):
         # Get movement options
         self.interaction_range = self.movement_rush
         movement_options = self.get_fields_in_range('movement_rush')
+        if len(movement_options) == 0:
+            self.game.logger.info(f"{self} has nowhere to move.")
+            return
         move_target = None
-        while (not move_target in movement_options) or (self.board.is_occupied(move_target, self.extent) ):
+        while not move_target in movement_options:
             await self.rules.get_tile_selection(tile_options=movement_options)
             move_target = self.rules.api.selection        
 
         self.place(move_target)
 
     async def charge(self):
-        if DEBUG:     
-            print(f"{self} charges. Select move target")
+        self.game.logger.debug(f"{self} charges. Select move target")
 
-        # Movement choice
+        # Movement choice. Only tiles from which an enemy unit is in reach are charge targets
         self.interaction_range = self.movement_rush
         movement_options = self.get_fields_in_range('movement_rush')
+        targets_in_reach = self.board.count_in_range(movement_options, 1.5, 'Unit', players=self.enemy_players())
+        movement_options = [tile for tile, n in zip(movement_options, targets_in_reach) if n > 0]
+        if len(movement_options) == 0:
+            self.game.logger.info(f"{self} has no enemy in charge range.")
+            return
         move_target = None
-        while (not move_target in movement_options) or (self.board.is_occupied(move_target, self.extent) ):
+        while not move_target in movement_options:
             await self.rules.get_tile_selection(tile_options=movement_options)
             move_target = self.rules.api.selection        
 
-        if DEBUG:
-            print(f"Move target: {move_target}, selecting attack target")
+        self.game.logger.debug(f"Move target: {move_target}, selecting attack target")
 
         # Attack choice
-        attack_target_options = self.game.board.in_range(move_target, 1.5)
+        attack_target_options = self.units_in_range(move_target, 1.5)
         attack_target = None
         while not attack_target in attack_target_options:
             await self.rules.get_unit_selection(selectable_units=attack_target_options)
             attack_target = self.rules.api.selection
 
-        if DEBUG:
-            print(f"Attack target: {attack_target}, confirming charge")
+        self.game.logger.debug(f"Attack target: {attack_target}, confirming charge")
     
         # Confirm choices
-        await self.rules.api.select_option(options=['Confirm charge', 'Back'])
+        await self.rules.get_option_selection(['Confirm charge', 'Back'])
         match self.rules.api.selection:
             case 'Confirm charge':
                 self.place(move_target)
-                self.melee(attack_target)
+                await self.melee(attack_target)
             case 'Back':
                 await self.charge()
             case _:
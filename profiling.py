@@ -0,0 +1,221 @@
+"""
+Per-phase profiling of the engine, the rules and the UI.
+
+The phases are the functions listed in PHASES. enable() replaces them with timing wrappers and disable()
+restores the originals, so a disabled profiler costs nothing. While enabled, every phase counts its calls
+and sums its time from a monotonic clock. In addition, the profiler keeps
+- a histogram of the decision latency, i.e. the time from a request for input until a valid selection,
+- the breakdown of every UI frame into its drawing phases,
+- optionally a trace of all calls, which can be opened in chrome://tracing or Perfetto.
+
+Synchronous phases nest, and the time of a phase includes its nested phases. Coroutine phases
+(the game sequence, unit turns and input requests) measure wall time, including the time suspended.
+
+Usage:
+    with profiling.profiled(trace=True) as profiler:
+        game.run_headless()
+    profiler.to_json('profile.json')
+    profiler.to_chrome_trace('trace.json')
+"""
+import bisect
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import os
+import sys
+import time
+from collections import deque
+
+
+# Instrumented functions: (module, class, function, phase). The board phases are the queries the rules make,
+# through the board, the spatial index and the visibility cache, and the occupancy updates, which include the listeners
+PHASES = [
+    ('engine', 'Board', 'in_range', 'board.in_range'),
+    ('engine', 'Board', 'count_in_range', 'board.count_in_range'),
+    ('engine', 'Board', 'in_range_batch', 'board.in_range_batch'),
+    ('engine', 'Board', 'is_occupied', 'board.is_occupied'),
+    ('engine', 'Board', 'occupy', 'board.occupy'),
+    ('engine', 'Board', 'vacate', 'board.vacate'),
+    ('engine', 'Board', 'reachable_positions', 'board.reachable_positions'),
+    ('engine', 'Board', 'movement_costs', 'board.movement_costs'),
+    ('engine', 'SpatialIndex', 'units_within', 'index.units_within'),
+    ('engine', 'SpatialIndex', 'nearest', 'index.nearest'),
+    ('engine', 'VisibilityCache', 'check', 'visibility.check'),
+    ('engine', 'VisibilityCache', 'trace', 'visibility.trace'),
+    ('engine', 'RuleSystem', 'wait_for_input', 'rules.wait_for_input'),
+    ('onepagerules', 'OPR_Firefight', 'game_sequence', 'rules.game_sequence'),
+    ('onepagerules', 'OPR_Firefight', 'unit_turn', 'rules.unit_turn'),
+    ('onepagerules', 'OPRUnit', 'attack', 'rules.attack'),
+    ('gameUI', 'UI', 'render_frame', 'ui.frame'),
+    ('gameUI', 'UI', 'handle_event', 'ui.handle_event'),
+    ('gameUI', 'UI', 'show_pieces', 'ui.show_pieces'),
+    ('gameUI', 'UI', 'draw_game_info', 'ui.draw_game_info'),
+    ('gameUI', 'UI', 'draw_option_buttons', 'ui.draw_option_buttons'),
+    ('gameUI', 'UI', 'highlight_hovered_square', 'ui.highlight_hovered_square'),
+    ('gameUI', 'UI', 'highlight_options', 'ui.highlight_options'),
+    ('gameUI', 'UI', 'present', 'ui.present'),
+]
+DECISION_PHASE = 'rules.wait_for_input'
+FRAME_PHASE = 'ui.frame'
+# Modules that are only instrumented if they are imported already. Importing gameUI would start pygame
+OPTIONAL_MODULES = ('gameUI',)
+
+# Upper bounds of the buckets of the decision latency histogram, in microseconds. The last bucket is unbounded
+LATENCY_BUCKETS_US = [2**k for k in range(32)]
+
+SYNC_TRACK = 1
+ASYNC_TRACK = 2
+
+
+class Profiler:
+    """
+    Collects the measurements of the instrumented phases.
+
+    trace: Whether to record every call for the Chrome trace
+    max_events: Calls recorded at most for the trace
+    max_frames: UI frames whose breakdown is kept, the most recent ones
+    """
+    def __init__(self, trace: bool = False, max_events: int = 1000000, max_frames: int = 1000):
+        self.calls = {} # phase -> number of calls
+        self.total_ns = {} # phase -> total time
+        self.decision_latency = [0] * (len(LATENCY_BUCKETS_US) + 1)
+        self.frames = deque(maxlen=max_frames) # Breakdown of each frame in milliseconds by phase
+        self.trace = trace
+        self.max_events = max_events
+        self.events = [] # (phase, start, duration, track), in nanoseconds
+        self.stack = [] # [phase, start, time of nested phases by phase] of the running synchronous phases
+        self.origin = time.perf_counter_ns()
+        self.patched = [] # (owner, name, original)
+
+    def record(self, phase: str, start: int, duration: int, track: int):
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.total_ns[phase] = self.total_ns.get(phase, 0) + duration
+        if self.trace and len(self.events) < self.max_events:
+            self.events.append((phase, start, duration, track))
+
+    def record_decision(self, duration: int):
+        self.decision_latency[bisect.bisect_left(LATENCY_BUCKETS_US, duration / 1000)] += 1
+
+    def wrap(self, function, phase: str):
+        """
+        Returns a timing wrapper of a function or coroutine function.
+        """
+        profiler = self
+        clock = time.perf_counter_ns
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed_coroutine(*args, **kwargs):
+                start = clock()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    duration = clock() - start
+                    profiler.record(phase, start, duration, ASYNC_TRACK)
+                    if phase == DECISION_PHASE:
+                        profiler.record_decision(duration)
+            return timed_coroutine
+
+        stack = self.stack
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            entry = [phase, clock(), {}]
+            stack.append(entry)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stack.pop()
+                start, nested = entry[1], entry[2]
+                duration = clock() - start
+                if stack:
+                    parent = stack[-1][2]
+                    parent[phase] = parent.get(phase, 0) + duration
+                profiler.record(phase, start, duration, SYNC_TRACK)
+                if phase == FRAME_PHASE:
+                    profiler.frames.append({'total': duration / 1e6, **{name: ns / 1e6 for name, ns in nested.items()}})
+        return timed
+
+    def instrument(self):
+        for module_name, class_name, name, phase in PHASES:
+            if module_name in OPTIONAL_MODULES and module_name not in sys.modules:
+                continue
+            owner = getattr(importlib.import_module(module_name), class_name)
+            original = owner.__dict__[name]
+            setattr(owner, name, self.wrap(original, phase))
+            self.patched.append((owner, name, original))
+
+    def restore(self):
+        for owner, name, original in reversed(self.patched):
+            setattr(owner, name, original)
+        self.patched = []
+
+    def summary(self) -> dict:
+        phases = {phase: {'calls': calls, 'total_ms': self.total_ns[phase] / 1e6,
+                          'mean_us': self.total_ns[phase] / calls / 1e3}
+                  for phase, calls in sorted(self.calls.items(), key=lambda item: -self.total_ns[item[0]])}
+        frames = list(self.frames)
+        frame_phases = sorted({name for frame in frames for name in frame})
+        return {
+            'phases': phases,
+            'decision_latency': {'bucket_upper_us': LATENCY_BUCKETS_US + [None], 'counts': self.decision_latency},
+            'frames': {'count': len(frames),
+                       'mean_ms': {name: sum(frame.get(name, 0.0) for frame in frames) / len(frames) for name in frame_phases}
+                       if frames else {},
+                       'recent': frames[-100:]},
+        }
+
+    def to_json(self, filename: str):
+        with open(filename, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def to_chrome_trace(self, filename: str):
+        """
+        Writes the recorded calls in the Chrome trace event format, with the synchronous phases and the coroutines
+        on separate tracks.
+        """
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': SYNC_TRACK, 'args': {'name': 'calls'}},
+                  {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ASYNC_TRACK, 'args': {'name': 'coroutines'}}]
+        events += [{'name': phase, 'cat': phase.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': track,
+                    'ts': (start - self.origin) / 1e3, 'dur': duration / 1e3}
+                   for phase, start, duration, track in self.events]
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+profiler: Profiler = None # The enabled profiler, if any
+
+
+def enable(**settings) -> Profiler:
+    """
+    Instruments the phases and returns the new profiler. The settings are passed to the Profiler.
+    """
+    global profiler
+    if profiler is not None:
+        disable()
+    profiler = Profiler(**settings)
+    profiler.instrument()
+    return profiler
+
+
+def disable() -> Profiler:
+    """
+    Restores the original functions and returns the profiler that was enabled.
+    """
+    global profiler
+    disabled, profiler = profiler, None
+    if disabled is not None:
+        disabled.restore()
+    return disabled
+
+
+@contextlib.contextmanager
+def profiled(**settings):
+    enabled = enable(**settings)
+    try:
+        yield enabled
+    finally:
+        if profiler is enabled:
+            disable()
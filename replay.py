@@ -0,0 +1,267 @@
+"""
+Compact binary replay logs of games, and a headless replayer.
+
+A game is determined by its setup and the ordered stream of selections made through the API, since all
+randomness of the rules, e.g. the initiative and the dice, is drawn from the generators seeded by the game.
+A log is written append-only while the game is played: a header, followed by one record per selection.
+
+    header:  b'TWRL', format version (1 byte), length of the setup (varint), setup as JSON
+    unit:    0x01, roster index of the unit (varint)
+    tile:    0x02, row (varint), column (varint)
+    option:  0x03, id of the option string (varint)
+    string:  0x04, length (varint), UTF-8 bytes. Defines the next option string id, before its first use
+    none:    0x05
+
+The setup holds the seed and the arguments of selfplay.setup_game, including the rule parameters.
+Most records take two or three bytes.
+A log that was cut off, e.g. by a crash, can still be replayed up to its last complete record.
+
+Usage:
+    python replay.py game.twrl --stop-at 25
+"""
+import argparse
+import json
+import sys
+from typing import Any, BinaryIO, Callable
+
+import engine
+import selfplay
+
+
+MAGIC = b'TWRL'
+FORMAT_VERSION = 1
+
+UNIT = 0x01
+TILE = 0x02
+OPTION = 0x03
+STRING = 0x04
+NONE = 0x05
+
+
+def encode_varint(value: int, out: bytearray):
+    """
+    Appends a non-negative integer in LEB128 encoding, 7 bits per byte.
+    """
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data: bytes, offset: int) -> tuple[int, int]:
+    """
+    Returns the integer at the offset and the offset after it. Raises EOFError if the data ends within it.
+    """
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise EOFError('Truncated varint')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class ReplayWriter:
+    """
+    Appends the selections of a game to a replay log. Attach it to the API of the game before it starts,
+    the API then hands it every selection.
+
+    file: Filename or binary file object the log is written to
+    setup: The seed and the arguments of selfplay.setup_game, e.g. {'seed': 1, 'armies': [...], 'board_size': [12, 12]}
+    """
+    def __init__(self, file: str | BinaryIO, setup: dict):
+        assert setup.get('seed') is not None, 'Only seeded games can be replayed'
+        self.file = open(file, 'wb') if isinstance(file, str) else file
+        self.owns_file = isinstance(file, str)
+        self.strings = {} # option string -> id
+        self.records = 0
+        self.buffer = bytearray()
+
+        header = json.dumps(setup, separators=(',', ':')).encode()
+        out = bytearray(MAGIC)
+        out.append(FORMAT_VERSION)
+        encode_varint(len(header), out)
+        self.file.write(bytes(out) + header)
+
+    def attach(self, game: engine.Game):
+        game.api.recorder = self
+
+    def record(self, selection: Any):
+        out = self.buffer
+        out.clear()
+        if isinstance(selection, engine.Piece):
+            out.append(UNIT)
+            encode_varint(selection.roster_index, out)
+        elif isinstance(selection, str):
+            string_id = self.strings.get(selection)
+            if string_id is None:
+                string_id = self.strings[selection] = len(self.strings)
+                encoded = selection.encode()
+                out.append(STRING)
+                encode_varint(len(encoded), out)
+                out += encoded
+            out.append(OPTION)
+            encode_varint(string_id, out)
+        elif selection is None:
+            out.append(NONE)
+        else:
+            row, column = selection
+            out.append(TILE)
+            encode_varint(int(row), out)
+            encode_varint(int(column), out)
+        self.file.write(out)
+        self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_log(source: str | bytes | BinaryIO) -> tuple[dict, list[tuple[int, Any]]]:
+    """
+    Returns the setup and the records of a log, as (UNIT, roster index), (TILE, (row, column)),
+    (OPTION, string) or (NONE, None). An incomplete last record is dropped.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            data = file.read()
+    elif isinstance(source, bytes):
+        data = source
+    else:
+        data = source.read()
+
+    if data[:4] != MAGIC:
+        raise ValueError('Not a replay log')
+    if data[4] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported replay log version {data[4]}')
+    length, offset = decode_varint(data, 5)
+    setup = json.loads(data[offset:offset + length])
+    offset += length
+
+    strings = []
+    records = []
+    end = len(data)
+    try:
+        while offset < end:
+            tag = data[offset]
+            offset += 1
+            if tag == UNIT:
+                index, offset = decode_varint(data, offset)
+                records.append((UNIT, index))
+            elif tag == TILE:
+                row, offset = decode_varint(data, offset)
+                column, offset = decode_varint(data, offset)
+                records.append((TILE, (row, column)))
+            elif tag == OPTION:
+                string_id, offset = decode_varint(data, offset)
+                records.append((OPTION, strings[string_id]))
+            elif tag == STRING:
+                length, offset = decode_varint(data, offset)
+                if offset + length > end:
+                    raise EOFError('Truncated string')
+                strings.append(data[offset:offset + length].decode())
+                offset += length
+            elif tag == NONE:
+                records.append((NONE, None))
+            else:
+                raise ValueError(f'Unknown record tag {tag} at byte {offset - 1}')
+    except EOFError:
+        pass
+    return setup, records
+
+
+class StopReplay(Exception):
+    """
+    Ends a replay at the requested step, or when the log is exhausted.
+    """
+
+
+class ReplayDecisionProvider(engine.DecisionProvider):
+    """
+    Answers every request with the next selection of the log, for all players.
+    """
+    def __init__(self, selections: list, stop_at: int = None):
+        self.selections = selections
+        self.stop_at = len(selections) if stop_at is None else min(stop_at, len(selections))
+        self.step = 0
+
+    def choose(self, kind: str, options: list, game: engine.Game) -> Any:
+        if self.step >= self.stop_at:
+            raise StopReplay()
+        selection = self.selections[self.step]
+        self.step += 1
+        return selection
+
+
+def setup_from_log(setup: dict) -> engine.Game:
+    return selfplay.setup_game(setup['seed'], setup['armies'], board_size=setup['board_size'], rules=setup.get('rules'))
+
+
+class Replayer:
+    """
+    Replays a log headlessly at full speed. The log is decoded once and can be replayed any number of times.
+
+    source: Filename, bytes or binary file object of the log
+    game_factory: Builds the game from the setup of the log. Defaults to selfplay.setup_game
+    """
+    def __init__(self, source: str | bytes | BinaryIO, game_factory: Callable[[dict], engine.Game] = setup_from_log):
+        self.setup, self.records = read_log(source)
+        self.game_factory = game_factory
+        self.steps = 0 # Selections applied in the last replay
+        self.finished = False # Whether the last replay played the game to its end
+
+    def __len__(self):
+        return len(self.records)
+
+    def run(self, stop_at: int = None) -> engine.Game:
+        """
+        Replays the game and returns it. With stop_at, the replay stops right before the selection of that step,
+        i.e. after stop_at selections, with the pending request in the current options of the API.
+        """
+        game = self.game_factory(self.setup)
+        roster = game.roster
+        selections = [roster[value] if tag == UNIT else value for tag, value in self.records]
+        provider = ReplayDecisionProvider(selections, stop_at)
+        engine.HeadlessAPI(game, game.rules, provider)
+        try:
+            game.run_headless()
+            self.finished = True
+        except StopReplay:
+            self.finished = False
+        self.steps = provider.step
+        return game
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded game headlessly.')
+    parser.add_argument('log', type=str, help='Replay log file')
+    parser.add_argument('--stop-at', type=int, default=None, help='Stop before the selection of this step')
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(args.log)
+    game = replayer.run(args.stop_at)
+    result = selfplay.game_result(game)
+    result.update({'steps': replayer.steps, 'records': len(replayer), 'finished': replayer.finished,
+                   'active_player': game.active_player, 'pending_options': [str(option) for option in game.api.current_options]
+                   if not replayer.finished else []})
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    return result
+
+
+if __name__ == '__main__':
+    main()
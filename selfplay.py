@@ -0,0 +1,274 @@
+"""
+Self-play runner, which plays many seeded OPR_Firefight games headlessly across worker processes.
+
+Usage:
+    python selfplay.py --games 1000 --workers 8 --agents random random --armies skirmish skirmish
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from typing import Callable, Iterator
+
+import engine
+import agents
+import armybook
+import onepagerules as opr
+import profiling
+import replay
+
+
+# Army lists, given as unit profiles. Weapons are (name, range, attacks, damage)
+ARMIES = {
+    'skirmish': [
+        {'name': 'Trooper', 'quality': 4, 'defense': 4, 'movement': 6, 'weapons': [('Rifle', 24, 1, 1)]},
+        {'name': 'Trooper', 'quality': 4, 'defense': 4, 'movement': 6, 'weapons': [('Rifle', 24, 1, 1)]},
+        {'name': 'Gunner', 'quality': 4, 'defense': 4, 'movement': 6, 'weapons': [('Heavy Gun', 30, 3, 1)]},
+        {'name': 'Brute', 'quality': 3, 'defense': 3, 'movement': 6, 'weapons': [('Claws', 1, 3, 1)]},
+    ],
+    'melee': [
+        {'name': 'Raider', 'quality': 4, 'defense': 5, 'movement': 8, 'weapons': [('Blade', 1, 2, 1)]},
+        {'name': 'Raider', 'quality': 4, 'defense': 5, 'movement': 8, 'weapons': [('Blade', 1, 2, 1)]},
+        {'name': 'Raider', 'quality': 4, 'defense': 5, 'movement': 8, 'weapons': [('Blade', 1, 2, 1)]},
+        {'name': 'Champion', 'quality': 3, 'defense': 4, 'movement': 6, 'weapons': [('Great Axe', 1, 4, 2)]},
+    ],
+}
+
+def mcts_agent(seed: int) -> agents.MCTSDecisionProvider:
+    return agents.MCTSDecisionProvider(seed=seed, iterations=200, time_budget=None)
+
+
+# Decision providers by name, constructed with a seed
+AGENTS: dict[str, Callable[[int], engine.DecisionProvider]] = {
+    'random': agents.RandomDecisionProvider,
+    'mcts': mcts_agent,
+}
+
+
+def deploy_army(game: engine.Game, player: int, army: list[dict]) -> list[opr.OPRUnit]:
+    """
+    Creates the units of an army and deploys them along the home edge of the player.
+    Player 1 deploys on the first row of the board, all other players on the last row.
+    """
+    rows, columns = game.board.size
+    row = 0 if player == 1 else rows - 1
+    spacing = max(columns // (len(army) + 1), 1)
+    return [armybook.build_unit(game, profile, player, (row, min((i + 1) * spacing, columns - 1)))
+            for i, profile in enumerate(army)]
+
+
+def resolve_army(army) -> list[dict]:
+    """
+    Returns the unit profiles of an army: the name of an entry in ARMIES, the path of an exported
+    army list, which is imported once per process, or a list of profiles.
+    """
+    if not isinstance(army, str):
+        return army
+    if army in ARMIES:
+        return ARMIES[army]
+    if army.endswith('.json'):
+        return armybook.load_army_list(army)
+    raise ValueError(f'Unknown army {army}')
+
+
+# Rule parameters that can be varied, e.g. in balance sweeps, with their defaults
+RULE_PARAMETERS = {
+    'max_turns': 4, # Number of game turns
+    'movement': None, # Movement of all units, instead of the movement of their profiles
+    'rush_multiplier': 2, # Rush and charge moves go this many times the movement
+}
+
+
+def apply_rules(game: engine.Game, rules: dict):
+    """
+    Applies a variant of the rule parameters to a set up game. Parameters not given keep their defaults.
+    """
+    unknown = set(rules) - set(RULE_PARAMETERS)
+    if unknown:
+        raise ValueError(f'Unknown rule parameters {sorted(unknown)}, expected some of {sorted(RULE_PARAMETERS)}')
+    if 'max_turns' in rules:
+        game.rules.max_turns = rules['max_turns']
+    for unit in game.rules.units():
+        unit.rush_multiplier = rules.get('rush_multiplier', unit.rush_multiplier)
+        movement = rules.get('movement')
+        unit.set_movement(unit.movement if movement is None else movement)
+
+
+def setup_game(seed: int, armies=('skirmish', 'skirmish'), providers: dict[int, engine.DecisionProvider] = None,
+               board_size=(12, 12), rules: dict = None) -> engine.Game:
+    """
+    Creates a headless OPR_Firefight game with both armies deployed.
+
+    armies: Names of entries in ARMIES, paths of exported army lists or unit profile lists, one per player
+    providers: Decision providers by player. Defaults to random agents
+    rules: Values of RULE_PARAMETERS that differ from the defaults
+    """
+    game = engine.Game(seed=seed)
+    engine.Board(list(board_size), game)
+    rule_system = opr.OPR_Firefight(game)
+    if providers is None:
+        providers = {player: agents.RandomDecisionProvider(seed * len(game.players) + player) for player in game.players}
+    engine.HeadlessAPI(game, rule_system, providers)
+    for player, army in zip(game.players, armies):
+        deploy_army(game, player, resolve_army(army))
+    if rules:
+        apply_rules(game, rules)
+    return game
+
+
+def game_result(game: engine.Game) -> dict:
+    """
+    Summarizes a finished game.
+    """
+    rules = game.rules
+    casualties = {player: 0 for player in game.players}
+    for unit in game.dead_units.values():
+        casualties[unit.player] += 1
+    return {
+        'seed': game.seed,
+        'winner': rules.determine_winner(),
+        'turns': rules.game_turn,
+        'casualties': casualties,
+        'activations': rules.activations,
+        'decisions': game.api.decisions,
+    }
+
+
+def play_game(config: dict) -> dict:
+    """
+    Plays a single game. The config holds the seed, the armies, the agents and the board size,
+    and optionally the rule parameters and a replay_dir, in which the replay log of the game is written.
+    Runs in the worker processes, so the config must be picklable.
+    """
+    start = time.perf_counter()
+    seed = config['seed']
+    providers = {player: AGENTS[agent](seed * 2 + player) for player, agent in zip((1, 2), config['agents'])}
+    game = setup_game(seed, config['armies'], providers, config['board_size'], config.get('rules'))
+    writer = None
+    if config.get('replay_dir'):
+        setup = {'seed': seed, 'armies': config['armies'], 'board_size': config['board_size'], 'rules': config.get('rules')}
+        writer = replay.ReplayWriter(os.path.join(config['replay_dir'], f'game_{seed}.twrl'), setup)
+        writer.attach(game)
+    try:
+        game.run_headless()
+    finally:
+        if writer is not None:
+            writer.close()
+    result = game_result(game)
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+def run_selfplay(n_games: int, seed: int = 0, workers: int = None, agents=('random', 'random'),
+                 armies=('skirmish', 'skirmish'), board_size=(12, 12), chunksize: int = None,
+                 replay_dir: str = None) -> Iterator[dict]:
+    """
+    Plays n_games seeded games across worker processes and yields each result as soon as it is available.
+    Game i is played with the seed seed + i, so every run is reproducible regardless of the number of workers.
+    With workers=1, the games are played in this process. With a replay_dir, every game writes a replay log there.
+    """
+    if replay_dir:
+        os.makedirs(replay_dir, exist_ok=True)
+    configs = ({'seed': seed + i, 'agents': tuple(agents), 'armies': tuple(armies), 'board_size': tuple(board_size),
+                'replay_dir': replay_dir} for i in range(n_games))
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        yield from map(play_game, configs)
+        return
+    # Large chunks keep the inter-process traffic low, while still streaming results
+    chunksize = chunksize or max(1, min(64, n_games // (workers * 8)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(play_game, configs, chunksize=chunksize)
+        # Let the workers exit on their own. Terminating them fails if pygame was initialized before the fork,
+        # since SDL turns SIGTERM into a quit event
+        pool.close()
+        pool.join()
+
+
+def wilson_interval(successes: float, n: int, z: float = 1.96) -> tuple[float, float]:
+    """
+    Returns the Wilson score confidence interval of a rate, by default at 95% confidence.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def summarize(results: list[dict], players=(1, 2)) -> dict:
+    """
+    Aggregates game results into win rates with confidence intervals and average game statistics.
+    """
+    n = len(results)
+    summary = {'games': n, 'players': {}}
+    for player in players:
+        wins = sum(1 for result in results if result['winner'] == player)
+        low, high = wilson_interval(wins, n)
+        summary['players'][player] = {
+            'wins': wins,
+            'win_rate': wins / n if n else 0.0,
+            'win_rate_ci': (low, high),
+            'mean_casualties': sum(result['casualties'][player] for result in results) / n if n else 0.0,
+        }
+    draws = sum(1 for result in results if result['winner'] is None)
+    summary['draws'] = draws
+    summary['draw_rate'] = draws / n if n else 0.0
+    summary['mean_turns'] = sum(result['turns'] for result in results) / n if n else 0.0
+    summary['mean_activations'] = sum(result['activations'] for result in results) / n if n else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play many headless OPR_Firefight games in parallel.')
+    parser.add_argument('--games', type=int, default=100, help='Number of games to play')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes, defaults to all cores')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game')
+    parser.add_argument('--agents', nargs=2, default=['random', 'random'], choices=sorted(AGENTS), help='Agents of player 1 and 2')
+    parser.add_argument('--armies', nargs=2, default=['skirmish', 'skirmish'],
+                        help=f'Armies of player 1 and 2, one of {sorted(ARMIES)} or the path of an exported army list')
+    parser.add_argument('--board', nargs=2, type=int, default=[12, 12], help='Board size')
+    parser.add_argument('--results', type=str, default=None, help='Stream the per-game results to this JSON lines file')
+    parser.add_argument('--replays', type=str, default=None, help='Write the replay log of every game into this directory')
+    parser.add_argument('--profile', type=str, default=None, help='Profile the phases of the games into this JSON file. Plays in this process')
+    parser.add_argument('--trace', type=str, default=None, help='Write a Chrome trace of the phases to this file. Plays in this process')
+    args = parser.parse_args(argv)
+
+    # The profiler measures this process only
+    profiler = profiling.enable(trace=args.trace is not None) if args.profile or args.trace else None
+    workers = 1 if profiler else args.workers
+
+    start = time.perf_counter()
+    results = []
+    output = open(args.results, 'w') if args.results else None
+    try:
+        for result in run_selfplay(args.games, args.seed, workers, args.agents, args.armies, args.board,
+                                   replay_dir=args.replays):
+            results.append(result)
+            if output:
+                output.write(json.dumps(result) + '\n')
+    finally:
+        if output:
+            output.close()
+        if profiler:
+            profiling.disable()
+    elapsed = time.perf_counter() - start
+    if args.profile:
+        profiler.to_json(args.profile)
+    if args.trace:
+        profiler.to_chrome_trace(args.trace)
+
+    summary = summarize(results)
+    summary['games_per_second'] = len(results) / elapsed if elapsed > 0 else float('inf')
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Balance sweeps over variants of the rule parameters, with sequential early stopping.
+
+Every variant of a grid of selfplay.RULE_PARAMETERS is played until its balance is clear: the score of player 1,
+with a win counting 1 and a draw 0.5, is tested after every batch of games. A variant stops as soon as the
+confidence interval of its score excludes 0.5, i.e. it favours one player, or is narrower than 2 * precision,
+i.e. it is balanced within the precision. Otherwise it stops after max_games. The confidence of the
+intervals is corrected for the repeated looks, so the error rate of every decision is at most 1 - confidence.
+
+All variants play the same seeds, so their differences do not depend on luck. The results enter the tests
+in the order of their seeds, so the decisions and the number of games do not depend on the number of workers.
+Finished variants are stored in a result cache, and a rerun of the sweep only plays the variants that are missing.
+
+Usage:
+    python sweep.py --param max_turns 3 4 5 --param rush_multiplier 1.5 2 --workers 8 --cache sweep.json
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from typing import Iterator
+
+import selfplay
+
+
+def variant_grid(grid: dict[str, list]) -> list[dict]:
+    """
+    Returns all combinations of the parameter values of the grid, e.g. {'max_turns': [3, 4]} -> [{'max_turns': 3}, {'max_turns': 4}].
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+class VariantTest:
+    """
+    Sequential test of the balance of one variant.
+    """
+    def __init__(self, rules: dict, max_games: int, batch: int, precision: float, confidence: float, min_games: int):
+        self.rules = rules
+        self.max_games = max_games
+        self.batch = batch
+        self.precision = precision
+        self.min_games = min_games
+        # Bonferroni correction over the largest possible number of looks
+        looks = max(1, math.ceil(max_games / batch))
+        self.z = statistics.NormalDist().inv_cdf(1 - (1 - confidence) / (2 * looks))
+
+        self.scheduled = 0
+        self.results = []
+        self.received = {} # Results of finished games that wait for the games before them, by game index
+        self.decision = None # 'player 1', 'player 2' or 'balanced', or 'undecided' after max_games
+
+    @property
+    def done(self) -> bool:
+        return self.decision is not None
+
+    def add(self, result: dict):
+        self.results.append(result)
+        n = len(self.results)
+        if n % self.batch and n < self.max_games:
+            return
+        if n < self.min_games:
+            return
+        low, high = self.interval()
+        if low > 0.5:
+            self.decision = 'player 1'
+        elif high < 0.5:
+            self.decision = 'player 2'
+        elif high - low < 2 * self.precision:
+            self.decision = 'balanced'
+        elif n >= self.max_games:
+            self.decision = 'undecided'
+
+    def receive(self, index: int, result: dict):
+        """
+        Adds the result of the game with the given index once the results of all games before it are in.
+        The looks, and thus the decision, do not depend on the order in which the games finish.
+        """
+        self.received[index] = result
+        while not self.done and len(self.results) in self.received:
+            self.add(self.received.pop(len(self.results)))
+
+    def score(self) -> float:
+        return sum(1.0 if result['winner'] == 1 else 0.5 if result['winner'] is None else 0.0 for result in self.results)
+
+    def interval(self) -> tuple[float, float]:
+        return selfplay.wilson_interval(self.score(), len(self.results), self.z)
+
+    def summary(self) -> dict:
+        summary = selfplay.summarize(self.results)
+        summary['rules'] = self.rules
+        summary['decision'] = self.decision
+        summary['score'] = self.score() / len(self.results) if self.results else 0.5
+        summary['score_ci'] = self.interval()
+        return summary
+
+
+class ResultCache:
+    """
+    Summaries of finished variants in a JSON file, keyed by everything that determines them.
+    """
+    def __init__(self, filename: str = None):
+        self.filename = filename
+        self.entries = {}
+        if filename and os.path.exists(filename):
+            with open(filename) as file:
+                self.entries = json.load(file)
+
+    @staticmethod
+    def key(rules: dict, settings: dict) -> str:
+        return json.dumps({'rules': rules, **settings}, sort_keys=True)
+
+    def get(self, rules: dict, settings: dict) -> dict:
+        return self.entries.get(self.key(rules, settings))
+
+    def put(self, rules: dict, settings: dict, summary: dict):
+        self.entries[self.key(rules, settings)] = summary
+        if self.filename:
+            temporary = f'{self.filename}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(self.entries, file, indent=1)
+            os.replace(temporary, self.filename)
+
+
+def run_sweep(variants: list[dict], seed: int = 0, workers: int = None, agents=('random', 'random'),
+              armies=('skirmish', 'skirmish'), board_size=(12, 12), max_games: int = 2000, batch: int = 50,
+              precision: float = 0.05, confidence: float = 0.95, min_games: int = 100,
+              cache: ResultCache = None) -> Iterator[dict]:
+    """
+    Plays the variants until each is decided and yields the summary of every variant as soon as it is done,
+    cached variants first. Games are scheduled across worker processes, always for the active variant with
+    the fewest games, so that all variants progress together and decided ones free the workers early.
+    """
+    cache = cache or ResultCache()
+    settings = {'seed': seed, 'agents': list(agents), 'armies': list(armies), 'board_size': list(board_size),
+                'max_games': max_games, 'batch': batch, 'precision': precision, 'confidence': confidence,
+                'min_games': min_games}
+    tests = []
+    for rules in variants:
+        cached = cache.get(rules, settings)
+        if cached is not None:
+            yield dict(cached, cached=True)
+        else:
+            tests.append(VariantTest(rules, max_games, batch, precision, confidence, min_games))
+
+    def config(test: VariantTest) -> dict:
+        # The same seeds for every variant
+        game_seed = seed + test.scheduled
+        test.scheduled += 1
+        return {'seed': game_seed, 'agents': tuple(agents), 'armies': tuple(armies), 'board_size': tuple(board_size),
+                'rules': test.rules}
+
+    def finish(test: VariantTest) -> dict:
+        summary = test.summary()
+        cache.put(test.rules, settings, summary)
+        return dict(summary, cached=False)
+
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for test in tests:
+            while not test.done:
+                test.add(selfplay.play_game(config(test)))
+            yield finish(test)
+        return
+
+    # Enough games in flight to keep every worker busy, but few enough to stop soon after a decision
+    in_flight = workers * 2
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = {}
+        while True:
+            active = [test for test in tests if not test.done and test.scheduled < test.max_games]
+            while active and len(pending) < in_flight:
+                test = min(active, key=lambda test: test.scheduled)
+                index = test.scheduled
+                pending[pool.submit(selfplay.play_game, config(test))] = (test, index)
+                active = [test for test in active if test.scheduled < test.max_games]
+            if not pending:
+                break
+            completed, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                test, index = pending.pop(future)
+                if test.done:
+                    continue
+                test.receive(index, future.result())
+                if test.done:
+                    yield finish(test)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the balance of variants of the rules, stopping each as soon as it is clear.')
+    parser.add_argument('--param', nargs='+', action='append', default=[], metavar=('NAME', 'VALUE'),
+                        help=f'A rule parameter and its values, one of {sorted(selfplay.RULE_PARAMETERS)}. Can be repeated')
+    parser.add_argument('--max-games', type=int, default=2000, help='Games after which a variant stops undecided')
+    parser.add_argument('--batch', type=int, default=50, help='Games between the tests of a variant')
+    parser.add_argument('--precision', type=float, default=0.05, help='Half width of the score interval at which a variant is balanced')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence of each decision')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes, defaults to all cores')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game of every variant')
+    parser.add_argument('--agents', nargs=2, default=['random', 'random'], choices=sorted(selfplay.AGENTS), help='Agents of player 1 and 2')
+    parser.add_argument('--armies', nargs=2, default=['skirmish', 'skirmish'], help='Armies of player 1 and 2')
+    parser.add_argument('--board', nargs=2, type=int, default=[12, 12], help='Board size')
+    parser.add_argument('--cache', type=str, default=None, help='JSON file of finished variants, which reruns skip')
+    args = parser.parse_args(argv)
+
+    grid = {}
+    for name, *values in args.param:
+        if name not in selfplay.RULE_PARAMETERS:
+            parser.error(f'Unknown rule parameter {name}')
+        grid[name] = [json.loads(value) for value in values]
+
+    start = time.perf_counter()
+    summaries = []
+    for summary in run_sweep(variant_grid(grid), args.seed, args.workers, args.agents, args.armies, args.board,
+                             args.max_games, args.batch, args.precision, args.confidence, cache=ResultCache(args.cache)):
+        summaries.append(summary)
+        print(f"{json.dumps(summary['rules'])}: {summary['decision']} after {summary['games']} games, "
+              f"score {summary['score']:.3f} [{summary['score_ci'][0]:.3f}, {summary['score_ci'][1]:.3f}]"
+              f"{' (cached)' if summary['cached'] else ''}", file=sys.stderr)
+    played = sum(summary['games'] for summary in summaries if not summary['cached'])
+    elapsed = time.perf_counter() - start
+    json.dump({'variants': summaries, 'games': played, 'seconds': elapsed}, sys.stdout, indent=2)
+    print()
+    return summaries
+
+
+if __name__ == '__main__':
+    main()
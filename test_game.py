@@ -1,8 +1,11 @@
 import engine
 import gameUI
 import asyncio
+import logging
 import onepagerules	as opr
 
+logging.basicConfig(level=logging.INFO)
+
 game = engine.Game()
 board= engine.Board([8,8], game)
 opr_rules = opr.OPR_Firefight(game)
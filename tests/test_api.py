@@ -1,4 +1,4 @@
-# tests/test_engine.py
+# tests/test_api.py
 
 import unittest
 import engine
@@ -9,9 +9,17 @@ class TestGameAPI(unittest.TestCase):
     def setUp(self):
         # Setup a simple board and API for testing
         self.game = engine.Game()
-        self.opr_rules = opr.OPR_Firefight(self.game)
         self.board = engine.Board(size=(10, 10), game=self.game)
-        self.api = engine.GameAPI(self.game, self.opr_rules)
+        self.opr_rules = opr.OPR_Firefight(self.game)
+        self.api = engine.API(self.game, self.opr_rules)
+
+    def test_selection_round_trip(self):
+        self.api.select_option(['Hold', 'Advance'])
+        self.assertEqual(self.api.state, 'wait_for_option_sel')
+        self.assertEqual(self.api.current_options, ['Hold', 'Advance'])
+        self.api.selection_done('Advance')
+        self.assertEqual(self.api.state, 'game_running')
+        self.assertEqual(self.api.selection, 'Advance')
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+# tests/test_armybook.py
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import armybook
+import engine
+import selfplay
+
+LIST_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'army_lists', 'OPR_export', 'Saurian_testlist.json')
+ARMY_ID = 'U6hwlur14RpnInZr'
+
+class TestArmyBook(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data_dir = os.path.join(self.directory.name, 'books')
+        shutil.copytree(armybook.ARMY_BOOK_DIR, self.data_dir, ignore=shutil.ignore_patterns('.cache'))
+        self.cache = armybook.ArmyBookCache(self.data_dir)
+        with open(LIST_PATH) as file:
+            self.army_list = json.load(file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_list_resolves_to_profiles(self):
+        profiles = armybook.import_army_list(self.army_list, self.cache)
+        self.assertEqual([profile['name'] for profile in profiles],
+                         ['Saurian Veteran', 'Saurian Warrior', 'Saurian Scout', 'Saurian Brute'])
+        veteran, _, scout, brute = profiles
+        # The upgrades replace the Heavy Rifle with a Plasma Rifle and add Fast
+        self.assertEqual([weapon[0] for weapon in veteran['weapons']], ['CCW', 'Plasma Rifle'])
+        self.assertEqual(veteran['movement'], 8)
+        self.assertEqual(veteran['wounds'], 3)
+        self.assertIn('Fast', veteran['special_rules'])
+        self.assertEqual(brute['movement'], 4)
+        self.assertEqual(brute['weapons'], [('Massive Claws', 1, 3, 3)])
+        self.assertEqual(scout['weapons'], [('Sniper Rifle', 30, 1, 1)])
+
+    def test_books_are_cached_by_army_and_version(self):
+        self.cache.get(ARMY_ID, '3.4.0')
+        self.cache.get(ARMY_ID, '3.4.0')
+        self.assertEqual((self.cache.parsed, self.cache.loaded), (1, 0))
+
+        # A new process loads the binary cache instead of parsing the book
+        cache = armybook.ArmyBookCache(self.data_dir)
+        book = cache.get(ARMY_ID, '3.4.0')
+        self.assertEqual((cache.parsed, cache.loaded), (0, 1))
+        self.assertEqual(book, self.cache.get(ARMY_ID, '3.4.0'))
+
+    def test_modified_books_are_parsed_again(self):
+        self.cache.get(ARMY_ID, '3.4.0')
+        path = os.path.join(self.data_dir, f'{ARMY_ID}.json')
+        with open(path) as file:
+            data = json.load(file)
+        data['units'][1]['quality'] = 5
+        with open(path, 'w') as file:
+            json.dump(data, file)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        cache = armybook.ArmyBookCache(self.data_dir)
+        self.assertEqual(cache.get(ARMY_ID, '3.4.0')['units']['eOvxa']['quality'], 5)
+        self.assertEqual((cache.parsed, cache.loaded), (1, 0))
+
+    def test_unknown_selections_raise(self):
+        self.army_list['list']['units'][0]['selectionId'] = 'missing'
+        with self.assertRaises(KeyError):
+            armybook.import_army_list(self.army_list, self.cache)
+
+    def test_selfplay_with_an_army_list(self):
+        game = selfplay.setup_game(1, armies=(LIST_PATH, 'skirmish'))
+        units = game.rules.units(1)
+        self.assertEqual(len(units), 4)
+        self.assertEqual(units[0].wounds, 3)
+        self.assertIs(selfplay.resolve_army(LIST_PATH), selfplay.resolve_army(LIST_PATH))
+        game.run_headless()
+        self.assertTrue(game.rules.check_game_over())
+
+
+if __name__ == '__main__':
+    unittest.main()
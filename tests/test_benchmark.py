@@ -0,0 +1,72 @@
+# tests/test_benchmark.py
+
+import contextlib
+import io
+import json
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import random
+import tempfile
+import unittest
+import benchmark
+
+def results(samples: dict) -> dict:
+    return {'meta': {}, 'benchmarks': {name: {'samples': values, 'median': sorted(values)[len(values) // 2]}
+                                       for name, values in samples.items()}}
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_quick_run_and_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'baseline.json')
+            output = io.StringIO()
+            with contextlib.redirect_stderr(output), contextlib.redirect_stdout(output):
+                self.assertEqual(benchmark.main(['--quick', '--filter', '[8x8,4 units]', '--repeats', '3',
+                                                 '--min-time', '0.001', '--save', filename]), 0)
+            self.assertIn('board.in_range[8x8,4 units]', output.getvalue())
+            with open(filename) as file:
+                baseline = json.load(file)
+            self.assertEqual(sorted(baseline['benchmarks']), ['board.in_range[8x8,4 units]', 'board.is_occupied[8x8,4 units]',
+                                                             'piece.place[8x8,4 units]'])
+            for result in baseline['benchmarks'].values():
+                self.assertEqual(len(result['samples']), 3)
+                self.assertGreater(result['median'], 0)
+
+    def test_headless_game_and_ui_frames(self):
+        names = ['game.headless[random,12x12]', 'ui.frame_idle[8x8]', 'ui.frame_move[8x8]']
+        benchmarks = [bench for bench in benchmark.all_benchmarks(quick=True) if bench.name in names]
+        measured = benchmark.run_benchmarks(benchmarks, repeats=2, min_time=0.001)
+        self.assertEqual(sorted(measured['benchmarks']), names)
+
+    def test_environments(self):
+        names = ['env.scalar_activation[random,12x12]', 'env.vector_activation[random,12x12,K=64]']
+        benchmarks = [bench for bench in benchmark.all_benchmarks(quick=True) if bench.name.startswith('env.')]
+        measured = benchmark.run_benchmarks(benchmarks, repeats=2, min_time=0.001)
+        self.assertEqual(sorted(measured['benchmarks']), names)
+
+    def test_significant_slowdowns_are_regressions(self):
+        rng = random.Random(0)
+        base = [1.0 + rng.gauss(0, 0.02) for _ in range(10)]
+        noise = [1.0 + rng.gauss(0, 0.02) for _ in range(10)]
+        slower = [1.2 + rng.gauss(0, 0.02) for _ in range(10)]
+        faster = [0.8 + rng.gauss(0, 0.02) for _ in range(10)]
+        rows = benchmark.compare(results({'a': base, 'b': base, 'c': base, 'gone': base}),
+                                 results({'a': noise, 'b': slower, 'c': faster, 'added': base}))
+        self.assertEqual({row['name']: row['status'] for row in rows},
+                         {'a': 'unchanged', 'b': 'regression', 'c': 'improvement', 'gone': 'missing', 'added': 'new'})
+
+    def test_small_or_noisy_slowdowns_are_not_regressions(self):
+        # 2% slower, below the threshold
+        self.assertEqual(benchmark.compare(results({'a': [1.0, 1.001] * 5}), results({'a': [1.02, 1.021] * 5}))[0]['status'],
+                         'unchanged')
+        # Much slower, but with too few samples to be significant
+        self.assertEqual(benchmark.compare(results({'a': [1.0]}), results({'a': [2.0]}))[0]['status'], 'unchanged')
+
+    def test_mann_whitney(self):
+        self.assertLess(benchmark.mann_whitney_greater([2, 3, 4, 5, 6], [0, 0.5, 1, 1.5, 1.8]), 0.01)
+        self.assertGreater(benchmark.mann_whitney_greater([0, 0.5, 1, 1.5, 1.8], [2, 3, 4, 5, 6]), 0.99)
+        self.assertAlmostEqual(benchmark.mann_whitney_greater([1, 1, 1], [1, 1, 1]), 0.5, delta=0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# tests/test_board.py
+
+import unittest
+import numpy as np
+import engine
+import onepagerules as opr
+
+class TestBoard(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game()
+        self.opr_rules = opr.OPR_Firefight(self.game)
+        self.board = engine.Board(size=(10, 10), game=self.game)
+
+    def test_place_and_remove_update_occupancy(self):
+        unit = opr.OPRUnit(self.game, 'Soldier', player=1, position=(2, 3))
+        self.assertEqual(self.board.occupancy[2, 3], unit.slot)
+        self.assertIs(self.board.piece_at((2, 3)), unit)
+        self.assertTrue(self.board.is_occupied((2, 3)))
+
+        unit.place((4, 4))
+        self.assertFalse(self.board.is_occupied((2, 3)))
+        self.assertIsNone(self.board.map[2, 3])
+        self.assertIs(self.board.map[4, 4], unit)
+
+        unit.remove()
+        self.assertTrue((self.board.occupancy == -1).all())
+        self.assertIsNone(unit.slot)
+
+    def test_multi_square_footprint(self):
+        big = engine.Piece(self.game, 'Building', extent=[3, 2])
+        big.place((5, 5))
+        self.assertEqual((self.board.occupancy >= 0).sum(), 6)
+        self.assertTrue(self.board.is_occupied((7, 6)))
+        self.assertTrue(self.board.is_occupied((4, 4), [2, 2]))
+        self.assertFalse(self.board.is_occupied((3, 3), [2, 2]))
+        # A footprint leaving the board does not fit
+        self.assertTrue(self.board.is_occupied((9, 9), [2, 2]))
+
+        with self.assertRaises(AssertionError):
+            opr.OPRUnit(self.game, 'Soldier', player=1, position=(6, 6))
+
+    def test_legal_placements_match_is_occupied(self):
+        engine.Piece(self.game, 'Rock', position=(1, 1))
+        engine.Piece(self.game, 'Wall', extent=[1, 4]).place((6, 2))
+        for extent in ([0, 0], [2, 2], [3, 1]):
+            legal = self.board.legal_placements(extent)
+            expected = np.array([[not self.board.is_occupied((x, y), extent) for y in range(10)] for x in range(10)])
+            np.testing.assert_array_equal(legal, expected)
+        self.assertNotIn((1, 1), self.board.legal_positions())
+
+    def test_legal_placements_ignore_moving_piece(self):
+        big = engine.Piece(self.game, 'Tank', extent=[2, 2])
+        big.place((0, 0))
+        self.assertFalse(self.board.legal_placements([2, 2])[1, 1])
+        self.assertTrue(self.board.legal_placements([2, 2], ignore=big)[1, 1])
+        big.place((1, 1))
+        self.assertIs(self.board.piece_at((2, 2)), big)
+        self.assertIsNone(self.board.piece_at((0, 0)))
+
+    def test_in_range_matches_distance(self):
+        friend = opr.OPRUnit(self.game, 'Friend', player=1, position=(4, 4))
+        enemy = opr.OPRUnit(self.game, 'Enemy', player=2, position=(6, 5))
+        engine.Piece(self.game, 'Rock', position=(3, 3))
+
+        tiles = self.board.in_range((4, 4), 2.5)
+        expected = [(x, y) for x in range(10) for y in range(10)
+                    if (x, y) != (4, 4) and np.hypot(x - 4, y - 4) <= 2.5]
+        self.assertEqual(tiles, expected)
+        self.assertEqual(self.board.in_range((4, 4), 2.5, 'Unit'), [(6, 5)])
+        self.assertEqual(self.board.in_range((4, 4), 2.5, 'Piece'), [(3, 3), (6, 5)])
+        self.assertEqual(self.board.in_range((5, 5), 2, 'Unit', players=[1]), [(4, 4)])
+        # Squares off the board are dropped
+        self.assertEqual(len(self.board.in_range((0, 0), 1)), 2)
+
+    def test_stencil_respects_gridsize(self):
+        dx, dy = engine.disk_stencil(2, 0.5)
+        self.assertEqual(dx.max(), 4)
+        self.assertIs(engine.disk_stencil(2, 0.5)[0], dx)
+
+    def test_batched_queries(self):
+        opr.OPRUnit(self.game, 'Enemy', player=2, position=(5, 5))
+        origins = [(5, 3), (0, 0), (4, 4)]
+        counts = self.board.count_in_range(origins, 2, 'Unit', players=[2])
+        np.testing.assert_array_equal(counts, [1, 0, 1])
+        xs, ys, hits = self.board.in_range_batch(origins, 1.5)
+        for origin, x, y, hit in zip(origins, xs, ys, hits):
+            self.assertEqual(list(zip(x[hit].tolist(), y[hit].tolist())), self.board.in_range(origin, 1.5))
+
+    def test_movement_on_open_board(self):
+        unit = opr.OPRUnit(self.game, 'Runner', player=1, position=(5, 5))
+        costs = self.board.movement_costs(unit, 3)
+        self.assertEqual(costs[5, 5], 0)
+        self.assertAlmostEqual(costs[7, 7], 2 * np.sqrt(2))
+        self.assertEqual(costs[5, 8], 3)
+        self.assertTrue(np.isinf(costs[8, 8]))
+        self.assertNotIn((5, 5), unit.get_fields_in_range('movement'))
+
+    def test_movement_goes_around_pieces_and_terrain(self):
+        unit = opr.OPRUnit(self.game, 'Runner', player=1, position=(5, 1))
+        for y in range(0, 4):
+            engine.Piece(self.game, 'Wall', position=(4, y))
+        self.board.set_terrain((slice(4, 5), slice(4, 5)), 2)
+        costs = self.board.movement_costs(unit, 12)
+        # The only way north leads around the wall, which costs more than the straight line
+        self.assertGreater(costs[3, 1], 4)
+        self.assertTrue(np.isfinite(costs[3, 1]))
+        self.assertTrue(np.isinf(costs[4, 4]))
+        self.assertNotIn((3, 1), self.board.reachable_positions(unit, 2))
+
+    def test_difficult_terrain_doubles_the_cost(self):
+        unit = opr.OPRUnit(self.game, 'Runner', player=1, position=(0, 0))
+        self.board.set_terrain((slice(0, 1), slice(1, 2)), 0.5)
+        self.assertEqual(self.board.movement_costs(unit, 6)[0, 1], 2)
+
+    def test_movement_with_extent(self):
+        tank = opr.OPRUnit(self.game, 'Tank', player=1)
+        tank.extent = [2, 2]
+        tank.place((0, 0))
+        engine.Piece(self.game, 'Wall', position=(3, 0))
+        positions = self.board.reachable_positions(tank, 2)
+        self.assertIn((1, 1), positions)
+        self.assertNotIn((2, 0), positions)
+        for position in positions:
+            self.assertTrue(self.board.legal_placements(tank.extent, ignore=tank)[position])
+
+    def test_movement_costs_are_cached_until_the_board_changes(self):
+        unit = opr.OPRUnit(self.game, 'Runner', player=1, position=(5, 5))
+        costs = self.board.movement_costs(unit, 6)
+        self.assertIs(self.board.movement_costs(unit, 6), costs)
+        opr.OPRUnit(self.game, 'Blocker', player=2, position=(6, 6))
+        updated = self.board.movement_costs(unit, 6)
+        self.assertIsNot(updated, costs)
+        self.assertTrue(np.isinf(updated[6, 6]))
+
+
+if __name__ == '__main__':
+    unittest.main()
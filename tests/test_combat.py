@@ -0,0 +1,113 @@
+# tests/test_combat.py
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import engine
+import combat
+import onepagerules as opr
+
+class TestDice(unittest.TestCase):
+
+    def test_natural_rolls_override_target(self):
+        rolls = np.arange(1, 7)
+        np.testing.assert_array_equal(combat.roll_succeeds(rolls, 4), [False, False, False, True, True, True])
+        np.testing.assert_array_equal(combat.roll_succeeds(rolls, 7), [False, False, False, False, False, True])
+        np.testing.assert_array_equal(combat.roll_succeeds(rolls, 1), [False, True, True, True, True, True])
+
+    def test_roll_attacks_per_group(self):
+        rng = np.random.default_rng(0)
+        wounds = combat.roll_attacks(rng, attacks=[20000, 0, 20000], damage=[1, 5, 2], quality=4, defense=[4, 4, 7])
+        self.assertEqual(wounds[1], 0)
+        # P(hit) = 1/2, P(not blocked) = 1/2 and 5/6
+        self.assertAlmostEqual(wounds[0] / 20000, 0.25, delta=0.02)
+        self.assertAlmostEqual(wounds[2] / 20000, 2 * 0.5 * 5 / 6, delta=0.04)
+
+    def test_seeded_rolls_are_reproducible(self):
+        first = combat.roll_attacks(np.random.default_rng(5), [3, 4], [1, 1], 3, 5)
+        second = combat.roll_attacks(np.random.default_rng(5), [3, 4], [1, 1], 3, 5)
+        np.testing.assert_array_equal(first, second)
+
+    def test_simulated_wounds(self):
+        rng = np.random.default_rng(1)
+        wounds = combat.simulate_wounds(rng, attacks=[10, 10], damage=[1, 2], quality=4, defense=4, trials=50000)
+        self.assertEqual(wounds.shape, (50000,))
+        self.assertAlmostEqual(wounds.mean(), 10 * 0.25 + 20 * 0.25, delta=0.1)
+
+
+class TestOutcomeTable(unittest.TestCase):
+
+    def test_distribution_matches_simulation(self):
+        table = combat.OutcomeTable()
+        weapons = [opr.OPRWeapon('Rifle', 24, 3, 1), opr.OPRWeapon('Launcher', 24, 2, 3)]
+        pmf = table.distribution(weapons, quality=3, defense=5)
+        self.assertAlmostEqual(pmf.sum(), 1.0)
+        self.assertEqual(len(pmf), 3 + 6 + 1)
+        p = (4 / 6) * (4 / 6)
+        self.assertAlmostEqual(table.expected_wounds(weapons, 3, 5), 3 * p + 6 * p)
+
+        wounds = combat.simulate_wounds(np.random.default_rng(2), [3, 2], [1, 3], 3, 5, trials=200000)
+        simulated = np.bincount(wounds, minlength=len(pmf)) / len(wounds)
+        np.testing.assert_allclose(simulated, pmf, atol=0.005)
+
+    def test_kill_queries(self):
+        table = combat.OutcomeTable()
+        weapons = [(2, 1)]
+        p = combat.unblocked_probability(4, 4)
+        self.assertAlmostEqual(table.kill_probability(weapons, 4, 4, wounds=1), 1 - (1 - p) ** 2)
+        self.assertAlmostEqual(table.kill_probability(weapons, 4, 4, wounds=2), p ** 2)
+        self.assertEqual(table.kill_probability(weapons, 4, 4, wounds=3), 0.0)
+        self.assertAlmostEqual(table.expected_kills(weapons, 4, 4, wounds=1, models=5), 2 * p)
+
+    def test_memoization_and_eviction(self):
+        table = combat.OutcomeTable(max_entries=2)
+        table.distribution([(1, 1), (2, 1)], 4, 4)
+        table.distribution([(2, 1), (1, 1)], 4, 4)
+        self.assertEqual((table.hits, table.misses), (1, 1))
+        table.distribution([(3, 1)], 4, 4)
+        table.distribution([(4, 1)], 4, 4)
+        self.assertEqual(len(table.entries), 2)
+        self.assertNotIn(table.profile([(1, 1), (2, 1)], 4, 4), table.entries)
+
+    def test_save_and_load(self):
+        table = combat.OutcomeTable()
+        pmf = table.distribution([(5, 2)], 3, 4)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'outcomes.pkl')
+            table.save(filename)
+            loaded = combat.OutcomeTable()
+            loaded.load(filename)
+        np.testing.assert_array_equal(loaded.distribution([(5, 2)], 3, 4), pmf)
+        self.assertEqual(loaded.misses, 0)
+
+
+class TestUnitDamage(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game(seed=0)
+        self.opr_rules = opr.OPR_Firefight(self.game)
+        self.board = engine.Board(size=(10, 10), game=self.game)
+
+    def test_attack_destroys_target(self):
+        shooter = opr.OPRUnit(self.game, 'Shooter', player=1, position=(0, 0))
+        shooter.quality = 2
+        shooter.add_weapon(opr.OPRWeapon('Cannon', range=24, attacks=50, damage=1))
+        target = opr.OPRUnit(self.game, 'Target', player=2, position=(5, 5))
+        target.defense = 6
+        target.wounds = 3
+
+        shooter.attack([(weapon, target) for weapon in shooter.weapons])
+        self.assertLessEqual(target.wounds, 0)
+        self.assertIsNone(target.position)
+        self.assertIn(target, self.game.dead_units.values())
+
+    def test_attack_requires_stats(self):
+        shooter = opr.OPRUnit(self.game, 'Shooter', player=1, position=(0, 0))
+        target = opr.OPRUnit(self.game, 'Target', player=2, position=(5, 5))
+        with self.assertRaises(ValueError):
+            shooter.attack([(opr.OPRWeapon('Rifle', 24, 1, 1), target)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# tests/test_dataset.py
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import dataset
+import environment
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.dtype = dataset.record_dtype((2, 3, 3), 5)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_episodes(self, writer, episodes, steps=4):
+        for episode in range(episodes):
+            for step in range(steps):
+                observation = np.full((2, 3, 3), episode * 10 + step, dtype=np.float32)
+                mask = np.arange(5) <= step
+                writer.add(observation, mask, step)
+            writer.end_episode(1.0 if episode % 2 == 0 else -1.0)
+
+    def test_records_round_trip_across_rotated_shards(self):
+        # Room for three records per shard
+        with dataset.ShardWriter(self.path, self.dtype, max_shard_bytes=3 * self.dtype.itemsize) as writer:
+            self.write_episodes(writer, 5)
+        reader = dataset.ShardReader(self.path)
+        self.assertEqual(len(reader), 20)
+        self.assertEqual(len(reader.shards), 7)
+        self.assertTrue(all(os.path.getsize(os.path.join(self.path, f'shard_{i:05d}.bin')) <= 3 * self.dtype.itemsize
+                            for i in range(7)))
+
+        record = reader[13]
+        self.assertEqual((record['episode'], record['step'], record['action']), (3, 1, 1))
+        self.assertEqual(record['outcome'], -1.0)
+        self.assertTrue((record['observation'] == 31).all())
+        self.assertEqual(record['action_mask'].tolist(), [True, True, False, False, False])
+
+    def test_sampling_reads_from_memory_maps(self):
+        with dataset.ShardWriter(self.path, self.dtype, max_shard_bytes=8 * self.dtype.itemsize) as writer:
+            self.write_episodes(writer, 6)
+        reader = dataset.ShardReader(self.path)
+        self.assertIsInstance(reader.shards[0], np.memmap)
+        batch = reader.sample(64, np.random.default_rng(0))
+        self.assertEqual(batch.shape, (64,))
+        # Every sampled record is consistent with its episode and step
+        expected = batch['episode'] * 10 + batch['step']
+        np.testing.assert_array_equal(batch['observation'][:, 0, 0, 0], expected)
+        np.testing.assert_array_equal(batch['outcome'], np.where(batch['episode'] % 2 == 0, 1.0, -1.0))
+
+    def test_writer_continues_an_existing_dataset(self):
+        with dataset.ShardWriter(self.path, self.dtype) as writer:
+            self.write_episodes(writer, 2)
+        with dataset.ShardWriter(self.path, self.dtype) as writer:
+            self.write_episodes(writer, 1)
+        reader = dataset.ShardReader(self.path)
+        self.assertEqual(len(reader), 12)
+        self.assertEqual(reader[11]['episode'], 2)
+        with self.assertRaises(ValueError):
+            dataset.ShardWriter(self.path, dataset.record_dtype((2, 3, 3), 6))
+
+    def test_unfinished_episodes_are_discarded(self):
+        with dataset.ShardWriter(self.path, self.dtype) as writer:
+            self.write_episodes(writer, 1)
+            writer.add(np.zeros((2, 3, 3), dtype=np.float32), np.ones(5, dtype=bool), 0)
+        self.assertEqual(len(dataset.ShardReader(self.path)), 4)
+
+    def test_collect_from_the_environment(self):
+        env = environment.FirefightEnv(board_size=(8, 8), seed=1)
+        dtype = dataset.record_dtype(env.observation.shape, env.n_actions)
+        with dataset.ShardWriter(self.path, dtype) as writer:
+            written = dataset.collect(env, writer, 2, np.random.default_rng(1))
+        reader = dataset.ShardReader(self.path)
+        self.assertEqual(len(reader), written)
+        records = reader[np.arange(len(reader))]
+        # Actions are legal and outcomes are the final rewards of the agent
+        self.assertTrue(records['action_mask'][np.arange(len(records)), records['action']].all())
+        self.assertTrue(np.isin(records['outcome'], [-1.0, 0.0, 1.0]).all())
+        self.assertEqual(set(records['episode'].tolist()), {0, 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# tests/test_environment.py
+
+import unittest
+import numpy as np
+import environment
+
+class TestFirefightEnv(unittest.TestCase):
+
+    def play_random_episode(self, env, seed):
+        rng = np.random.default_rng(seed)
+        observation, info = env.reset(seed=seed)
+        steps, done, reward = 0, env.done, 0.0
+        while not done:
+            action = rng.choice(np.flatnonzero(info['action_mask']))
+            observation, reward, done, truncated, info = env.step(action)
+            steps += 1
+        return observation, reward, steps
+
+    def test_episode_terminates_with_reward(self):
+        env = environment.FirefightEnv(seed=0)
+        observation, reward, steps = self.play_random_episode(env, 3)
+        self.assertGreater(steps, 0)
+        self.assertIn(reward, (-1.0, 0.0, 1.0))
+        self.assertEqual(observation.shape, (len(environment.PLANES), 12, 12))
+
+    def test_observation_is_updated_in_place(self):
+        env = environment.FirefightEnv(seed=0)
+        observation, info = env.reset(seed=1)
+        self.assertEqual(info['request'], 'unit')
+        action = int(np.flatnonzero(info['action_mask'])[0])
+        next_observation, _, _, _, info = env.step(action)
+        self.assertIs(next_observation, observation)
+        self.assertEqual(info['request'], 'option')
+
+    def test_planes_match_board(self):
+        env = environment.FirefightEnv(seed=0)
+        rng = np.random.default_rng(0)
+        observation, info = env.reset(seed=5)
+        for _ in range(30):
+            if env.done:
+                break
+            observation, _, _, _, info = env.step(rng.choice(np.flatnonzero(info['action_mask'])))
+            board = env.game.board
+            np.testing.assert_array_equal(env.planes['occupied'], board.occupancy >= 0)
+            own = np.zeros(board.size)
+            for unit in env.game.rules.units(env.agent_player):
+                own[tuple(unit.position)] = 1
+                self.assertEqual(env.planes['wounds'][tuple(unit.position)], unit.wounds)
+            np.testing.assert_array_equal(env.planes['own_unit'], own)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# tests/test_hash.py
+
+import unittest
+import engine
+import agents
+import onepagerules as opr
+import selfplay
+
+class TestZobristHash(unittest.TestCase):
+
+    def test_incremental_hash_matches_rehash(self):
+        game = selfplay.setup_game(5)
+        board = game.board
+        self.assertEqual(board.hash, board.rehash())
+        hashes = []
+
+        class Recorder(engine.DecisionProvider):
+            def choose(self, kind, options, game):
+                hashes.append((game.board.hash, game.board.rehash()))
+                return random.choose(kind, options, game)
+        random = agents.RandomDecisionProvider(5)
+        game.api.providers = {1: Recorder(), 2: Recorder()}
+        game.run_headless()
+        self.assertGreater(len(hashes), 10)
+        for incremental, full in hashes:
+            self.assertEqual(incremental, full)
+        self.assertEqual(board.hash, board.rehash())
+
+    def test_hash_follows_moves_and_flags(self):
+        game = selfplay.setup_game(1)
+        unit = game.rules.units(1)[0]
+        start = game.board.hash
+        position = unit.position
+        unit.place((5, 5))
+        self.assertNotEqual(game.board.hash, start)
+        unit.place(position)
+        self.assertEqual(game.board.hash, start)
+
+        unit.activated = True
+        activated = game.board.hash
+        self.assertNotEqual(activated, start)
+        unit.activated = False
+        self.assertEqual(game.board.hash, start)
+
+        game.active_player = 2
+        game.rules.game_turn = 1
+        self.assertNotEqual(game.board.hash, start)
+        self.assertEqual(game.board.hash, game.board.rehash())
+
+    def test_hash_is_restored_with_snapshots(self):
+        game = selfplay.setup_game(3)
+        game.rules.determine_initiative()
+        snapshot = game.snapshot()
+        before = game.board.hash
+        game.run_headless()
+        self.assertNotEqual(game.board.hash, before)
+        game.restore(snapshot)
+        self.assertEqual(game.board.hash, before)
+
+    def test_same_position_same_hash_across_games(self):
+        first, second = selfplay.setup_game(0), selfplay.setup_game(1)
+        self.assertEqual(first.board.hash, second.board.hash)
+        first.rules.units(2)[0].take_wounds(1)
+        self.assertNotEqual(first.board.hash, second.board.hash)
+
+    def test_units_created_before_the_board(self):
+        game = engine.Game()
+        unit = opr.OPRUnit(game, 'Soldier', player=1)
+        unit.activated = True
+        board = engine.Board([8, 8], game)
+        opr.OPR_Firefight(game)
+        self.assertEqual(board.hash, board.rehash())
+        unit.activated = False
+        self.assertEqual(board.hash, board.rehash())
+
+
+if __name__ == '__main__':
+    unittest.main()
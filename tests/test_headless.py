@@ -0,0 +1,50 @@
+# tests/test_headless.py
+
+import unittest
+import engine
+import agents
+import onepagerules as opr
+
+def build_game(seed, provider):
+    game = engine.Game(seed=seed)
+    engine.Board([8, 8], game)
+    rules = opr.OPR_Firefight(game)
+    engine.HeadlessAPI(game, rules, provider)
+    for i, (player, position) in enumerate([(1, [5, 3]), (2, [2, 3]), (1, [6, 6]), (2, [1, 1])]):
+        unit = opr.OPRUnit(game, f'Unit {i}', player=player, position=position)
+        unit.quality, unit.defense = 4, 4
+        unit.add_weapon(opr.OPRWeapon('Rifle', range=12, attacks=1, damage=1))
+    return game
+
+class TestHeadlessGame(unittest.TestCase):
+
+    def test_full_game_runs_to_the_end(self):
+        game = build_game(1, agents.RandomDecisionProvider(1))
+        game.run_headless()
+        self.assertLessEqual(game.rules.game_turn, 4)
+        self.assertTrue(game.rules.check_game_over())
+        self.assertTrue(game.rules.all_units_activated())
+        self.assertGreater(game.api.decisions, 16)
+
+    def test_seeded_games_are_reproducible(self):
+        positions = []
+        for _ in range(2):
+            game = build_game(7, agents.RandomDecisionProvider(7))
+            game.run_headless()
+            positions.append([(unit.name, tuple(unit.position), unit.wounds) for unit in game.rules.units()])
+        self.assertEqual(positions[0], positions[1])
+
+    def test_providers_per_player(self):
+        scripted = agents.ScriptedDecisionProvider([], fallback=agents.RandomDecisionProvider(0))
+        game = build_game(3, {1: scripted, 2: agents.RandomDecisionProvider(1)})
+        game.run_headless()
+        self.assertTrue(game.rules.check_game_over())
+
+    def test_exhausted_script_raises(self):
+        game = build_game(3, agents.ScriptedDecisionProvider([]))
+        with self.assertRaises(RuntimeError):
+            game.run_headless()
+
+
+if __name__ == '__main__':
+    unittest.main()
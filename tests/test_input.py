@@ -0,0 +1,73 @@
+# tests/test_input.py
+
+import asyncio
+import unittest
+import engine
+import onepagerules as opr
+
+class TestInputHandoff(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game()
+        self.opr_rules = opr.OPR_Firefight(self.game)
+        self.board = engine.Board(size=(10, 10), game=self.game)
+        self.api = engine.API(self.game, self.opr_rules)
+
+    def test_selection_wakes_rules_immediately(self):
+        async def scenario():
+            request = asyncio.create_task(self.opr_rules.get_option_selection(['Hold', 'Rush']))
+            await asyncio.sleep(0)
+            self.assertEqual(self.api.state, 'wait_for_option_sel')
+            pending = self.api.pending
+            self.api.selection_done('Rush')
+            # The selection resolves the future right away, and the rules resume within a few loop iterations
+            self.assertTrue(pending.done())
+            self.assertEqual(pending.result(), 'Rush')
+            iterations = 0
+            while not request.done():
+                await asyncio.sleep(0)
+                iterations += 1
+            return iterations
+
+        iterations = asyncio.run(scenario())
+        self.assertLessEqual(iterations, 2)
+        self.assertEqual(self.api.selection, 'Rush')
+        self.assertEqual(self.api.state, 'game_running')
+
+    def test_invalid_selection_is_requested_again(self):
+        async def scenario():
+            request = asyncio.create_task(self.opr_rules.get_tile_selection([(1, 1), (2, 2)]))
+            await asyncio.sleep(0)
+            self.api.selection_done((5, 5))
+            await asyncio.sleep(0)
+            self.assertFalse(request.done())
+            self.assertEqual(self.api.state, 'wait_for_tile_sel')
+            self.api.selection_done((2, 2))
+            await request
+
+        asyncio.run(scenario())
+        self.assertEqual(self.api.selection, (2, 2))
+
+    def test_timeout_withdraws_request(self):
+        async def scenario():
+            await self.opr_rules.wait_for_input(['Hold'], 'option', timeout=0.01)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(scenario())
+        self.assertEqual(self.api.state, 'game_running')
+        self.assertIsNone(self.api.pending)
+
+    def test_cancel_selection(self):
+        async def scenario():
+            request = asyncio.create_task(self.opr_rules.get_option_selection(['Hold']))
+            await asyncio.sleep(0)
+            self.api.cancel_selection()
+            await request
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(scenario())
+        self.assertEqual(self.api.state, 'game_running')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# tests/test_mcts.py
+
+import unittest
+import agents
+import selfplay
+
+class TestMCTS(unittest.TestCase):
+
+    def test_game_against_random_finishes(self):
+        searcher = agents.MCTSDecisionProvider(seed=0, iterations=10, time_budget=None)
+        game = selfplay.setup_game(0, providers={1: searcher, 2: agents.RandomDecisionProvider(0)})
+        game.run_headless()
+        self.assertTrue(game.rules.check_game_over())
+        self.assertGreater(searcher.simulations, 0)
+        self.assertGreater(len(searcher.table), 0)
+
+    def test_search_restores_the_game(self):
+        test = self
+        class CheckedSearch(agents.MCTSDecisionProvider):
+            def search(self, game):
+                api, before = game.api, game.snapshot()
+                roots = super().search(game)
+                test.assertEqual(before.key(), game.snapshot().key())
+                test.assertEqual(before.random_state, game.snapshot().random_state)
+                test.assertIs(game.api, api)
+                test.assertIs(game.rules.api, api)
+                test.assertGreaterEqual(sum(stats[0] for stats in roots[0].stats.values()), 20)
+                self.searches += 1
+                return roots
+
+        searcher = CheckedSearch(seed=2, iterations=20, time_budget=None)
+        searcher.searches = 0
+        game = selfplay.setup_game(2, providers={1: searcher, 2: agents.RandomDecisionProvider(2)})
+        game.run_headless()
+        self.assertGreater(searcher.searches, 0)
+
+    def test_transposition_table_is_bounded(self):
+        searcher = agents.MCTSDecisionProvider(seed=1, iterations=10, time_budget=None, max_table_size=5)
+        game = selfplay.setup_game(1, providers={1: searcher, 2: searcher})
+        game.run_headless()
+        self.assertLessEqual(len(searcher.table), 5)
+
+    def test_table_evicts_least_recently_used(self):
+        searcher = agents.MCTSDecisionProvider(seed=0, iterations=1, time_budget=None, max_table_size=2)
+        game = selfplay.setup_game(0)
+        first = searcher.node_for_state(game, 1)
+        searcher.node_for_state(game, 2)
+        self.assertIs(searcher.node_for_state(game, 1), first)
+        searcher.node_for_state(game, 3)
+        self.assertEqual(list(searcher.table), [1, 3])
+        self.assertIs(searcher.table[1], first)
+
+    def test_stronger_than_random(self):
+        # Seeded, so the score is reproducible. Draws count half
+        n_games, score = 20, 0.0
+        for seed in range(n_games):
+            side = 1 + seed % 2
+            providers = {side: agents.MCTSDecisionProvider(seed=seed, iterations=50, time_budget=None),
+                         3 - side: agents.RandomDecisionProvider(seed)}
+            game = selfplay.setup_game(seed, providers=providers)
+            game.run_headless()
+            winner = game.rules.determine_winner()
+            score += 1.0 if winner == side else 0.5 if winner is None else 0.0
+        low, _ = selfplay.wilson_interval(score, n_games)
+        self.assertGreater(low, 0.5)
+
+    def test_registered_agent(self):
+        self.assertIsInstance(selfplay.AGENTS['mcts'](0), agents.MCTSDecisionProvider)
+
+
+if __name__ == '__main__':
+    unittest.main()
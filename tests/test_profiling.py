@@ -0,0 +1,72 @@
+# tests/test_profiling.py
+
+import json
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import tempfile
+import unittest
+import engine
+import gameUI
+import onepagerules as opr
+import profiling
+import selfplay
+
+class TestProfiling(unittest.TestCase):
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_disabled_profiler_leaves_the_functions_untouched(self):
+        originals = [engine.Board.__dict__['in_range'], opr.OPR_Firefight.__dict__['game_sequence'], gameUI.UI.__dict__['present']]
+        profiling.enable()
+        self.assertIsNot(engine.Board.__dict__['in_range'], originals[0])
+        profiling.disable()
+        self.assertEqual([engine.Board.__dict__['in_range'], opr.OPR_Firefight.__dict__['game_sequence'],
+                          gameUI.UI.__dict__['present']], originals)
+        self.assertIsNone(profiling.profiler)
+
+    def test_headless_game_phases(self):
+        with profiling.profiled(trace=True) as profiler:
+            game = selfplay.setup_game(3)
+            game.run_headless()
+        self.assertEqual(profiler.calls['rules.game_sequence'], 1)
+        self.assertEqual(profiler.calls['rules.unit_turn'], game.rules.activations)
+        self.assertEqual(sum(profiler.decision_latency), profiler.calls['rules.wait_for_input'])
+        # The queries of the rules are measured where they are made
+        for phase in ('board.reachable_positions', 'board.movement_costs', 'board.occupy', 'index.units_within', 'visibility.check'):
+            self.assertGreater(profiler.calls.get(phase, 0), 0, phase)
+        # The game sequence includes all unit turns
+        self.assertGreaterEqual(profiler.total_ns['rules.game_sequence'], profiler.total_ns['rules.unit_turn'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler.to_chrome_trace(os.path.join(directory, 'trace.json'))
+            profiler.to_json(os.path.join(directory, 'profile.json'))
+            with open(os.path.join(directory, 'trace.json')) as file:
+                events = json.load(file)['traceEvents']
+            with open(os.path.join(directory, 'profile.json')) as file:
+                summary = json.load(file)
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(len(spans), sum(profiler.calls.values()))
+        self.assertEqual(summary['phases']['rules.unit_turn']['calls'], game.rules.activations)
+
+    def test_ui_frame_breakdown(self):
+        game = engine.Game()
+        board = engine.Board(size=(8, 8), game=game)
+        rules = opr.OPR_Firefight(game)
+        api = engine.API(game, rules)
+        opr.OPRUnit(game, 'Soldier', player=1, position=(2, 2))
+        ui = gameUI.UI(board, api)
+        self.addCleanup(ui.close)
+        with profiling.profiled() as profiler:
+            ui.render_frame()
+            ui.render_frame()
+        self.assertEqual(len(profiler.frames), 2)
+        frame = profiler.frames[0]
+        for phase in ('ui.show_pieces', 'ui.draw_game_info', 'ui.present'):
+            self.assertIn(phase, frame)
+        self.assertGreaterEqual(frame['total'], sum(ms for name, ms in frame.items() if name != 'total'))
+        self.assertEqual(profiler.summary()['frames']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
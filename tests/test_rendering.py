@@ -0,0 +1,265 @@
+# tests/test_rendering.py
+
+import asyncio
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import unittest
+from unittest import mock
+import engine
+import gameUI
+import onepagerules as opr
+
+class TestRetainedRendering(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game()
+        self.board = engine.Board(size=(8, 8), game=self.game)
+        self.rules = opr.OPR_Firefight(self.game)
+        self.api = engine.API(self.game, self.rules)
+        self.unit = opr.OPRUnit(self.game, 'Soldier', player=1, position=(2, 2))
+        self.ui = gameUI.UI(self.board, self.api)
+        self.addCleanup(self.ui.close)
+
+    def frame(self):
+        self.ui.show_pieces()
+        self.ui.draw_game_info()
+        self.ui.draw_option_buttons()
+        return self.ui.present()
+
+    def test_unchanged_frames_redraw_nothing(self):
+        self.assertEqual(self.frame(), [self.ui.screen.get_rect()])
+        self.assertEqual(self.frame(), [])
+        self.assertEqual(self.frame(), [])
+
+    def test_moving_a_unit_redraws_its_squares_only(self):
+        self.frame()
+        self.unit.place((5, 6))
+        dirty = self.frame()
+        square = (self.ui.square_width, self.ui.square_height)
+        self.assertCountEqual([tuple(rect) for rect in dirty],
+                              [(2 * square[0], 2 * square[1], *square), (6 * square[0], 5 * square[1], *square)])
+        # Left of the letter, inside the token
+        def token_pixel(row, col):
+            rect = self.ui.cell_rect(row, col)
+            return self.ui.screen.get_at((rect.centerx - rect.width // 4, rect.centery))[:3]
+        self.assertEqual(token_pixel(5, 6), gameUI.DARKGREEN)
+        self.assertNotEqual(token_pixel(2, 2), gameUI.DARKGREEN)
+
+    def test_surfaces_are_cached(self):
+        self.frame()
+        sprites, texts = dict(self.ui.sprite_cache), dict(self.ui.text_cache)
+        self.frame()
+        self.assertEqual(self.ui.sprite_cache, sprites)
+        self.assertEqual(self.ui.text_cache, texts)
+        self.assertIs(self.ui.render_text('Turn: 0'), self.ui.render_text('Turn: 0'))
+
+    def test_close_detaches_from_the_board(self):
+        self.assertIn(self.ui, self.board.listeners)
+        self.ui.close()
+        self.assertNotIn(self.ui, self.board.listeners)
+        self.unit.place((5, 6))
+
+    def test_option_overlay_is_reused(self):
+        options = [(3, 3), (3, 4), (4, 4)]
+        self.ui.highlight_options(options, gameUI.BLUE, pixel_inwards=5)
+        overlay = self.ui.scene[-1][0]
+        self.ui.present()
+        self.ui.highlight_options(options, gameUI.BLUE, pixel_inwards=5)
+        self.assertIs(self.ui.scene[-1][0], overlay)
+        self.assertEqual(self.ui.present(), [])
+
+
+class TestCamera(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game()
+        self.board = engine.Board(size=(500, 500), game=self.game)
+        self.rules = opr.OPR_Firefight(self.game)
+        self.api = engine.API(self.game, self.rules)
+        for i in range(0, 500, 10):
+            opr.OPRUnit(self.game, f'Unit {i}', player=1, position=(i, i))
+        self.ui = gameUI.UI(self.board, self.api)
+        self.addCleanup(self.ui.close)
+
+    def test_hit_testing_is_arithmetic(self):
+        size = self.ui.square_width
+        self.assertEqual(self.ui.cell_at((0, 0)), (0, 0))
+        self.assertEqual(self.ui.cell_at((3 * size + 1, 2 * size + 1)), (2, 3))
+        self.assertIsNone(self.ui.cell_at((self.ui.board_width + 5, 10)))
+        self.ui.pan(100 * size, 50 * size)
+        self.assertEqual(self.ui.cell_at((1, 1)), (50, 100))
+        self.assertEqual(self.ui.cell_rect(50, 100).topleft, (0, 0))
+
+    def test_only_visible_squares_are_drawn(self):
+        r0, r1, c0, c1 = self.ui.visible_window()
+        self.assertLessEqual((r1 - r0) * self.ui.square_height, self.ui.board_height + self.ui.square_height)
+        self.ui.show_pieces()
+        drawn = len(self.ui.scene)
+        self.assertEqual(drawn, len([i for i in range(0, 500, 10) if r0 <= i < r1]))
+        self.assertLess(self.ui.board_image.get_width(), 2 * self.ui.board_width)
+        self.ui.present()
+
+        # Far away units come into view after panning
+        self.ui.pan(400 * self.ui.square_width, 400 * self.ui.square_height)
+        self.ui.show_pieces()
+        self.assertTrue(all(self.ui.viewport.colliderect(rect) for _, rect, _ in self.ui.scene))
+        self.assertGreater(len(self.ui.scene), 0)
+        self.ui.present()
+
+    def test_view_is_clamped_to_the_board(self):
+        self.ui.pan(-1000, -1000)
+        self.assertEqual(self.ui.view_offset, [0, 0])
+        self.ui.pan(10**7, 10**7)
+        self.assertEqual(self.ui.cell_at((self.ui.board_width - 1, self.ui.board_height - 1)), (499, 499))
+
+    def test_zoom_keeps_the_point_under_the_cursor(self):
+        self.ui.pan(1000, 1000)
+        position = (200, 300)
+        before = self.ui.cell_at(position)
+        self.ui.zoom_at(position, 2)
+        self.assertEqual(self.ui.cell_at(position), before)
+        self.assertGreater(self.ui.square_width, self.ui.min_square_size)
+
+
+class TestBoardSurfaceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game()
+        self.board = engine.Board(size=(8, 8), game=self.game)
+        self.rules = opr.OPR_Firefight(self.game)
+        self.api = engine.API(self.game, self.rules)
+        self.ui = gameUI.UI(self.board, self.api)
+        self.addCleanup(self.ui.close)
+
+    def test_board_images_are_cached_in_memory(self):
+        cache = gameUI.BoardSurfaceCache(max_entries=4)
+        image = cache.board_image(self.board, (50, 50))
+        self.assertIs(cache.board_image(self.board, (50, 50)), image)
+        self.assertEqual(image.get_size(), (400, 400))
+        self.assertEqual(image.get_at((25, 25))[:3], gameUI.THEMES['default']['board'])
+        self.assertEqual(image.get_at((0, 25))[:3], gameUI.THEMES['default']['grid'])
+
+        self.board.set_terrain((slice(0, 1), slice(0, 1)), 2)
+        changed = cache.board_image(self.board, (50, 50))
+        self.assertIsNot(changed, image)
+        self.assertEqual(changed.get_at((25, 25))[:3], gameUI.THEMES['default']['impassable'])
+
+        for size in range(10, 20):
+            cache.board_image(self.board, (size, size))
+        self.assertLessEqual(len(cache.entries), 4)
+
+    def test_resizes_are_debounced(self):
+        rendered = []
+        original = self.ui.render_board_image
+        self.ui.render_board_image = lambda: rendered.append(1) or original()
+        for height in range(500, 560, 10):
+            self.ui.handle_resize(gameUI.pygame.event.Event(gameUI.pygame.VIDEORESIZE, size=(700, height)))
+            self.assertFalse(self.ui.apply_pending_resize())
+        self.assertEqual(rendered, [])
+        self.ui.pending_resize = (self.ui.pending_resize[0], 0)
+        self.assertTrue(self.ui.apply_pending_resize())
+        self.assertEqual(rendered, [1])
+        self.assertEqual((self.ui.screen_width, self.ui.screen_height), (700, 550))
+        self.assertEqual(self.ui.square_height, 550 // 8)
+        self.assertEqual(self.ui.cell_at((3 * (550 // 8) + 1, 1)), (0, 3))
+
+    def test_terrain_changes_update_the_board_image(self):
+        image = self.ui.board_image
+        self.board.set_terrain((slice(2, 3), slice(2, 3)), 0.5)
+        self.assertIsNot(self.ui.board_image, image)
+
+
+class FakeClock:
+    """
+    Time that only passes while the scheduler sleeps, or when a test advances it.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        self.sleeps.append(delay)
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+class TestFrameScheduler(unittest.TestCase):
+    # A power of two, so that the frame times are exact
+    FPS = 64
+
+    def setUp(self):
+        self.game = engine.Game()
+        self.board = engine.Board(size=(8, 8), game=self.game)
+        self.rules = opr.OPR_Firefight(self.game)
+        self.api = engine.API(self.game, self.rules)
+        self.unit = opr.OPRUnit(self.game, 'Soldier', player=1, position=(2, 2))
+        self.clock = FakeClock()
+        self.ui = gameUI.UI(self.board, self.api, fps=self.FPS)
+        self.addCleanup(self.ui.close)
+        self.ui.scheduler = gameUI.FrameScheduler(self.FPS, clock=self.clock, sleep=self.clock.sleep)
+        self.rendered = 0
+        render_frame = self.ui.render_frame
+        def counting_render():
+            self.rendered += 1
+            render_frame()
+        self.ui.render_frame = counting_render
+
+    def run_ui(self, frames: int, game_task=None):
+        async def stop_after_frames():
+            while self.ui.scheduler.frames < frames:
+                await asyncio.sleep(0)
+            self.ui.running = False
+        async def main():
+            tasks = [self.ui.run(), stop_after_frames()] + ([game_task] if game_task else [])
+            await asyncio.gather(*tasks)
+        # UI.run quits pygame when it ends, which would invalidate the fonts of the other tests
+        with mock.patch.object(gameUI.pygame, 'quit'):
+            asyncio.run(main())
+
+    def test_idle_ui_renders_no_frames(self):
+        self.run_ui(15)
+        scheduler = self.ui.scheduler
+        self.assertEqual((scheduler.frames, self.rendered, scheduler.idle, scheduler.dropped), (15, 1, 14, 0))
+        self.assertEqual(self.clock.sleeps, [1 / self.FPS] * 15)
+        # The UI detaches from the board when its loop ends
+        self.assertNotIn(self.ui, self.board.listeners)
+
+    def test_game_changes_are_rendered(self):
+        async def move():
+            while self.ui.scheduler.frames < 5:
+                await asyncio.sleep(0)
+            self.unit.place((5, 6))
+        self.run_ui(10, move())
+        self.assertEqual((self.rendered, self.ui.scheduler.idle), (2, 8))
+
+    def test_game_task_is_not_stalled(self):
+        steps = 0
+        async def busy_game():
+            nonlocal steps
+            while self.ui.running is not False:
+                steps += 1
+                await asyncio.sleep(0)
+        self.ui.running = None
+        self.run_ui(20, busy_game())
+        # The game task runs while the UI waits for each frame, until the UI stops after the last one
+        self.assertEqual(self.ui.scheduler.frames, 20)
+        self.assertEqual(steps, 19)
+
+    def test_late_frames_are_dropped(self):
+        clock = FakeClock()
+        scheduler = gameUI.FrameScheduler(fps=self.FPS, clock=clock, sleep=clock.sleep)
+        async def frames():
+            await scheduler.wait_for_next_frame()
+            clock.now += 5.5 / self.FPS # The game task hogs the loop
+            await scheduler.wait_for_next_frame()
+        asyncio.run(frames())
+        self.assertEqual((scheduler.frames, scheduler.dropped), (2, 5))
+        # No burst of catch-up frames, the next one is a full frame away
+        self.assertEqual(clock.sleeps, [1 / self.FPS, 1 / self.FPS])
+
+
+if __name__ == '__main__':
+    unittest.main()
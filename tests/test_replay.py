@@ -0,0 +1,84 @@
+# tests/test_replay.py
+
+import io
+import os
+import tempfile
+import unittest
+import engine
+import replay
+import selfplay
+
+def state_of(game):
+    return [(unit.roster_index, tuple(unit.position) if unit.position is not None else None, unit.wounds)
+            for unit in game.roster]
+
+class TestReplay(unittest.TestCase):
+
+    def record_game(self, seed, agents=('random', 'random')):
+        providers = {player: selfplay.AGENTS[agent](seed * 2 + player) for player, agent in zip((1, 2), agents)}
+        game = selfplay.setup_game(seed, providers=providers)
+        log = io.BytesIO()
+        writer = replay.ReplayWriter(log, {'seed': seed, 'armies': ['skirmish', 'skirmish'], 'board_size': [12, 12]})
+        writer.attach(game)
+        game.run_headless()
+        return game, writer, log.getvalue()
+
+    def test_varints_round_trip(self):
+        for value in (0, 1, 127, 128, 300, 2**40):
+            out = bytearray()
+            replay.encode_varint(value, out)
+            self.assertEqual(replay.decode_varint(bytes(out), 0), (value, len(out)))
+
+    def test_replay_reproduces_the_game(self):
+        game, writer, log = self.record_game(5)
+        self.assertEqual(writer.records, game.api.decisions)
+        # Option strings are stored once, so most records take two or three bytes
+        self.assertLess(len(log), 200 + 3 * writer.records)
+
+        replayer = replay.Replayer(log)
+        replayed = replayer.run()
+        self.assertTrue(replayer.finished)
+        self.assertEqual(replayer.steps, len(replayer))
+        self.assertEqual(state_of(replayed), state_of(game))
+        self.assertEqual(replayed.board.hash, game.board.hash)
+        self.assertEqual(replayed.rules.determine_winner(), game.rules.determine_winner())
+
+    def test_stop_at_step(self):
+        game, writer, log = self.record_game(6)
+        replayer = replay.Replayer(log)
+        stopped = replayer.run(stop_at=10)
+        self.assertFalse(replayer.finished)
+        self.assertEqual(replayer.steps, 10)
+        self.assertTrue(stopped.api.current_options)
+
+        # Replaying the first steps with the recorded selections leads to the same state
+        _, records = replay.read_log(log)
+        scripted = selfplay.setup_game(6)
+        script = [scripted.roster[value] if tag == replay.UNIT else value for tag, value in records[:10]]
+        provider = replay.ReplayDecisionProvider(script)
+        engine.HeadlessAPI(scripted, scripted.rules, provider)
+        with self.assertRaises(replay.StopReplay):
+            scripted.run_headless()
+        self.assertEqual(state_of(scripted), state_of(stopped))
+
+    def test_truncated_log_replays_up_to_the_last_record(self):
+        _, writer, log = self.record_game(7)
+        replayer = replay.Replayer(log[:-1])
+        self.assertEqual(len(replayer), writer.records - 1)
+        replayer.run()
+        self.assertFalse(replayer.finished)
+        self.assertEqual(replayer.steps, writer.records - 1)
+
+    def test_selfplay_writes_replay_logs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = list(selfplay.run_selfplay(2, seed=3, workers=1, replay_dir=directory))
+            for result in results:
+                replayer = replay.Replayer(os.path.join(directory, f'game_{result["seed"]}.twrl'))
+                game = replayer.run()
+                self.assertTrue(replayer.finished)
+                self.assertEqual(selfplay.game_result(game)['winner'], result['winner'])
+                self.assertEqual(replayer.steps, result['decisions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
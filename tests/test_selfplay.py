@@ -0,0 +1,33 @@
+# tests/test_selfplay.py
+
+import unittest
+import selfplay
+
+class TestSelfPlay(unittest.TestCase):
+
+    def test_results_do_not_depend_on_workers(self):
+        serial = list(selfplay.run_selfplay(4, seed=10, workers=1))
+        parallel = list(selfplay.run_selfplay(4, seed=10, workers=2))
+        strip = lambda results: sorted((r['seed'], r['winner'], r['decisions']) for r in results)
+        self.assertEqual(strip(serial), strip(parallel))
+        self.assertTrue(all(1 <= r['turns'] <= 4 for r in serial))
+
+    def test_summary(self):
+        results = [{'winner': 1, 'turns': 4, 'activations': 8, 'casualties': {1: 0, 2: 2}},
+                   {'winner': None, 'turns': 4, 'activations': 8, 'casualties': {1: 1, 2: 1}}]
+        summary = selfplay.summarize(results)
+        self.assertEqual(summary['players'][1]['wins'], 1)
+        self.assertEqual(summary['draws'], 1)
+        self.assertEqual(summary['players'][2]['mean_casualties'], 1.5)
+        low, high = summary['players'][1]['win_rate_ci']
+        self.assertLess(low, 0.5)
+        self.assertGreater(high, 0.5)
+
+    def test_wilson_interval_narrows(self):
+        wide = selfplay.wilson_interval(5, 10)
+        narrow = selfplay.wilson_interval(500, 1000)
+        self.assertGreater(wide[1] - wide[0], narrow[1] - narrow[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
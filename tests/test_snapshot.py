@@ -0,0 +1,62 @@
+# tests/test_snapshot.py
+
+import pickle
+import unittest
+import numpy as np
+import selfplay
+
+def describe(game):
+    units = [(unit.roster_index, tuple(unit.position) if unit.position is not None else None,
+              unit.activated, unit.wounds) for unit in game.roster]
+    return (units, sorted(game.board.pieces), sorted(game.dead_units), game.active_player,
+            game.rules.game_turn, game.rules.activations, (game.board.occupancy >= 0).tobytes())
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_restore_after_a_game(self):
+        game = selfplay.setup_game(4)
+        game.rules.determine_initiative()
+        snapshot = game.snapshot()
+        before = describe(game)
+        game.run_headless()
+        self.assertNotEqual(describe(game), before)
+
+        game.restore(snapshot)
+        self.assertEqual(describe(game), before)
+        for unit in game.board.pieces.values():
+            self.assertIs(game.board.piece_at(unit.position), unit)
+
+    def test_restored_game_replays_identically(self):
+        game = selfplay.setup_game(9)
+        game.rules.determine_initiative()
+        snapshot = game.snapshot()
+        game.api.providers = {player: selfplay.agents.RandomDecisionProvider(player) for player in (1, 2)}
+        game.run_headless()
+        first = describe(game)
+
+        game.restore(snapshot)
+        game.api.providers = {player: selfplay.agents.RandomDecisionProvider(player) for player in (1, 2)}
+        game.run_headless()
+        self.assertEqual(describe(game), first)
+
+    def test_restore_into_another_game(self):
+        game = selfplay.setup_game(2)
+        game.run_headless()
+        snapshot = pickle.loads(pickle.dumps(game.snapshot()))
+
+        other = selfplay.setup_game(2)
+        other.restore(snapshot)
+        self.assertEqual(describe(other)[3:], describe(game)[3:])
+        np.testing.assert_array_equal(other.board.occupancy >= 0, game.board.occupancy >= 0)
+
+    def test_snapshot_key(self):
+        game = selfplay.setup_game(1)
+        key = game.snapshot().key()
+        self.assertEqual(hash(key), hash(game.snapshot(include_random=False).key()))
+        unit = game.rules.units(1)[0]
+        unit.place((5, 5))
+        self.assertNotEqual(game.snapshot().key(), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# tests/test_spatial_index.py
+
+import unittest
+import numpy as np
+import engine
+import onepagerules as opr
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game(seed=0)
+        opr.OPR_Firefight(self.game)
+        self.board = engine.Board(size=(200, 200), game=self.game)
+        self.index = self.board.unit_index
+        rng = np.random.default_rng(0)
+        self.units = []
+        for i, position in enumerate({tuple(p) for p in rng.integers(0, 200, size=(300, 2)).tolist()}):
+            self.units.append(opr.OPRUnit(self.game, f'Unit {i}', player=i % 2 + 1, position=position))
+        tank = opr.OPRUnit(self.game, 'Tank', player=1)
+        tank.extent = [3, 3]
+        for x in range(50, 200):
+            if not self.board.is_occupied((x, 100), tank.extent):
+                tank.place((x, 100))
+                break
+        self.units.append(tank)
+
+    def brute_force(self, origin, range, players=None):
+        return [unit for unit in sorted(self.units, key=lambda unit: unit.roster_index)
+                if unit.position is not None and (players is None or unit.player in players)
+                and self.index.distance(origin, unit) <= range]
+
+    def test_units_within_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        for origin in rng.integers(0, 200, size=(50, 2)).tolist():
+            for range, players in ((5, None), (12, [1]), (30, [2])):
+                self.assertEqual(self.index.units_within(origin, range, players), self.brute_force(origin, range, players))
+
+    def test_units_within_matches_board_scan(self):
+        origin, range = (100, 100), 10
+        tiles = self.board.in_range(origin, range, 'Unit', players=[2])
+        scanned = {self.board.piece_at(tile) for tile in tiles}
+        self.assertEqual(set(self.index.units_within(origin, range, [2])) - {self.board.piece_at(origin)}, scanned)
+
+    def test_index_follows_moves(self):
+        unit = self.units[0]
+        unit.remove()
+        self.assertNotIn(unit, self.index.units_within((0, 0), 300))
+        for x in range(200):
+            if not self.board.is_occupied((x, 0)):
+                break
+        unit.place((x, 0))
+        self.assertIn(unit, self.index.units_within((x, 0), 0))
+
+    def test_nearest(self):
+        rng = np.random.default_rng(2)
+        for origin in rng.integers(0, 200, size=(50, 2)).tolist():
+            candidates = [unit for unit in self.units if unit.player == 2]
+            expected = min(candidates, key=lambda unit: (self.index.distance(origin, unit), unit.roster_index))
+            unit, distance = self.index.nearest(origin, [2])
+            self.assertIs(unit, expected)
+            self.assertEqual(distance, self.index.distance(origin, expected))
+        unit, _ = self.index.nearest_enemy(self.units[0])
+        self.assertNotEqual(unit.player, self.units[0].player)
+
+    def test_enemy_pairs_within(self):
+        expected = [(a, b) for a in self.units for b in self.units
+                    if a.roster_index < b.roster_index and a.player != b.player
+                    and self.index.gap(self.index.bounds(a), b) <= 6]
+        expected.sort(key=lambda pair: (pair[0].roster_index, pair[1].roster_index))
+        self.assertEqual(self.index.enemy_pairs_within(6), expected)
+        self.assertGreater(len(expected), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# tests/test_sweep.py
+
+import json
+import os
+import tempfile
+import unittest
+import selfplay
+import sweep
+
+class TestRuleParameters(unittest.TestCase):
+
+    def test_rule_parameters_are_applied(self):
+        game = selfplay.setup_game(1, rules={'max_turns': 1, 'movement': 3, 'rush_multiplier': 3})
+        self.assertEqual(game.rules.max_turns, 1)
+        for unit in game.rules.units():
+            self.assertEqual((unit.movement, unit.movement_rush), (3, 9))
+        game.run_headless()
+        self.assertEqual(game.rules.game_turn, 1)
+
+    def test_defaults_keep_the_profiles(self):
+        game = selfplay.setup_game(1, armies=('melee', 'skirmish'), rules={'rush_multiplier': 1.5})
+        self.assertEqual([unit.movement_rush for unit in game.rules.units(1)], [12, 12, 12, 9])
+
+    def test_unknown_parameters_raise(self):
+        with self.assertRaises(ValueError):
+            selfplay.setup_game(1, rules={'charge_range': 3})
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_grid(self):
+        self.assertEqual(sweep.variant_grid({'max_turns': [3, 4], 'movement': [6]}),
+                         [{'max_turns': 3, 'movement': 6}, {'max_turns': 4, 'movement': 6}])
+        self.assertEqual(sweep.variant_grid({}), [{}])
+
+    def test_clear_variants_stop_early(self):
+        test = sweep.VariantTest({}, max_games=1000, batch=20, precision=0.05, confidence=0.95, min_games=20)
+        while not test.done:
+            test.add({'winner': 1 if len(test.results) % 10 else 2, 'turns': 4, 'casualties': {1: 0, 2: 0}, 'activations': 0})
+        self.assertEqual(test.decision, 'player 1')
+        self.assertLess(len(test.results), 100)
+
+    def test_balanced_variants_stop_at_the_precision(self):
+        test = sweep.VariantTest({}, max_games=10000, batch=50, precision=0.1, confidence=0.95, min_games=50)
+        while not test.done:
+            test.add({'winner': (1, 2)[len(test.results) % 2], 'turns': 4, 'casualties': {1: 0, 2: 0}, 'activations': 0})
+        self.assertEqual(test.decision, 'balanced')
+        low, high = test.interval()
+        self.assertLess(high - low, 0.2)
+        self.assertLess(len(test.results), 10000)
+
+    def test_undecided_after_max_games(self):
+        test = sweep.VariantTest({}, max_games=60, batch=50, precision=0.01, confidence=0.95, min_games=10)
+        while not test.done:
+            test.add({'winner': None, 'turns': 4, 'casualties': {1: 0, 2: 0}, 'activations': 0})
+        self.assertEqual((test.decision, len(test.results)), ('undecided', 60))
+
+    def test_results_are_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sweep.json')
+            variants = [{'max_turns': 1}, {'max_turns': 2}]
+            settings = dict(workers=1, max_games=20, batch=10, min_games=10)
+            first = list(sweep.run_sweep(variants, cache=sweep.ResultCache(filename), **settings))
+            self.assertEqual([summary['cached'] for summary in first], [False, False])
+            self.assertTrue(all(10 <= summary['games'] <= 20 for summary in first))
+
+            # Only the new variant is played in a rerun
+            second = list(sweep.run_sweep(variants + [{'max_turns': 3}], cache=sweep.ResultCache(filename), **settings))
+            self.assertEqual([summary['cached'] for summary in second], [True, True, False])
+            self.assertEqual([summary['score'] for summary in second[:2]], [summary['score'] for summary in first])
+
+    def test_parallel_sweep(self):
+        summaries = list(sweep.run_sweep([{'max_turns': 1}, {'movement': 8}], workers=2, max_games=20, batch=10, min_games=10))
+        self.assertEqual(len(summaries), 2)
+        self.assertTrue(all(summary['decision'] is not None for summary in summaries))
+
+    def test_decisions_do_not_depend_on_workers(self):
+        variants = [{'max_turns': 1}, {'movement': 8}, {}]
+        settings = dict(max_games=80, batch=10, min_games=10, precision=0.2)
+        def decisions(workers):
+            return {json.dumps(summary['rules']): (summary['decision'], summary['games'], summary['score'])
+                    for summary in sweep.run_sweep(variants, workers=workers, **settings)}
+        self.assertEqual(decisions(1), decisions(2))
+
+    def test_results_are_added_in_seed_order(self):
+        test = sweep.VariantTest({}, max_games=100, batch=2, precision=0.01, confidence=0.95, min_games=2)
+        results = [{'winner': winner, 'turns': 4, 'casualties': {1: 0, 2: 0}, 'activations': 0} for winner in (1, 2, None)]
+        test.receive(2, results[2])
+        test.receive(1, results[1])
+        self.assertEqual(test.results, [])
+        test.receive(0, results[0])
+        self.assertEqual(test.results, results)
+
+
+if __name__ == '__main__':
+    unittest.main()
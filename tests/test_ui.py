@@ -1,5 +1,7 @@
 # tests/test_ui.py
 
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
 import unittest
 from gameUI import UI
 import engine
@@ -9,10 +11,11 @@ class TestUI(unittest.TestCase):
     
     def setUp(self):
         self.game = engine.Game()
-        self.opr_rules = opr.OPR_Firefight(self.game)
         self.board = engine.Board(size=(10, 10), game=self.game)
-        self.api = engine.GameAPI(self.game, self.opr_rules)
+        self.opr_rules = opr.OPR_Firefight(self.game)
+        self.api = engine.API(self.game, self.opr_rules)
         self.ui = UI(self.board, self.api)
+        self.addCleanup(self.ui.close)
 
     def test_highlight_square(self):
         # Test the highlight_square logic for grid positioning
@@ -32,7 +35,7 @@ class TestUI(unittest.TestCase):
     
     def test_remove_piece(self):
         # Test the remove_piece method
-        piece = opr.OPRUnit(self.game, name="Soldier")
+        piece = opr.OPRUnit(self.game, name="Soldier", player=1)
 
         self.assertIn(piece, self.game.unplaced_pieces.values())
         piece.place((1, 1))
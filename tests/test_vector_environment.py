@@ -0,0 +1,143 @@
+# tests/test_vector_environment.py
+
+import unittest
+import numpy as np
+import onepagerules as opr
+import vector_environment
+
+# Units with a long and a short ranged weapon
+GUNNERS = [{'name': 'Gunner', 'quality': 4, 'defense': 4, 'movement': 6,
+            'weapons': [('Rifle', 24, 1, 1), ('Pistol', 6, 1, 1)]}] * 2
+
+class TestVectorFirefightEnv(unittest.TestCase):
+
+    def setUp(self):
+        self.env = vector_environment.VectorFirefightEnv(64, seed=0)
+
+    def test_state_stays_consistent(self):
+        rng = np.random.default_rng(0)
+        finished = 0
+        for _ in range(100):
+            _, reward, done, info = self.env.step(self.env.sample_actions(rng))
+            self.assertTrue(info['valid'].all())
+            finished += done.sum()
+            occupancy = self.env.occupancy
+            self.assertTrue(((occupancy >= 0).sum(axis=(1, 2)) == self.env.alive.sum(axis=1)).all())
+            boards, units = np.nonzero(self.env.alive)
+            positions = self.env.position[boards, units]
+            np.testing.assert_array_equal(occupancy[boards, positions[:, 0], positions[:, 1]], units)
+            self.assertTrue((self.env.game_turn <= 4).all())
+            np.testing.assert_array_equal(reward[~done], 0)
+        self.assertGreater(finished, 0)
+
+    def test_moves_respect_movement(self):
+        env = self.env
+        unit = env.can_act().argmax(axis=1)
+        origin = env.position[env.envs, unit]
+        enemy = np.where(env.active_player == 1, env.n_units - 1, 0)
+        # Advance 6 squares towards the center row is allowed, 7 squares is not
+        direction = np.where(origin[:, 0] == 0, 1, -1)
+        actions = np.column_stack([unit, np.ones_like(unit), origin[:, 0] + 6 * direction, origin[:, 1], enemy])
+        _, _, _, info = env.step(actions)
+        self.assertTrue(info['valid'].all())
+        np.testing.assert_array_equal(env.position[env.envs, unit, 0], origin[:, 0] + 6 * direction)
+
+        unit = env.can_act().argmax(axis=1)
+        origin = env.position[env.envs, unit]
+        enemy = np.where(env.active_player == 1, env.n_units - 1, 0)
+        direction = np.where(origin[:, 0] == 0, 1, -1)
+        actions = np.column_stack([unit, np.ones_like(unit), origin[:, 0] + 7 * direction, origin[:, 1], enemy])
+        _, _, _, info = env.step(actions)
+        self.assertFalse(info['valid'].any())
+        np.testing.assert_array_equal(env.position[env.envs, unit], origin)
+
+    def test_invalid_actions_leave_the_boards_unchanged(self):
+        env = self.env
+        player = env.active_player.copy()
+        enemy_unit = np.where(player == 1, env.n_units - 1, 0)
+        _, _, _, info = env.step(np.column_stack([enemy_unit, np.zeros((env.n_envs, 3), dtype=int), enemy_unit]))
+        self.assertFalse(info['valid'].any())
+        self.assertFalse(env.activated.any())
+        np.testing.assert_array_equal(env.active_player, player)
+
+    def test_turn_ends_when_all_units_activated(self):
+        env = vector_environment.VectorFirefightEnv(1, seed=0, armies=('melee', 'melee'), board_size=(40, 40))
+        for _ in range(env.n_units):
+            env.step(np.array([[env.can_act().argmax(), 0, 0, 0, 0]]))
+        self.assertEqual(env.game_turn[0], 2)
+        self.assertFalse(env.activated.any())
+
+    def test_every_weapon_has_its_own_target(self):
+        # The armies deploy 5 rows apart, so the pistol only reaches the enemy in the same column
+        env = vector_environment.VectorFirefightEnv(1, armies=(GUNNERS, GUNNERS), board_size=(6, 12), seed=0)
+        self.assertEqual(env.sample_actions().shape, (1, 6))
+        unit = env.can_act().argmax()
+        enemies = np.flatnonzero(env.enemies(np.array([unit]))[0])
+        same_column = env.position[0, enemies, 1] == env.position[0, unit, 1]
+        near, far = enemies[same_column][0], enemies[~same_column][0]
+        _, _, _, info = env.step(np.array([[unit, 0, 0, 0, near, far]]))
+        self.assertFalse(info['valid'][0])
+        _, _, _, info = env.step(np.array([[unit, 0, 0, 0, far, near]]))
+        self.assertTrue(info['valid'][0])
+
+        # Out of the reach of the pistol, its target is ignored
+        env = vector_environment.VectorFirefightEnv(1, armies=(GUNNERS, GUNNERS), seed=0)
+        unit = env.can_act().argmax()
+        enemy = np.flatnonzero(env.enemies(np.array([unit]))[0])[0]
+        _, _, _, info = env.step(np.array([[unit, 0, 0, 0, enemy, unit]]))
+        self.assertTrue(info['valid'][0])
+
+    def test_rule_parameters(self):
+        env = vector_environment.VectorFirefightEnv(2, seed=0, rules={'max_turns': 2, 'movement': 4, 'rush_multiplier': 3})
+        self.assertEqual(env.max_turns, 2)
+        np.testing.assert_array_equal(env.movement, 4)
+        np.testing.assert_array_equal(env.movement_rush, 12)
+
+
+class TestVectorParity(unittest.TestCase):
+    """
+    The legal moves and targets on the vector boards equal those of OPR_Firefight in the same state.
+    """
+    def check_parity(self, env, steps, boards):
+        rng = np.random.default_rng(1)
+        for _ in range(steps):
+            actions = env.sample_actions(rng)
+            for board in boards:
+                game = env.to_game(board)
+                units = [piece for piece in game.roster if isinstance(piece, opr.OPRUnit)]
+                index = actions[board, 0]
+                unit = units[index]
+                self.assertFalse(unit.activated)
+                self.assertEqual(unit.player, game.active_player)
+
+                def vector_options(kind):
+                    options = env.move_options(np.full(env.n_envs, index), np.full(env.n_envs, kind))[board]
+                    return set(zip(*np.nonzero(options)))
+                self.assertEqual(vector_options(1), set(unit.get_fields_in_range('movement')))
+                rush_squares = unit.get_fields_in_range('movement_rush')
+                self.assertEqual(vector_options(2), set(rush_squares))
+                in_reach = game.board.count_in_range(rush_squares, 1.5, 'Unit', players=unit.enemy_players())
+                self.assertEqual(vector_options(3), {square for square, n in zip(rush_squares, in_reach) if n > 0})
+
+                reach = env.shooting_reach(np.full(env.n_envs, index), env.position[:, index])[board]
+                for w, weapon in enumerate(unit.weapons):
+                    expected = set(unit.units_in_sight(unit.position, weapon.range)) if weapon.range > 1 else set()
+                    self.assertEqual({units[u] for u in np.flatnonzero(reach[w])}, expected)
+            _, _, _, info = env.step(actions)
+            self.assertTrue(info['valid'].all())
+
+    def test_parity_with_the_scalar_game(self):
+        self.check_parity(vector_environment.VectorFirefightEnv(4, seed=3), steps=40, boards=range(4))
+
+    def test_parity_with_rule_variants(self):
+        env = vector_environment.VectorFirefightEnv(2, armies=('melee', 'skirmish'), board_size=(10, 14), seed=4,
+                                                    rules={'movement': 3, 'rush_multiplier': 3})
+        self.check_parity(env, steps=30, boards=range(2))
+
+    def test_parity_with_several_weapons(self):
+        env = vector_environment.VectorFirefightEnv(2, armies=(GUNNERS, 'skirmish'), seed=5)
+        self.check_parity(env, steps=30, boards=range(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# tests/test_visibility.py
+
+import unittest
+import numpy as np
+import engine
+import onepagerules as opr
+
+class TestVisibility(unittest.TestCase):
+
+    def setUp(self):
+        self.game = engine.Game(seed=0)
+        self.rules = opr.OPR_Firefight(self.game)
+        self.board = engine.Board(size=(12, 12), game=self.game)
+        self.shooter = opr.OPRUnit(self.game, 'Shooter', player=1, position=(1, 5))
+        self.target = opr.OPRUnit(self.game, 'Target', player=2, position=(9, 5))
+
+    def test_open_board_is_visible(self):
+        self.assertTrue(self.board.visibility.line_of_sight((1, 5), (9, 5)))
+        self.assertEqual(list(self.shooter.units_in_sight((1, 5), 24).items()), [(self.target, False)])
+
+    def test_units_of_height_zero_do_not_block(self):
+        opr.OPRUnit(self.game, 'Bystander', player=1, position=(5, 5))
+        self.assertTrue(self.board.visibility.line_of_sight((1, 5), (9, 5)))
+
+    def test_terrain_blocks_and_grants_cover(self):
+        self.board.set_terrain((slice(5, 6), slice(4, 7)), 3)
+        self.assertFalse(self.board.visibility.line_of_sight((1, 5), (9, 5)))
+        self.assertEqual(self.shooter.units_in_sight((1, 5), 24), {})
+
+        self.board.set_terrain((slice(5, 6), slice(4, 7)), 0)
+        self.board.set_terrain((slice(8, 9), slice(5, 6)), 0.5)
+        visible, cover = self.board.visibility.check((1, 5), [(9, 5)])
+        self.assertTrue(visible[0])
+        self.assertTrue(cover[0])
+
+    def test_tall_pieces_block(self):
+        wall = engine.Piece(self.game, 'Wall', position=(5, 5), height=2)
+        self.assertFalse(self.board.visibility.line_of_sight((1, 5), (9, 5)))
+        wall.remove(kill=False)
+        self.assertTrue(self.board.visibility.line_of_sight((1, 5), (9, 5)))
+
+    def test_cache_is_invalidated_only_along_rays(self):
+        cache = self.board.visibility
+        cache.check((1, 5), [(9, 5), (1, 11)])
+        self.assertEqual(len(cache.entries), 2)
+        engine.Piece(self.game, 'Wall', position=(5, 5), height=2)
+        self.assertNotIn((1, 5, 9, 5), cache.entries)
+        self.assertIn((1, 5, 1, 11), cache.entries)
+
+    def test_cached_results_match_tracing(self):
+        rng = np.random.default_rng(1)
+        self.board.set_terrain(rng.random(self.board.size) < 0.2, 2)
+        self.board.set_terrain(rng.random(self.board.size) < 0.1, 0.5)
+        origins = rng.integers(0, 12, size=(200, 2))
+        targets = rng.integers(0, 12, size=(200, 2))
+        traced = self.board.visibility.trace(origins, targets)[:2]
+        for origin, target, visible, cover in zip(origins, targets, *traced):
+            self.assertEqual(self.board.visibility.check(origin, [target]), ([visible], [cover]))
+
+    def test_cover_improves_defense(self):
+        self.shooter.quality, self.target.defense = 2, 5
+        self.shooter.add_weapon(opr.OPRWeapon('Rifle', range=24, attacks=3000, damage=1))
+        wounds = []
+        self.target.take_wounds = wounds.append
+        self.shooter.attack([(self.shooter.weapons[0], self.target)])
+        self.shooter.attack([(self.shooter.weapons[0], self.target)], in_cover={self.target})
+        # Expected are 1667 wounds in the open and 1250 in cover
+        self.assertGreater(wounds[0], 1500)
+        self.assertLess(wounds[1], 1400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,379 @@
+"""
+Vectorized OPR_Firefight environment, which steps K independent boards with array operations.
+
+The units, their stats and their deployment are taken from a game set up by selfplay.setup_game with the same
+armies, board size and rule parameters, so the boards play the same unit profiles and rule variants as self-play.
+The state of all boards is held as a struct of arrays, with the units in a fixed order:
+occupancy (K, rows, columns), positions (K, units, 2), wounds, alive and activated flags (K, units),
+and the active player and game turn per board. The rule semantics follow OPR_Firefight and OPRUnit:
+
+- A step is one activation. The action of every board is (unit, kind, row, column, target of every weapon),
+  where kind is 0 Hold, 1 Advance, 2 Rush or 3 Charge, (row, column) is the move target, and the targets are
+  the units the weapons shoot at, in the order of the weapons of the unit. A charge attacks the first target,
+  and the targets of weapons a unit does not have are ignored.
+- Moves follow Board.movement_costs: square by square, diagonals costing sqrt(2), around other units and
+  without cutting their corners. Advance moves up to movement, Rush and Charge up to movement_rush.
+  A charge must end within 1.5 of an enemy, and attacks an enemy within 1.5 of that square.
+- Hold and Advance fire every ranged weapon that reaches an enemy at its own target, which must be in its reach.
+  Charge fights with every melee weapon.
+- Actions the game would not accept leave the board unchanged, as the game asks again, and are marked in
+  info['valid']. As in the game, a unit without a square to move to still advances, i.e. shoots,
+  and a unit without an enemy in charge range ends its activation when it charges.
+- Players alternate as in next_player, passing when they have no unit left to activate. A turn ends
+  when all units are activated, and the game ends after max_turns, or at the end of a turn in which
+  a player has no units left.
+
+The boards are those of setup_game: they have no terrain, and every unit takes one square.
+Units of height 0 do not block the line of sight, so every enemy is in sight and none is in cover.
+
+Finished boards are reset automatically. to_game() returns an OPR_Firefight game in the state of a board,
+which is how the tests check the rules against the scalar game.
+"""
+import numpy as np
+
+import combat
+import engine
+import selfplay
+
+
+# Offsets of the squares around a square, i.e. within 1.5
+NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+class VectorFirefightEnv:
+
+    def __init__(self, n_envs: int, armies=('skirmish', 'skirmish'), board_size=(12, 12), seed: int = None,
+                 rules: dict = None):
+        """
+        rules: Values of selfplay.RULE_PARAMETERS that differ from the defaults
+        """
+        self.n_envs = n_envs
+        self.armies = armies
+        self.board_size = tuple(board_size)
+        self.rules = dict(rules or {})
+        self.players = (1, 2)
+        self.rng = np.random.default_rng(seed)
+
+        # Static unit stats, read from a game set up with the same armies and rules, in the order of deployment
+        template = selfplay.setup_game(0, armies, board_size=board_size, rules=self.rules)
+        units = template.rules.units()
+        n_units = len(units)
+        n_weapons = max(len(unit.weapons) for unit in units)
+        self.n_units = n_units
+        self.max_turns = template.rules.max_turns
+        self.unit_player = np.array([unit.player for unit in units], dtype=np.int32)
+        self.quality = np.array([unit.quality for unit in units], dtype=np.int32)
+        self.defense = np.array([unit.defense for unit in units], dtype=np.int32)
+        self.movement = np.array([unit.movement for unit in units], dtype=np.float64)
+        self.movement_rush = np.array([unit.movement_rush for unit in units], dtype=np.float64)
+        self.max_wounds = np.array([unit.wounds for unit in units], dtype=np.int32)
+        self.n_weapons = n_weapons
+        self.weapon_range = np.zeros((n_units, n_weapons))
+        self.weapon_attacks = np.zeros((n_units, n_weapons), dtype=np.int32)
+        self.weapon_damage = np.zeros((n_units, n_weapons), dtype=np.int32)
+        for u, unit in enumerate(units):
+            for w, weapon in enumerate(unit.weapons):
+                self.weapon_range[u, w], self.weapon_attacks[u, w], self.weapon_damage[u, w] = weapon.range, weapon.attacks, weapon.damage
+        self.deployment = np.array([unit.position for unit in units], dtype=np.int32)
+
+        # Dynamic state of all boards
+        self.occupancy = np.full((n_envs,) + self.board_size, -1, dtype=np.int16)
+        self.position = np.zeros((n_envs, n_units, 2), dtype=np.int32)
+        self.wounds = np.zeros((n_envs, n_units), dtype=np.int32)
+        self.alive = np.zeros((n_envs, n_units), dtype=bool)
+        self.activated = np.zeros((n_envs, n_units), dtype=bool)
+        self.active_player = np.zeros(n_envs, dtype=np.int32)
+        self.game_turn = np.zeros(n_envs, dtype=np.int32)
+        self.envs = np.arange(n_envs)
+
+        self.reachable_cache = None # Key and result of the last call of reachable
+        self.observation = np.zeros((n_envs, 5) + self.board_size, dtype=np.float32)
+        self.reset()
+
+    def reset(self, envs: np.ndarray = None):
+        """
+        Resets the given boards, or all boards. Returns the observation.
+        """
+        envs = self.envs if envs is None else np.asarray(envs)
+        self.occupancy[envs] = -1
+        self.position[envs] = self.deployment
+        self.occupancy[envs[:, None], self.deployment[:, 0], self.deployment[:, 1]] = np.arange(self.n_units)
+        self.wounds[envs] = self.max_wounds
+        self.alive[envs] = True
+        self.activated[envs] = False
+        self.active_player[envs] = self.rng.choice(self.players, size=len(envs))
+        self.game_turn[envs] = 1
+        return self.observe()
+
+    def can_act(self) -> np.ndarray:
+        """
+        Returns a (K, units) mask of the units the active player can activate.
+        """
+        return self.alive & ~self.activated & (self.unit_player == self.active_player[:, None])
+
+    def distances(self, origins: np.ndarray) -> np.ndarray:
+        """
+        Returns the distances (K, units) from one origin per board to all units.
+        """
+        return np.linalg.norm(self.position - origins[:, None, :], axis=-1)
+
+    def enemies(self, unit: np.ndarray) -> np.ndarray:
+        """
+        Returns a (K, units) mask of the living enemies of one unit per board.
+        """
+        return self.alive & (self.unit_player != self.unit_player[unit][:, None])
+
+    def reachable(self, unit: np.ndarray, distance: np.ndarray) -> np.ndarray:
+        """
+        Returns a (K, rows, columns) mask of the squares the unit of every board can reach within the distance
+        of the board, including its own square. Follows Board.movement_costs on a board without terrain:
+        the moves go around the other units and do not cut their corners.
+
+        A move of a orthogonal and b diagonal steps costs a + b sqrt(2), so the squares reachable with
+        exactly (a, b) steps are those of (a - 1, b) and (a, b - 1) grown by one step. The boards are packed
+        into the bits of the last axis, which turns every step of all boards into a few byte-wise operations.
+        The result is cached until the boards change, e.g. between sample_actions and step, and must not be modified.
+        """
+        key = (unit, distance, self.occupancy)
+        if self.reachable_cache is not None and all(map(np.array_equal, key, self.reachable_cache[0])):
+            return self.reachable_cache[1]
+        k = self.envs
+        rows, columns = self.board_size
+        origin = self.position[k, unit]
+        passable = self.occupancy < 0
+        passable[k, origin[:, 0], origin[:, 1]] = True
+        open_padded = np.zeros((rows + 2, columns + 2, (self.n_envs + 7) // 8), dtype=np.uint8)
+        open_padded[1:-1, 1:-1] = np.packbits(passable.transpose(1, 2, 0), axis=2)
+
+        # Squares every step may enter, given as the offset of its origin
+        straight, diagonal = [], []
+        for dx, dy in NEIGHBOURS:
+            allowed = open_padded[1:-1, 1:-1]
+            if dx and dy:
+                allowed = allowed & open_padded[1 - dx:1 - dx + rows, 1:1 + columns] \
+                    & open_padded[1:1 + rows, 1 - dy:1 - dy + columns]
+            (diagonal if dx and dy else straight).append((1 - dx, 1 - dy, allowed))
+
+        def grow(squares: np.ndarray, steps: list, out: np.ndarray):
+            inner, moved = out[1:-1, 1:-1], np.empty_like(out[1:-1, 1:-1])
+            for x_offset, y_offset, allowed in steps:
+                np.bitwise_and(squares[x_offset:x_offset + rows, y_offset:y_offset + columns], allowed, out=moved)
+                np.bitwise_or(inner, moved, out=inner)
+
+        start = np.zeros((rows + 2, columns + 2, self.n_envs), dtype=bool)
+        start[origin[:, 0] + 1, origin[:, 1] + 1, k] = True
+        start = np.packbits(start, axis=2)
+        reached = start[1:-1, 1:-1].copy()
+        max_distance = distance.max(initial=0) + 1e-9
+        previous_row = [start] # Squares reached with (a, b - 1) steps, by a
+        for b in range(int(max_distance / np.sqrt(2)) + 1):
+            row = []
+            for a in range(int(max_distance - b * np.sqrt(2)) + 1):
+                if a == b == 0:
+                    row.append(start)
+                    continue
+                squares = np.zeros_like(start)
+                if a:
+                    grow(row[a - 1], straight, squares)
+                if b:
+                    grow(previous_row[a], diagonal, squares)
+                in_distance = np.packbits(distance + 1e-9 >= a + b * np.sqrt(2))
+                reached |= squares[1:-1, 1:-1] & in_distance
+                row.append(squares)
+            previous_row = row
+        result = np.unpackbits(reached, axis=2, count=self.n_envs).transpose(2, 0, 1).astype(bool)
+        result.flags.writeable = False
+        self.reachable_cache = (tuple(np.copy(value) for value in key), result)
+        return result
+
+    def move_options(self, unit: np.ndarray, kind: np.ndarray) -> np.ndarray:
+        """
+        Returns a (K, rows, columns) mask of the squares the unit of every board can move to with the kind
+        of action, as OPRUnit.get_fields_in_range, and for charges only the squares next to an enemy.
+        """
+        k = self.envs
+        rows, columns = self.board_size
+        distance = np.select([kind == 1, kind >= 2], [self.movement[unit], self.movement_rush[unit]], 0)
+        options = self.reachable(unit, distance).copy()
+        origin = self.position[k, unit]
+        options[k, origin[:, 0], origin[:, 1]] = False
+
+        # Charges end within 1.5 of an enemy
+        charging = k[kind == 3]
+        boards, units = np.nonzero(self.enemies(unit)[charging])
+        enemy_padded = np.zeros((len(charging), rows + 2, columns + 2), dtype=bool)
+        enemy_padded[boards, self.position[charging[boards], units, 0] + 1, self.position[charging[boards], units, 1] + 1] = True
+        near_enemy = np.zeros((len(charging), rows, columns), dtype=bool)
+        for dx, dy in NEIGHBOURS:
+            near_enemy |= enemy_padded[:, 1 + dx:1 + dx + rows, 1 + dy:1 + dy + columns]
+        options[charging] &= near_enemy
+        return options
+
+    def shooting_reach(self, unit: np.ndarray, origin: np.ndarray) -> np.ndarray:
+        """
+        Returns a (K, weapons, units) mask, which is True where a ranged weapon of the unit reaches an enemy from the origin.
+        """
+        distance = self.distances(origin)
+        weapon_range = self.weapon_range[unit]
+        return self.enemies(unit)[:, None, :] & (weapon_range[:, :, None] > 1) & (distance[:, None, :] <= weapon_range[:, :, None])
+
+    def charge_targets(self, unit: np.ndarray, square: np.ndarray) -> np.ndarray:
+        """
+        Returns a (K, units) mask of the enemies within 1.5 of the charge square.
+        """
+        return self.enemies(unit) & (self.distances(square) <= 1.5)
+
+    def step(self, actions: np.ndarray):
+        """
+        Applies one activation per board. actions is an integer array of shape (K, 4 + weapons).
+        Returns observation, reward, done and info. The reward is given from the view of player 1:
+        1 for a win, -1 for a loss, 0 for a draw or an unfinished game.
+        """
+        actions = np.asarray(actions)
+        assert actions.shape == (self.n_envs, 4 + self.n_weapons), f'Expected actions of shape {(self.n_envs, 4 + self.n_weapons)}'
+        k = self.envs
+        rows, columns = self.board_size
+        unit, kind, square, target = actions[:, 0], actions[:, 1], actions[:, 2:4].astype(np.int32), actions[:, 4:]
+        valid = (unit >= 0) & (unit < self.n_units) & (kind >= 0) & (kind <= 3) \
+            & ((target >= 0) & (target < self.n_units)).all(axis=1)
+        unit = np.where(valid, unit, 0)
+        kind = np.where(valid, kind, 0)
+        target = np.where(valid[:, None], target, 0)
+        valid &= self.can_act()[k, unit]
+        on_board = (square >= 0).all(axis=1) & (square[:, 0] < rows) & (square[:, 1] < columns)
+        square = np.clip(square, 0, np.array(self.board_size) - 1)
+
+        # Movement. Without any square to move to, the unit stays in place
+        origin = self.position[k, unit]
+        options = self.move_options(unit, kind)
+        has_options = options.any(axis=(1, 2))
+        moves = (kind > 0) & has_options
+        valid &= ~moves | (on_board & options[k, square[:, 0], square[:, 1]])
+        charges = (kind == 3) & has_options
+        valid &= ~charges | self.charge_targets(unit, square)[k, target[:, 0]]
+
+        # Shooting after the move. Every weapon that reaches an enemy must reach its target
+        shoots = (kind == 0) | (kind == 1)
+        reach = self.shooting_reach(unit, np.where(moves[:, None], square, origin))
+        fires = reach.any(axis=2)
+        on_target = np.take_along_axis(reach, target[:, :, None], axis=2)[:, :, 0]
+        valid &= ~shoots | (on_target | ~fires).all(axis=1)
+
+        v = k[valid]
+        m = k[valid & moves]
+        self.occupancy[m, origin[m, 0], origin[m, 1]] = -1
+        self.occupancy[m, square[m, 0], square[m, 1]] = unit[m]
+        self.position[m, unit[m]] = square[m]
+
+        # Attacks: Hold and Advance shoot, a charge fights in melee
+        usable = (valid & shoots)[:, None] & fires
+        melee = (valid & charges)[:, None] & (self.weapon_range[unit] <= 1) & (self.weapon_attacks[unit] > 0)
+        weapon_target = np.where(melee, target[:, :1], target)
+        self.resolve_attacks(unit, usable | melee, weapon_target)
+
+        # Activation alternation and turn ends
+        self.activated[v, unit[v]] = True
+        self.active_player[v] = self.active_player[v] % len(self.players) + 1
+        done = self.advance_turns()
+
+        reward = np.zeros(self.n_envs, dtype=np.float32)
+        winner = np.zeros(self.n_envs, dtype=np.int32)
+        if done.any():
+            remaining = np.stack([(self.alive & (self.unit_player == player)).sum(axis=1) for player in self.players], axis=1)
+            winner = np.where(done & (remaining[:, 0] > remaining[:, 1]), 1, np.where(done & (remaining[:, 1] > remaining[:, 0]), 2, 0))
+            reward = np.select([winner == 1, winner == 2], [1.0, -1.0], 0.0).astype(np.float32)
+            self.reset(k[done])
+        info = {'winner': winner, 'game_turn': self.game_turn, 'valid': valid}
+        return self.observe(), reward, done, info
+
+    def resolve_attacks(self, unit: np.ndarray, usable: np.ndarray, weapon_target: np.ndarray):
+        """
+        Rolls all attacks of the weapons of the acting units on all boards in one draw, and applies the wounds.
+        """
+        k = self.envs
+        attacks = np.where(usable, self.weapon_attacks[unit], 0)
+        if attacks.max(initial=0) == 0:
+            return
+        to_hit, to_block = self.rng.integers(1, 7, size=(2,) + attacks.shape + (attacks.max(),), dtype=np.int8)
+        rolled = np.arange(attacks.max()) < attacks[..., None]
+        unblocked = combat.roll_succeeds(to_hit, self.quality[unit][:, None, None]) \
+            & ~combat.roll_succeeds(to_block, self.defense[weapon_target][..., None]) & rolled
+        wounds = unblocked.sum(axis=2) * self.weapon_damage[unit]
+        np.subtract.at(self.wounds, (np.broadcast_to(k[:, None], wounds.shape), weapon_target), wounds)
+
+        killed = self.alive & (self.wounds <= 0)
+        if killed.any():
+            boards, units = np.nonzero(killed)
+            self.occupancy[boards, self.position[boards, units, 0], self.position[boards, units, 1]] = -1
+            self.alive[killed] = False
+
+    def advance_turns(self) -> np.ndarray:
+        """
+        Ends the turns in which all units are activated, and lets players without units to activate pass.
+        Returns the mask of the boards whose game is over.
+        """
+        turn_over = ~(self.alive & ~self.activated).any(axis=1)
+        wiped_out = np.stack([~(self.alive & (self.unit_player == player)).any(axis=1) for player in self.players], axis=1).any(axis=1)
+        # As in OPR_Firefight.game_sequence, the game is only checked for its end between turns
+        done = turn_over & ((self.game_turn >= self.max_turns) | wiped_out)
+        new_turn = turn_over & ~done
+        self.game_turn[new_turn] += 1
+        self.activated[new_turn] = False
+
+        passes = ~done & ~self.can_act().any(axis=1)
+        self.active_player[passes] = self.active_player[passes] % len(self.players) + 1
+        return done
+
+    def observe(self) -> np.ndarray:
+        """
+        Writes the planes occupied, units of the active player, enemy units, activated and wounds
+        into the preallocated observation of shape (K, 5, rows, columns).
+        """
+        self.observation[:] = 0
+        boards, units = np.nonzero(self.alive)
+        x, y = self.position[boards, units, 0], self.position[boards, units, 1]
+        own = self.unit_player[units] == self.active_player[boards]
+        self.observation[boards, 0, x, y] = 1
+        self.observation[boards, np.where(own, 1, 2), x, y] = 1
+        self.observation[boards, 3, x, y] = self.activated[boards, units]
+        self.observation[boards, 4, x, y] = self.wounds[boards, units]
+        return self.observation
+
+    def sample_actions(self, rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Returns random valid actions: a unit that can act, a kind of action, a square it can move to
+        with that kind, and targets its weapons can attack from there.
+        """
+        rng = rng or self.rng
+        k = self.envs
+        can_act = self.can_act()
+        unit = (rng.random(can_act.shape) * can_act).argmax(axis=1)
+        kind = rng.integers(0, 4, size=self.n_envs)
+        options = self.move_options(unit, kind).reshape(self.n_envs, -1)
+        square = np.column_stack(np.unravel_index((rng.random(options.shape) * options).argmax(axis=1), self.board_size))
+        square = np.where(options.any(axis=1)[:, None], square, self.position[k, unit])
+        reach = self.shooting_reach(unit, square)
+        shot = (rng.random(reach.shape) * reach).argmax(axis=2)
+        charge_targets = self.charge_targets(unit, square)
+        charged = (rng.random(charge_targets.shape) * charge_targets).argmax(axis=1)
+        target = np.where((kind == 3)[:, None], charged[:, None], shot)
+        return np.column_stack([unit, kind, square, target])
+
+    def to_game(self, board: int) -> engine.Game:
+        """
+        Returns a headless OPR_Firefight game in the state of a board. The units of the game are in the order of the units here.
+        """
+        game = selfplay.setup_game(0, self.armies, board_size=self.board_size, rules=self.rules)
+        units = game.rules.units()
+        for unit in units:
+            unit.remove(kill=False)
+        for u, unit in enumerate(units):
+            unit.wounds = int(self.wounds[board, u])
+            unit.activated = bool(self.activated[board, u])
+            if self.alive[board, u]:
+                unit.place(tuple(self.position[board, u].tolist()))
+            else:
+                game.dead_units[unit.id] = unit
+        game.rules.game_turn = int(self.game_turn[board])
+        game.active_player = int(self.active_player[board])
+        return game